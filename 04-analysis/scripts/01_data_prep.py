@@ -6,55 +6,98 @@ Loads and merges PFAS, demographic, and biomarker data
 
 import pandas as pd
 import numpy as np
+import argparse
 import os
 import sys
 from pathlib import Path
 
+from chunked import RunningMoments, SeqnStream, exact_quantiles
+from cohort_cache import (
+    has_partition,
+    iter_cohort,
+    load_manifest,
+    read_cohort,
+    remove_partition,
+    save_manifest,
+    write_partition,
+)
+from cohort import (
+    EXCLUSION_BIOMARKERS,
+    OUTLIER_VARS,
+    PFAS_COLUMNS,
+    apply_criteria,
+    build_cohort,
+    has_any_pfas,
+    is_adult,
+    label_codes,
+    memory_report,
+    min_available,
+    not_pregnant,
+)
+from nhanes_io import (
+    CYCLE_YEARS,
+    file_fingerprint,
+    iter_nhanes_chunks,
+    load_families,
+    load_family,
+    nhanes_path,
+)
+from outliers import (
+    GROUP_COLUMN,
+    fit_rules_chunked,
+    flag_report,
+    outlier_criteria,
+    outlier_flags,
+    outlier_mask,
+    outlier_rules,
+)
+from pipeline_log import PipelineLogger
+
 # Set paths
 DATA_DIR = Path("/data")
 STUDY_DIR = Path("/study")
 OUTPUT_DIR = STUDY_DIR / "04-analysis" / "outputs"
 LOG_FILE = OUTPUT_DIR / "analysis_log.txt"
 
+# Study cycles with PFAS measurements; each becomes one cohort partition
+PFAS_CYCLES = ["D", "E", "F", "G"]
+
+# Fixed categories, so cycle partitions concatenate as one categorical
+CYCLE_DTYPE = pd.CategoricalDtype(list(CYCLE_YEARS))
+
+# name -> (NHANES file family, cycles available)
+BIOMARKER_FILES = {
+    # Standard biochemistry
+    "biopro": ("BIOPRO", ["D", "F", "G", "H", "I", "J"]),
+    # CRP
+    "crp": ("CRP", ["D", "E", "F"]),
+    # CBC
+    "cbc": ("CBC", ["D", "E", "F", "G", "H", "I", "J"]),
+    # Glucose
+    "glucose": ("GLU", ["D", "E", "F", "G", "H", "I", "J"]),
+    # HbA1c
+    "hba1c": ("GHB", ["D", "E", "F", "G", "H", "I", "J"]),
+    # Albumin/Creatinine
+    "alb_cr": ("ALB_CR", ["D", "E", "F", "G", "H", "I", "J"]),
+}
+
 
-def log_message(msg):
-    """Log message to file"""
-    with open(LOG_FILE, "a") as f:
-        f.write(f"[01_data_prep] {msg}\n")
-    print(msg)
+log_message = PipelineLogger("01_data_prep", LOG_FILE)
 
 
-def load_pfas_data():
+def load_pfas_data(cycles=PFAS_CYCLES):
     """Load PFAS datasets from multiple cycles"""
     log_message("Loading PFAS datasets...")
 
-    pfas_files = {
-        "D": "PFC_D.csv",  # 2005-2006
-        "E": "PFC_E.csv",  # 2007-2008
-        "F": "PFC_F.csv",  # 2009-2010
-        "G": "PFC_G.csv",  # 2011-2012
-    }
+    pfas_all = load_family("PFC", cycles, DATA_DIR, log_message)
 
-    pfas_list = []
-    cycle_counts = {}
-
-    for cycle, filename in pfas_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["cycle"] = cycle
-            df["cycle_year"] = {
-                "D": "2005-2006",
-                "E": "2007-2008",
-                "F": "2009-2010",
-                "G": "2011-2012",
-            }[cycle]
-            pfas_list.append(df)
-            cycle_counts[cycle] = len(df)
-            log_message(f"  Cycle {cycle}: {len(df)} records")
-
-    if pfas_list:
-        pfas_all = pd.concat(pfas_list, ignore_index=True)
+    if pfas_all is not None:
+        pfas_all["cycle"] = pfas_all["cycle"].astype(CYCLE_DTYPE)
+        pfas_all["cycle_year"] = label_codes(pfas_all["cycle"], CYCLE_YEARS)
+        cycle_counts = pfas_all["cycle"].value_counts(sort=False)
+        cycle_counts = cycle_counts[cycle_counts > 0].to_dict()
+        for cycle, n in cycle_counts.items():
+            log_message(f"  Cycle {cycle}: {n} records")
         log_message(f"Total PFAS records: {len(pfas_all)}")
         return pfas_all, cycle_counts
     else:
@@ -62,9 +105,10 @@ def load_pfas_data():
         return None, {}
 
 
-def standardize_pfas_vars(df):
+def standardize_pfas_vars(df, verbose=True):
     """Standardize PFAS variable names across cycles"""
-    log_message("Standardizing PFAS variable names...")
+    if verbose:
+        log_message("Standardizing PFAS variable names...")
 
     # Map various naming conventions to standardized names
     var_mapping = {
@@ -103,43 +147,28 @@ def standardize_pfas_vars(df):
     # Ensure required columns exist
     required_cols = ["SEQN", "PFOA", "PFOS", "PFHxS", "PFNA"]
     for col in required_cols:
-        if col not in df.columns:
+        if col not in df.columns and verbose:
             log_message(f"  WARNING: Required column {col} not found")
 
     return df
 
 
-def load_demographics():
+def load_demographics(cycles=PFAS_CYCLES):
     """Load demographic data for all relevant cycles"""
     log_message("Loading demographic data...")
 
-    demo_files = {
-        "D": "DEMO_D.csv",
-        "E": "DEMO_E.csv",
-        "F": "DEMO_F.csv",
-        "G": "DEMO_G.csv",
-    }
-
-    demo_list = []
-
-    for cycle, filename in demo_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["cycle"] = cycle
-            demo_list.append(df)
-            log_message(f"  Cycle {cycle}: {len(df)} records")
+    demo_all = load_family("DEMO", cycles, DATA_DIR, log_message)
 
-    if demo_list:
-        demo_all = pd.concat(demo_list, ignore_index=True)
+    if demo_all is not None:
         log_message(f"Total demo records: {len(demo_all)}")
         return demo_all
     return None
 
 
-def standardize_demo_vars(df):
+def standardize_demo_vars(df, verbose=True):
     """Standardize demographic variables"""
-    log_message("Standardizing demographic variables...")
+    if verbose:
+        log_message("Standardizing demographic variables...")
 
     # Age
     if "RIDAGEYR" in df.columns:
@@ -147,7 +176,7 @@ def standardize_demo_vars(df):
 
     # Sex (1=Male, 2=Female)
     if "RIAGENDR" in df.columns:
-        df["sex"] = df["RIAGENDR"].map({1: "Male", 2: "Female"})
+        df["sex"] = label_codes(df["RIAGENDR"], {1: "Male", 2: "Female"})
 
     # Race/Ethnicity
     if "RIDRETH1" in df.columns:
@@ -158,7 +187,7 @@ def standardize_demo_vars(df):
             4: "Non-Hispanic Black",
             5: "Other Race",
         }
-        df["race_ethnicity"] = df["RIDRETH1"].map(race_map)
+        df["race_ethnicity"] = label_codes(df["RIDRETH1"], race_map)
 
     # Education
     if "DMDEDUC2" in df.columns:
@@ -169,7 +198,7 @@ def standardize_demo_vars(df):
             4: "Some college",
             5: "College graduate or above",
         }
-        df["education"] = df["DMDEDUC2"].map(edu_map)
+        df["education"] = label_codes(df["DMDEDUC2"], edu_map)
 
     # Income (PIR - Poverty Income Ratio)
     if "INDFMPIR" in df.columns:
@@ -177,7 +206,7 @@ def standardize_demo_vars(df):
 
     # Pregnancy status
     if "RIDEXPRG" in df.columns:
-        df["pregnant"] = df["RIDEXPRG"].map({1: "Yes", 2: "No", 3: "Unknown"})
+        df["pregnant"] = label_codes(df["RIDEXPRG"], {1: "Yes", 2: "No", 3: "Unknown"})
 
     # Survey weights
     for weight_col in ["WTMEC2YR", "WTMEC4YR", "SDMVPSU", "SDMVSTRA"]:
@@ -187,108 +216,49 @@ def standardize_demo_vars(df):
     return df
 
 
-def load_biomarkers():
+def load_biomarkers(cycles=PFAS_CYCLES):
     """Load biomarker data for PhenoAge calculation"""
     log_message("Loading biomarker data...")
 
-    biomarker_data = {}
-
-    # Standard biochemistry
-    biopro_files = {
-        "D": "BIOPRO_D.csv",
-        "F": "BIOPRO_F.csv",
-        "G": "BIOPRO_G.csv",
-        "H": "BIOPRO_H.csv",
-        "I": "BIOPRO_I.csv",
-        "J": "BIOPRO_J.csv",
-    }
-
-    # CRP
-    crp_files = {
-        "D": "CRP_D.csv",
-        "E": "CRP_E.csv",
-        "F": "CRP_F.csv",
-    }
-
-    # CBC
-    cbc_files = {
-        "D": "CBC_D.csv",
-        "E": "CBC_E.csv",
-        "F": "CBC_F.csv",
-        "G": "CBC_G.csv",
-        "H": "CBC_H.csv",
-        "I": "CBC_I.csv",
-        "J": "CBC_J.csv",
+    # Only cycles with PFAS participants can contribute to the cohort
+    files = {
+        name: (family, [c for c in available if c in cycles])
+        for name, (family, available) in BIOMARKER_FILES.items()
     }
 
-    # Glucose
-    glucose_files = {
-        "D": "GLU_D.csv",
-        "E": "GLU_E.csv",
-        "F": "GLU_F.csv",
-        "G": "GLU_G.csv",
-        "H": "GLU_H.csv",
-        "I": "GLU_I.csv",
-        "J": "GLU_J.csv",
-    }
+    # Read every family x cycle file concurrently
+    biomarker_data = load_families(files, DATA_DIR, log_message)
+    for name, df in biomarker_data.items():
+        log_message(f"  {name}: {len(df)} records")
 
-    # HbA1c
-    hba1c_files = {
-        "D": "GHB_D.csv",
-        "E": "GHB_E.csv",
-        "F": "GHB_F.csv",
-        "G": "GHB_G.csv",
-        "H": "GHB_H.csv",
-        "I": "GHB_I.csv",
-        "J": "GHB_J.csv",
-    }
+    return biomarker_data
 
-    # Albumin/Creatinine
-    alb_cr_files = {
-        "D": "ALB_CR_D.csv",
-        "E": "ALB_CR_E.csv",
-        "F": "ALB_CR_F.csv",
-        "G": "ALB_CR_G.csv",
-        "H": "ALB_CR_H.csv",
-        "I": "ALB_CR_I.csv",
-        "J": "ALB_CR_J.csv",
-    }
 
-    # Load each type
-    for name, file_dict in [
-        ("biopro", biopro_files),
-        ("crp", crp_files),
-        ("cbc", cbc_files),
-        ("glucose", glucose_files),
-        ("hba1c", hba1c_files),
-        ("alb_cr", alb_cr_files),
-    ]:
-        dfs = []
-        for cycle, filename in file_dict.items():
-            filepath = DATA_DIR / filename
-            if filepath.exists():
-                df = pd.read_csv(filepath)
-                df["cycle"] = cycle
-                dfs.append(df)
-
-        if dfs:
-            biomarker_data[name] = pd.concat(dfs, ignore_index=True)
-            log_message(f"  {name}: {len(biomarker_data[name])} records")
+# Exclusions on PFC/DEMO columns, evaluated before the biomarker joins.
+# Order matters only for the reported exclusion flow.
+COHORT_PREDICATES = [
+    ("after_pfas_missing", has_any_pfas),
+    ("after_age", is_adult),
+    ("after_pregnancy", not_pregnant),
+]
 
-    return biomarker_data
 
+def merge_all_data(pfas_df, demo_df, biomarker_data, verbose=True):
+    """
+    Merge all datasets on SEQN, excluding minors and pregnant participants
+    before the biomarker joins
 
-def merge_all_data(pfas_df, demo_df, biomarker_data):
-    """Merge all datasets on SEQN"""
-    log_message("Merging datasets...")
+    Participants without PFAS are kept in the merged cohort (scripts 02-07
+    read it from the cache), but are counted in the exclusion flow.
+    """
+    if verbose:
+        log_message("Merging datasets...")
 
-    # Start with PFAS data
-    merged = pfas_df.copy()
+    tables = {}
 
-    # Merge demographics
+    # Demographics
     if demo_df is not None:
         demo_cols = [
-            "SEQN",
             "age",
             "sex",
             "race_ethnicity",
@@ -298,144 +268,514 @@ def merge_all_data(pfas_df, demo_df, biomarker_data):
             "WTMEC2YR",
             "SDMVPSU",
             "SDMVSTRA",
+            # Raw codes, so downstream scripts can apply their own labels
+            "RIDAGEYR",
+            "RIAGENDR",
+            "RIDRETH1",
+            "DMDEDUC2",
+            "INDFMPIR",
+            "RIDEXPRG",
         ]
-        demo_cols = [c for c in demo_cols if c in demo_df.columns]
-        merged = merged.merge(demo_df[demo_cols], on="SEQN", how="left")
-        log_message(f"  After demo merge: {len(merged)} records")
-
-    # Merge biomarkers
+        tables["demo"] = (demo_df, [c for c in demo_cols if c in demo_df.columns])
+
+    # Biomarkers
+    biomarker_cols = {
+        # Albumin, Creatinine, ALP
+        "biopro": ["LBXSAT", "LBXSAL", "LBXSCR", "LBXSAPSI", "LBXSC3SI", "LBXSGL"],
+        "crp": ["LBXCRP", "LBDCRP"],
+        "cbc": ["LBXLYPCT", "LBXMCVSI", "LBXRBWSI", "LBXRDW", "LBXWBCSI"],
+        "glucose": ["LBXGLU", "LBDGLUSI"],
+        "hba1c": ["LBXGH"],
+        "alb_cr": ["URXUMA", "URXUMS", "URXUCR"],
+    }
     for name, df in biomarker_data.items():
-        if name == "biopro":
-            # Albumin, Creatinine, ALP
-            cols = ["SEQN"]
-            for col in ["LBXSAT", "LBXSAL", "LBXSCR", "LBXSAPSI", "LBXSC3SI"]:
-                if col in df.columns:
-                    cols.append(col)
-            if len(cols) > 1:
-                merged = merged.merge(df[cols], on="SEQN", how="left")
-
-        elif name == "crp":
-            cols = ["SEQN"]
-            for col in ["LBXCRP", "LBDCRP"]:
-                if col in df.columns:
-                    cols.append(col)
-            if len(cols) > 1:
-                merged = merged.merge(df[cols], on="SEQN", how="left")
-
-        elif name == "cbc":
-            cols = ["SEQN"]
-            for col in ["LBXLYPCT", "LBXMCVSI", "LBXRBWSI", "LBXWBCSI"]:
-                if col in df.columns:
-                    cols.append(col)
-            if len(cols) > 1:
-                merged = merged.merge(df[cols], on="SEQN", how="left")
-
-        elif name == "glucose":
-            cols = ["SEQN"]
-            for col in ["LBXGLU", "LBDGLUSI"]:
-                if col in df.columns:
-                    cols.append(col)
-            if len(cols) > 1:
-                merged = merged.merge(df[cols], on="SEQN", how="left")
-
-        elif name == "hba1c":
-            cols = ["SEQN"]
-            for col in ["LBXGH"]:
-                if col in df.columns:
-                    cols.append(col)
-            if len(cols) > 1:
-                merged = merged.merge(df[cols], on="SEQN", how="left")
-
-        elif name == "alb_cr":
-            cols = ["SEQN"]
-            for col in ["URXUMA", "URXUMS", "URXUCR"]:
-                if col in df.columns:
-                    cols.append(col)
-            if len(cols) > 1:
-                merged = merged.merge(df[cols], on="SEQN", how="left")
-
-    log_message(f"  Final merged dataset: {len(merged)} records")
-    return merged
-
-
-def apply_exclusions(df):
-    """Apply study exclusion criteria"""
-    log_message("Applying exclusion criteria...")
+        cols = [c for c in biomarker_cols.get(name, []) if c in df.columns]
+        if cols:
+            tables[name] = (df, cols)
+
+    # One SEQN lookup per table, one gather per output column
+    merged, exclusions = build_cohort(
+        pfas_df,
+        tables,
+        predicates=COHORT_PREDICATES,
+        screen=["demo"] if "demo" in tables else [],
+        keep=["after_age", "after_pregnancy"],
+    )
+    if verbose:
+        for name, (_, cols) in tables.items():
+            log_message(f"  Joined {name}: {len(cols)} columns")
+        log_message(f"  Final merged dataset: {len(merged)} records")
+    return merged, exclusions
 
-    initial_n = len(df)
-    exclusions = {"initial": initial_n}
 
-    # Exclusion 1: Missing PFAS data
-    pfas_cols = ["PFOA", "PFOS", "PFHxS", "PFNA"]
-    available_pfas = [c for c in pfas_cols if c in df.columns]
-    if available_pfas:
-        has_pfas = df[available_pfas].notna().any(axis=1)
-        df = df[has_pfas].copy()
-    exclusions["after_pfas_missing"] = len(df)
+def cycle_files(cycle):
+    """Raw files feeding one cycle's partition, keyed by file stem"""
+    families = ["PFC", "DEMO"] + [
+        family for family, cycles in BIOMARKER_FILES.values() if cycle in cycles
+    ]
+    return {
+        f"{family}_{cycle}": nhanes_path(family, cycle, DATA_DIR) for family in families
+    }
 
-    # Exclusion 2: Age < 18
-    if "age" in df.columns:
-        df = df[df["age"] >= 18].copy()
-    exclusions["after_age"] = len(df)
 
-    # Exclusion 3: Pregnant women
-    if "pregnant" in df.columns:
-        df = df[df["pregnant"] != "Yes"].copy()
-    exclusions["after_pregnancy"] = len(df)
+def fingerprint_cycles(manifest):
+    """Current fingerprints of every study cycle's files"""
+    fingerprints = {}
+    for cycle in PFAS_CYCLES:
+        previous = manifest["cycles"].get(cycle, {}).get("files", {})
+        fingerprints[cycle] = {
+            stem: file_fingerprint(path, previous.get(stem))
+            for stem, path in cycle_files(cycle).items()
+        }
+    return fingerprints
+
+
+def is_current(entry, fingerprints, cycle):
+    """Cycle already cached from files with identical content"""
+    if entry is None or not has_partition(cycle):
+        return False
+    cached = {stem: f and f["sha256"] for stem, f in entry["files"].items()}
+    current = {stem: f and f["sha256"] for stem, f in fingerprints.items()}
+    return cached == current
+
+
+def ingest_cycles(cycles, fingerprints, manifest):
+    """
+    Load, harmonize and merge the given cycles, replacing their partitions
+
+    Files are parsed only for these cycles, so the cost of a run is
+    proportional to the cycles that changed. Each cycle's merged rows,
+    exclusion flow and per-file row counts are recorded in the manifest.
+    """
+    with log_message.stage("load_files") as stage:
+        pfas_df, _ = load_pfas_data(cycles)
+        if pfas_df is None:
+            return
+        pfas_df = standardize_pfas_vars(pfas_df)
+
+        demo_df = load_demographics(cycles)
+        demo_df = standardize_demo_vars(demo_df)
+
+        biomarker_data = load_biomarkers(cycles)
+        stage["rows"] = len(pfas_df)
+
+    loaded = {"PFC": pfas_df, "DEMO": demo_df}
+    for name, df in biomarker_data.items():
+        loaded[BIOMARKER_FILES[name][0]] = df
+
+    def in_cycle(df, cycle):
+        return df[df["cycle"] == cycle]
+
+    for cycle in cycles:
+        cycle_pfas = in_cycle(pfas_df, cycle)
+        if cycle_pfas.empty:
+            remove_partition(cycle)
+            manifest["cycles"].pop(cycle, None)
+            continue
+
+        log_message(f"Cycle {cycle}:")
+        with log_message.stage(f"merge_cycle_{cycle}") as stage:
+            merged, flow = merge_all_data(
+                cycle_pfas,
+                in_cycle(demo_df, cycle) if demo_df is not None else None,
+                {name: in_cycle(df, cycle) for name, df in biomarker_data.items()},
+            )
+            write_partition(merged, cycle)
+            stage["rows"] = len(merged)
+
+        # Fingerprint plus parsed row count per file (None if absent)
+        files = {}
+        for stem, fingerprint in fingerprints[cycle].items():
+            family = stem[: -len(cycle) - 1]
+            if fingerprint is not None and family in loaded:
+                rows = int((loaded[family]["cycle"] == cycle).sum())
+                fingerprint = {**fingerprint, "rows": rows}
+            files[stem] = fingerprint
+        manifest["cycles"][cycle] = {
+            "files": files,
+            "rows": len(merged),
+            "exclusions": flow,
+        }
+
 
+def ingest_cycles_chunked(cycles, fingerprints, manifest, chunk_rows):
+    """
+    Out-of-core version of ingest_cycles
+
+    Each cycle's PFC file is streamed in chunks of `chunk_rows` records;
+    every other file is streamed alongside it in SEQN order, so a chunk is
+    joined only to the rows in its SEQN range. Exclusions and joins run per
+    chunk, each chunk is written as one part of the cycle's partition, and
+    the exclusion flow is summed over chunks. Memory is bounded by the
+    chunk size, not by the file sizes.
+    """
+    for cycle in cycles:
+        base = iter_nhanes_chunks("PFC", cycle, DATA_DIR, chunk_rows)
+        if base is None:
+            remove_partition(cycle)
+            manifest["cycles"].pop(cycle, None)
+            continue
+
+        log_message(f"Cycle {cycle}: streaming in chunks of {chunk_rows} rows")
+        families = {"demo": "DEMO"}
+        families.update(
+            {
+                name: family
+                for name, (family, available) in BIOMARKER_FILES.items()
+                if cycle in available
+            }
+        )
+        streams = {}
+        for name, family in families.items():
+            chunks = iter_nhanes_chunks(family, cycle, DATA_DIR, chunk_rows)
+            if chunks is not None:
+                streams[name] = SeqnStream(f"{family}_{cycle}", chunks)
+
+        with log_message.stage(f"ingest_cycle_{cycle}") as stage:
+            base = SeqnStream(f"PFC_{cycle}", base)
+            flow = {}
+            rows = 0
+            part = 0
+            for pfas_chunk in base:
+                if pfas_chunk.empty:
+                    continue
+                pfas_chunk["cycle"] = pd.Series(cycle, pfas_chunk.index, CYCLE_DTYPE)
+                pfas_chunk["cycle_year"] = label_codes(pfas_chunk["cycle"], CYCLE_YEARS)
+                pfas_chunk = standardize_pfas_vars(pfas_chunk, verbose=False)
+
+                # Side rows in this chunk's SEQN range
+                last = pfas_chunk["SEQN"].iloc[-1]
+                side = {name: s.take_through(last) for name, s in streams.items()}
+                demo_chunk = side.pop("demo", None)
+                if demo_chunk is not None:
+                    demo_chunk = standardize_demo_vars(demo_chunk.copy(), verbose=False)
+
+                merged, chunk_flow = merge_all_data(
+                    pfas_chunk, demo_chunk, side, verbose=False
+                )
+                for step, n in chunk_flow.items():
+                    flow[step] = flow.get(step, 0) + n
+                if len(merged) or part == 0:
+                    write_partition(merged, cycle, part=part)
+                    part += 1
+                rows += len(merged)
+            stage["rows"] = rows
+
+        if part == 0:
+            remove_partition(cycle)
+            manifest["cycles"].pop(cycle, None)
+            continue
+        log_message(f"  {rows} merged records in {part} part(s)")
+
+        # Fingerprint plus row count per file (None if absent)
+        totals = {"PFC": base.rows}
+        for name, s in streams.items():
+            totals[families[name]] = s.drain()
+        files = {}
+        for stem, fingerprint in fingerprints[cycle].items():
+            family = stem[: -len(cycle) - 1]
+            if fingerprint is not None and family in totals:
+                fingerprint = {**fingerprint, "rows": totals[family]}
+            files[stem] = fingerprint
+        manifest["cycles"][cycle] = {"files": files, "rows": rows, "exclusions": flow}
+
+
+def build_cohort_cache(incremental=False, chunk_rows=None):
+    """
+    Bring the per-cycle cohort cache up to date with the raw files
+
+    A full run re-ingests every cycle; with `chunk_rows` the files are
+    streamed out of core (see ingest_cycles_chunked). An incremental run checks each
+    cycle's files against the manifest (size/mtime first, then SHA-256)
+    and re-ingests only cycles that are new or whose files changed.
+    Returns the exclusion flow summed over all cached cycles.
+    """
+    manifest = load_manifest()
+    fingerprints = fingerprint_cycles(manifest)
+
+    if incremental:
+        stale = [
+            c
+            for c in PFAS_CYCLES
+            if not is_current(manifest["cycles"].get(c), fingerprints[c], c)
+        ]
+        log_message(f"Incremental run: {len(stale)} cycle(s) to ingest {stale}")
+    else:
+        stale = list(PFAS_CYCLES)
+
+    # Cycles dropped from the study no longer contribute
+    for cycle in list(manifest["cycles"]):
+        if cycle not in PFAS_CYCLES:
+            remove_partition(cycle)
+            del manifest["cycles"][cycle]
+
+    if stale and chunk_rows:
+        ingest_cycles_chunked(stale, fingerprints, manifest, chunk_rows)
+    elif stale:
+        ingest_cycles(stale, fingerprints, manifest)
+    save_manifest(manifest)
+
+    exclusions = {}
+    for cycle in PFAS_CYCLES:
+        entry = manifest["cycles"].get(cycle)
+        if entry is None:
+            continue
+        for stage, n in entry["exclusions"].items():
+            exclusions[stage] = exclusions.get(stage, 0) + n
+    return exclusions
+
+
+# Exclusions 1 and 4, in order, for cohort.apply_criteria (2 and 3 are
+# applied before the joins; 5 follows, see outliers.outlier_criteria):
+# (criterion, exclusion flow stage, mask)
+EXCLUSION_CRITERIA = [
+    # Exclusion 1: Missing PFAS data (counted in merge_all_data)
+    ("pfas_missing", None, lambda df, passed: has_any_pfas(df)),
     # Exclusion 4: Missing key biomarkers (need at least 7 of 9 for PhenoAge)
-    biomarker_cols = [
-        "LBXSAT",
-        "LBXSAL",
-        "LBXSCR",
-        "LBXGLU",
-        "LBXGH",
-        "LBXCRP",
-        "LBXLYPCT",
-        "LBXMCVSI",
-        "LBXRBWSI",
-        "LBXSAPSI",
-        "LBXWBCSI",
-    ]
-    available_bio = [c for c in biomarker_cols if c in df.columns]
-    if len(available_bio) >= 7:
-        df["bio_count"] = df[available_bio].notna().sum(axis=1)
-        df = df[df["bio_count"] >= 7].copy()
-        df = df.drop("bio_count", axis=1)
-    exclusions["after_biomarkers"] = len(df)
-
-    # Exclusion 5: Extreme outliers (|z| > 4)
-    continuous_vars = ["age", "PFOA", "PFOS", "PFHxS", "PFNA"]
-    for var in continuous_vars:
-        if var in df.columns:
-            mean_val = df[var].mean()
-            std_val = df[var].std()
-            if std_val > 0:
-                z_scores = np.abs((df[var] - mean_val) / std_val)
-                df = df[z_scores <= 4].copy()
-    exclusions["after_outliers"] = len(df)
+    ("biomarkers_missing", "after_biomarkers", min_available(EXCLUSION_BIOMARKERS, 7)),
+]
+
+# Columns analytic_mask looks at (the cycle for per-cycle outlier rules)
+MASK_COLUMNS = PFAS_COLUMNS + EXCLUSION_BIOMARKERS + OUTLIER_VARS + [GROUP_COLUMN]
+
+
+def apply_exclusions(df, exclusions):
+    """
+    Apply study exclusion criteria
+
+    The PFAS, age and pregnancy exclusions were counted in merge_all_data,
+    which already dropped minors and pregnant participants; participants
+    without PFAS are still in the merged rows and are dropped here. The
+    criteria are evaluated as masks on the merged rows (see
+    cohort.apply_criteria) and the analytic sample is copied out once.
+    """
+    log_message("Applying exclusion criteria...")
+
+    # Exclusion 5: Extreme outliers (|z| > 4 per variable in turn, or the
+    # rules set in PFAS_OUTLIER_RULE)
+    criteria = EXCLUSION_CRITERIA + outlier_criteria(OUTLIER_VARS, outlier_rules())
+    mask, exclusions, report = apply_criteria(df, criteria, exclusions)
+    df = df[mask].copy()
 
     log_message(f"  Exclusions applied:")
     for key, val in exclusions.items():
         log_message(f"    {key}: {val}")
+    log_criteria_report(report)
+    screen = criteria[-1][2]
+    if hasattr(screen, "report"):
+        log_outlier_report(screen.report)
 
     return df, exclusions
 
 
+def log_criteria_report(report):
+    """Log and save the rows each exclusion criterion removes"""
+    for r in report.itertuples():
+        log_message(
+            f"    {r.criterion}: removes {r.removed_alone} on its own, "
+            f"{r.removed_in_sequence} after the criteria before it"
+        )
+    report.to_csv(OUTPUT_DIR / "tables" / "exclusion_criteria.csv", index=False)
+
+
+def log_outlier_report(report):
+    """Log and save the rows each outlier rule flagged (see outliers.flag_report)"""
+    for r in report[report["variable"] == "any"].itertuples():
+        log_message(
+            f"    {r.rule}: flags {r.flagged} rows, {r.only_this_rule} by this rule "
+            "alone"
+        )
+    report.to_csv(OUTPUT_DIR / "tables" / "outlier_flags.csv", index=False)
+
+
+def analytic_mask(df, thresholds=()):
+    """
+    Exclusions 1, 4 and 5 as a row mask on one chunk of the merged cohort
+
+    `thresholds` lists (variable, mean, std) for the sequential outlier
+    screens that apply, or is a fitted outliers model; chunks must carry
+    the full cohort column set (see iter_cohort) so the biomarker rule
+    sees the same columns as apply_exclusions.
+    """
+    mask = has_any_pfas(df)
+    available_bio = [c for c in EXCLUSION_BIOMARKERS if c in df.columns]
+    if len(available_bio) >= 7:
+        mask = mask & (df[available_bio].notna().sum(axis=1).to_numpy() >= 7)
+    if isinstance(thresholds, dict):
+        return mask & outlier_mask(df, thresholds)
+    for var, mean_val, std_val in thresholds:
+        z_scores = np.abs((df[var] - mean_val) / std_val)
+        mask = mask & (z_scores <= 4).to_numpy()
+    return mask
+
+
+def zscore_threshold(var, moments, dtype):
+    """(var, mean, SD) of a |z| > 4 screen from running moments, or None"""
+    if dtype is None:
+        return None
+    # Same precision as Series.mean()/std() on the in-memory column
+    mean_val = dtype.type(moments.mean)
+    std_val = dtype.type(moments.std())
+    if not std_val > 0:
+        return None
+    return var, mean_val, std_val
+
+
+def zscore_kept(threshold):
+    """Chunk mask of one |z| > 4 screen (all kept if `threshold` is None)"""
+
+    def kept(chunk):
+        if threshold is None:
+            return np.ones(len(chunk), dtype=bool)
+        var, mean_val, std_val = threshold
+        return (np.abs((chunk[var] - mean_val) / std_val) <= 4).to_numpy()
+
+    return kept
+
+
+def criteria_report_chunked(screens, chunk_rows):
+    """
+    Out-of-core report of apply_criteria, for log_criteria_report
+
+    `screens` lists the outlier criteria following EXCLUSION_CRITERIA as
+    (criterion, kept, kept_alone): chunk masks with the thresholds of
+    the exclusion flow and with those fitted on the whole cohort. One
+    pass counts every criterion's rows removed on its own and in sequence.
+    """
+
+    def row_level(criterion):
+        return lambda chunk: criterion(chunk, None)
+
+    criteria = [
+        (name, stage, row_level(criterion), row_level(criterion))
+        for name, stage, criterion in EXCLUSION_CRITERIA
+    ]
+    criteria += [(name, "after_outliers", kept, alone) for name, kept, alone in screens]
+
+    total = 0
+    removed_alone = np.zeros(len(criteria), dtype=np.int64)
+    remaining = np.zeros(len(criteria), dtype=np.int64)
+    for chunk in iter_cohort(MASK_COLUMNS, chunk_rows):
+        total += len(chunk)
+        passed = np.ones(len(chunk), dtype=bool)
+        for j, (_, _, kept, kept_alone) in enumerate(criteria):
+            removed_alone[j] += len(chunk) - np.count_nonzero(kept_alone(chunk))
+            passed = passed & kept(chunk)
+            remaining[j] += np.count_nonzero(passed)
+
+    return pd.DataFrame(
+        {
+            "criterion": [c[0] for c in criteria],
+            "stage": [c[1] for c in criteria],
+            "removed_alone": removed_alone,
+            "removed_in_sequence": np.r_[total, remaining[:-1]] - remaining,
+            "remaining": remaining,
+        }
+    )
+
+
+def apply_exclusions_chunked(exclusions, chunk_rows):
+    """
+    Out-of-core version of apply_exclusions
+
+    The PFAS and biomarker exclusions are row-level. Each outlier screen
+    needs the mean and SD of its variable over the rows left by the
+    previous screens, so every screen costs one pass over the cached cohort
+    accumulating running moments. Order-independent rules (see
+    PFAS_OUTLIER_RULE) are fitted from one pass instead, plus a few for
+    exact robust quantiles. One more pass counts the rows each criterion
+    removes for exclusion_criteria.csv, as apply_exclusions reports them.
+    Returns (exclusions, thresholds); the final count comes from the
+    summary pass.
+    """
+    log_message("Applying exclusion criteria (chunked)...")
+
+    exclusions = dict(exclusions)
+    rules = outlier_rules()
+    if rules is not None:
+        return apply_outlier_rules_chunked(exclusions, rules, chunk_rows)
+
+    thresholds = []
+    screens = []
+    overall = {var: RunningMoments() for var in OUTLIER_VARS}
+    dtypes = {}
+    for i, var in enumerate(OUTLIER_VARS):
+        n_kept = 0
+        moments = RunningMoments()
+        for chunk in iter_cohort(MASK_COLUMNS, chunk_rows):
+            if i == 0:
+                # Whole-cohort moments, for each screen's count on its own
+                for col in overall:
+                    if col in chunk.columns:
+                        overall[col].update(chunk[col])
+                        dtypes[col] = chunk[col].dtype
+            kept = chunk[analytic_mask(chunk, thresholds)]
+            n_kept += len(kept)
+            if var in kept.columns:
+                moments.update(kept[var])
+        if i == 0:
+            exclusions["after_biomarkers"] = n_kept
+        threshold = zscore_threshold(var, moments, dtypes.get(var))
+        if threshold is not None:
+            thresholds.append(threshold)
+        alone = zscore_threshold(var, overall[var], dtypes.get(var))
+        screens.append((f"outlier_{var}", zscore_kept(threshold), zscore_kept(alone)))
+
+    log_criteria_report(criteria_report_chunked(screens, chunk_rows))
+    return exclusions, thresholds
+
+
+def apply_outlier_rules_chunked(exclusions, rules, chunk_rows):
+    """apply_exclusions_chunked with order-independent outlier rules"""
+
+    def passes():
+        for chunk in iter_cohort(MASK_COLUMNS, chunk_rows):
+            yield chunk[analytic_mask(chunk)]
+
+    exclusions["after_biomarkers"] = sum(len(chunk) for chunk in passes())
+    model = fit_rules_chunked(passes, OUTLIER_VARS, rules, max_buffer=chunk_rows)
+
+    report = None
+    for chunk in passes():
+        flags = outlier_flags(chunk, model)
+        counts = flag_report(flags, model["columns"])
+        if report is None:
+            report = counts
+        else:
+            report[["flagged", "only_this_rule"]] += counts[
+                ["flagged", "only_this_rule"]
+            ]
+    if report is not None:
+        log_outlier_report(report)
+
+    # On its own, the screen is fitted on the whole cohort
+    def everyone():
+        return iter_cohort(MASK_COLUMNS, chunk_rows)
+
+    alone = fit_rules_chunked(everyone, OUTLIER_VARS, rules, max_buffer=chunk_rows)
+    screen = (
+        f"outliers_{'+'.join(rules)}",
+        lambda chunk: outlier_mask(chunk, model),
+        lambda chunk: outlier_mask(chunk, alone),
+    )
+    log_criteria_report(criteria_report_chunked([screen], chunk_rows))
+    return exclusions, model
+
+
 def save_summary_stats(df, exclusions):
     """Save summary statistics (aggregated only)"""
     log_message("Generating summary statistics...")
 
     # Sample size by cycle
     if "cycle_year" in df.columns:
-        cycle_counts = df["cycle_year"].value_counts().to_dict()
-        log_message(f"  Sample by cycle: {cycle_counts}")
+        cycle_counts = df["cycle_year"].value_counts()
+        log_message(f"  Sample by cycle: {cycle_counts[cycle_counts > 0].to_dict()}")
 
     # PFAS summary
     pfas_cols = ["PFOA", "PFOS", "PFHxS", "PFNA"]
     available_pfas = [c for c in pfas_cols if c in df.columns]
     if available_pfas:
-        pfas_summary = df[available_pfas].describe()
+        pfas_summary = df[available_pfas].astype("float64").describe()
         pfas_summary.to_csv(OUTPUT_DIR / "tables" / "pfas_summary_raw.csv")
         log_message(f"  PFAS summary saved")
 
@@ -462,44 +802,172 @@ def save_summary_stats(df, exclusions):
     return len(df)
 
 
-def main():
-    log_message("=" * 60)
-    log_message("PFAS-PhenoAge Study: Data Preparation")
-    log_message("=" * 60)
-
-    # Load data
-    pfas_df, cycle_counts = load_pfas_data()
-    if pfas_df is None:
-        log_message("FATAL: Could not load PFAS data")
-        sys.exit(1)
-
-    # Standardize PFAS
-    pfas_df = standardize_pfas_vars(pfas_df)
+def save_summary_stats_chunked(exclusions, thresholds, chunk_rows):
+    """
+    Out-of-core version of save_summary_stats
 
-    # Load demographics
-    demo_df = load_demographics()
-    demo_df = standardize_demo_vars(demo_df)
+    One pass accumulates the final count, per-cycle counts, column
+    non-null counts and PFAS moments; the PFAS quartiles take a few more
+    passes (see exact_quantiles). Writes the same tables, all statistics
+    in float64 as in save_summary_stats; the running mean and SD may
+    differ from describe()'s in the last bits. Returns (final N, column
+    info).
+    """
+    log_message("Generating summary statistics (chunked)...")
 
-    # Load biomarkers
-    biomarker_data = load_biomarkers()
+    n = 0
+    cycle_counts = {}
+    non_null = {}
+    dtypes = {}
+    moments = {c: RunningMoments() for c in PFAS_COLUMNS}
+    for chunk in iter_cohort(chunk_rows=chunk_rows):
+        kept = chunk[analytic_mask(chunk, thresholds)]
+        n += len(kept)
+        for col, count in kept.count().items():
+            non_null[col] = non_null.get(col, 0) + int(count)
+            dtypes.setdefault(col, kept[col].dtype)
+        if "cycle_year" in kept.columns:
+            for year, count in kept["cycle_year"].value_counts(sort=False).items():
+                cycle_counts[year] = cycle_counts.get(year, 0) + count
+        for col, m in moments.items():
+            if col in kept.columns:
+                m.update(kept[col])
+    exclusions["after_outliers"] = n
+
+    log_message("  Exclusions applied:")
+    for key, val in exclusions.items():
+        log_message(f"    {key}: {val}")
 
-    # Merge all
-    merged_df = merge_all_data(pfas_df, demo_df, biomarker_data)
+    # Sample size by cycle
+    if "cycle_year" in dtypes:
+        cycle_counts = pd.Series(cycle_counts, dtype="int64")
+        cycle_counts = cycle_counts[cycle_counts > 0].sort_values(
+            ascending=False, kind="stable"
+        )
+        log_message(f"  Sample by cycle: {cycle_counts.to_dict()}")
+
+    # PFAS summary, matching DataFrame.describe()
+    available_pfas = [c for c in PFAS_COLUMNS if c in dtypes]
+    if available_pfas:
+        quartiles = [0.25, 0.5, 0.75]
+        summary = {}
+        for col in available_pfas:
+
+            def passes(col=col):
+                for chunk in iter_cohort(MASK_COLUMNS, chunk_rows):
+                    yield chunk.loc[analytic_mask(chunk, thresholds), col].to_numpy()
+
+            m = moments[col]
+            q = exact_quantiles(passes, quartiles, m, max_buffer=chunk_rows)
+            summary[col] = [
+                m.n,
+                m.mean,
+                m.std(),
+                m.min,
+                q[0.25],
+                q[0.5],
+                q[0.75],
+                m.max,
+            ]
+        pfas_summary = pd.DataFrame(
+            summary,
+            index=["count", "mean", "std", "min", "25%", "50%", "75%", "max"],
+            dtype="float64",
+        )
+        pfas_summary.to_csv(OUTPUT_DIR / "tables" / "pfas_summary_raw.csv")
+        log_message(f"  PFAS summary saved")
 
-    # Apply exclusions
-    analytic_df, exclusions = apply_exclusions(merged_df)
+    log_message(f"  Final analytic sample: {n}")
 
-    # Save summary
-    final_n = save_summary_stats(analytic_df, exclusions)
+    # Save exclusions
+    exclusion_df = pd.DataFrame(list(exclusions.items()), columns=["stage", "count"])
+    exclusion_df.to_csv(OUTPUT_DIR / "tables" / "exclusion_flow.csv", index=False)
 
-    # Save analytic dataset columns info (not the actual data for privacy)
     col_info = pd.DataFrame(
         {
-            "column": analytic_df.columns,
-            "dtype": analytic_df.dtypes.values,
-            "non_null": analytic_df.count().values,
+            "column": list(dtypes),
+            "dtype": list(dtypes.values()),
+            "non_null": [non_null[c] for c in dtypes],
         }
     )
+    return n, col_info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PFAS-PhenoAge data preparation")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only re-ingest cycles whose files are new or changed",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=None,
+        help="stream files and the cached cohort in chunks of this many rows "
+        "(out-of-core mode; peak memory scales with the chunk size)",
+    )
+    args = parser.parse_args()
+
+    log_message("=" * 60)
+    log_message("PFAS-PhenoAge Study: Data Preparation")
+    log_message("=" * 60)
+
+    # Load, merge and cache each cycle so scripts 02-07 don't re-read the
+    # raw files
+    with log_message.stage("build_cohort_cache") as stage:
+        exclusions = build_cohort_cache(
+            incremental=args.incremental, chunk_rows=args.chunk_rows
+        )
+        stage["rows"] = exclusions.get("after_pregnancy")
+    if not exclusions:
+        log_message("FATAL: Could not load PFAS data")
+        sys.exit(1)
+
+    if args.chunk_rows:
+        with log_message.stage("exclusions") as stage:
+            exclusions, thresholds = apply_exclusions_chunked(
+                exclusions, args.chunk_rows
+            )
+            stage["rows"] = exclusions["after_biomarkers"]
+        with log_message.stage("summary") as stage:
+            final_n, col_info = save_summary_stats_chunked(
+                exclusions, thresholds, args.chunk_rows
+            )
+            stage["rows"] = final_n
+    else:
+        with log_message.stage("read_cohort") as stage:
+            merged_df = read_cohort()
+            stage["rows"] = len(merged_df)
+        log_message(f"Merged cohort: {len(merged_df)} records")
+
+        # Apply exclusions
+        with log_message.stage("exclusions") as stage:
+            analytic_df, exclusions = apply_exclusions(merged_df, exclusions)
+            stage["rows"] = len(analytic_df)
+
+        # Save summary
+        with log_message.stage("summary") as stage:
+            final_n = save_summary_stats(analytic_df, exclusions)
+            stage["rows"] = final_n
+
+        # Compact dtypes vs float64/object layout (aggregate only)
+        memory = memory_report(analytic_df)
+        memory.to_csv(OUTPUT_DIR / "tables" / "memory_report.csv", index=False)
+        log_message(
+            f"  Analytic cohort memory: {memory['bytes'].sum() / 1e6:.2f} MB "
+            f"(float64/object layout: {memory['wide_bytes'].sum() / 1e6:.2f} MB)"
+        )
+
+        col_info = pd.DataFrame(
+            {
+                "column": analytic_df.columns,
+                "dtype": analytic_df.dtypes.values,
+                "non_null": analytic_df.count().values,
+            }
+        )
+
+    # Save analytic dataset columns info (not the actual data for privacy)
     col_info.to_csv(OUTPUT_DIR / "analytic_columns.csv", index=False)
 
     log_message(f"Data preparation complete. Final N: {final_n}")
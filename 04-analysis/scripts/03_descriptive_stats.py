@@ -8,216 +8,88 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+from biomarkers import add_biomarkers
+from cohort import label_codes
+from cohort_cache import read_cohort
+from imputation import add_imputed
+from phenoage import (
+    COMPONENTS,
+    clipping_report,
+    component_matrix,
+    format_clipping_report,
+    score,
+)
+from pipeline_log import PipelineLogger
+
 DATA_DIR = Path("/data")
 STUDY_DIR = Path("/study")
 OUTPUT_DIR = STUDY_DIR / "04-analysis" / "outputs"
 LOG_FILE = OUTPUT_DIR / "analysis_log.txt"
 
 
-def log_message(msg):
-    with open(LOG_FILE, "a") as f:
-        f.write(f"[03_descriptive_stats] {msg}\n")
-    print(msg)
+log_message = PipelineLogger("03_descriptive_stats", LOG_FILE)
 
 
 def load_and_calculate_phenoage():
     """Load data and calculate PhenoAge"""
-    # PFAS
-    pfas_files = {
-        "D": "PFC_D.csv",
-        "E": "PFC_E.csv",
-        "F": "PFC_F.csv",
-        "G": "PFC_G.csv",
-    }
-    pfas_list = []
-    for cycle, filename in pfas_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["cycle"] = cycle
-            for old, new in [
-                ("LBXPFOA", "PFOA"),
-                ("LBXPFOS", "PFOS"),
-                ("LBXPFHS", "PFHxS"),
-                ("LBXPFNA", "PFNA"),
-            ]:
-                if old in df.columns:
-                    df[new] = df[old]
-            pfas_list.append(df[["SEQN", "cycle", "PFOA", "PFOS", "PFHxS", "PFNA"]])
-    pfas_df = pd.concat(pfas_list, ignore_index=True)
-
-    # Demographics
-    demo_files = {
-        "D": "DEMO_D.csv",
-        "E": "DEMO_E.csv",
-        "F": "DEMO_F.csv",
-        "G": "DEMO_G.csv",
-    }
-    demo_list = []
-    for cycle, filename in demo_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["age"] = df["RIDAGEYR"]
-            df["sex"] = df["RIAGENDR"].map({1: "Male", 2: "Female"})
-            df["race_ethnicity"] = df["RIDRETH1"].map(
-                {
-                    1: "Mexican American",
-                    2: "Other Hispanic",
-                    3: "Non-Hispanic White",
-                    4: "Non-Hispanic Black",
-                    5: "Other",
-                }
-            )
-            df["education"] = df["DMDEDUC2"].map(
-                {1: "<HS", 2: "<HS", 3: "HS grad", 4: "Some college", 5: "College+"}
-            )
-            df["pir"] = df["INDFMPIR"]
-            demo_list.append(
-                df[
-                    [
-                        "SEQN",
-                        "age",
-                        "sex",
-                        "race_ethnicity",
-                        "education",
-                        "pir",
-                        "RIDEXPRG",
-                    ]
-                ]
-            )
-    demo_df = pd.concat(demo_list, ignore_index=True)
-
-    # Biomarkers
-    biopro_files = {"D": "BIOPRO_D.csv", "F": "BIOPRO_F.csv", "G": "BIOPRO_G.csv"}
-    biopro_list = []
-    for cycle, filename in biopro_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            biopro_list.append(df)
-    biopro_df = pd.concat(biopro_list, ignore_index=True)
-
-    crp_files = {"D": "CRP_D.csv", "E": "CRP_E.csv", "F": "CRP_F.csv"}
-    crp_list = []
-    for cycle, filename in crp_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            crp_list.append(df)
-    crp_df = pd.concat(crp_list, ignore_index=True)
-
-    cbc_files = {"D": "CBC_D.csv", "E": "CBC_E.csv", "F": "CBC_F.csv", "G": "CBC_G.csv"}
-    cbc_list = []
-    for cycle, filename in cbc_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            cbc_list.append(df)
-    cbc_df = pd.concat(cbc_list, ignore_index=True)
-
-    glucose_files = {
-        "D": "GLU_D.csv",
-        "E": "GLU_E.csv",
-        "F": "GLU_F.csv",
-        "G": "GLU_G.csv",
-    }
-    glucose_list = []
-    for cycle, filename in glucose_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            glucose_list.append(df)
-    glucose_df = pd.concat(glucose_list, ignore_index=True)
-
-    # Merge
-    merged = pfas_df.merge(demo_df, on="SEQN", how="inner")
-    merged = merged[merged["age"] >= 18]
-    merged = merged[merged["RIDEXPRG"] != 1]
-
-    bio_cols = ["SEQN"]
-    for col in ["LBXSAT", "LBXSAL", "LBXSCR", "LBXSAPSI"]:
-        if col in biopro_df.columns:
-            bio_cols.append(col)
-    merged = merged.merge(biopro_df[bio_cols], on="SEQN", how="left")
-
-    if "LBXCRP" in crp_df.columns:
-        merged = merged.merge(crp_df[["SEQN", "LBXCRP"]], on="SEQN", how="left")
-
-    cbc_cols = ["SEQN"]
-    for col in ["LBXLYPCT", "LBXMCVSI", "LBXRBWSI", "LBXWBCSI"]:
-        if col in cbc_df.columns:
-            cbc_cols.append(col)
-    merged = merged.merge(cbc_df[cbc_cols], on="SEQN", how="left")
-
-    if "LBXGLU" in glucose_df.columns:
-        merged = merged.merge(glucose_df[["SEQN", "LBXGLU"]], on="SEQN", how="left")
-
-    # Calculate PhenoAge components
-    merged["albumin"] = (
-        merged["LBXSAT"] * 10
-        if "LBXSAT" in merged.columns
-        else merged.get("LBXSAL", np.nan) * 10
-    )
-    merged["creatinine"] = (
-        merged["LBXSCR"] * 88.4 if "LBXSCR" in merged.columns else np.nan
+    # Cohort merged once by 01_data_prep
+    merged = read_cohort(
+        columns=[
+            "SEQN",
+            "cycle",
+            "PFOA",
+            "PFOS",
+            "PFHxS",
+            "PFNA",
+            "age",
+            "RIAGENDR",
+            "RIDRETH1",
+            "DMDEDUC2",
+            "INDFMPIR",
+            "RIDEXPRG",
+            "LBXSAT",
+            "LBXSAL",
+            "LBXSCR",
+            "LBXSAPSI",
+            "LBXCRP",
+            "LBXLYPCT",
+            "LBXMCVSI",
+            "LBXRBWSI",
+            "LBXWBCSI",
+            "LBXGLU",
+        ]
     )
-    merged["glucose"] = (
-        merged["LBXGLU"] * 0.0555 if "LBXGLU" in merged.columns else np.nan
+    merged["sex"] = label_codes(merged["RIAGENDR"], {1: "Male", 2: "Female"})
+    merged["race_ethnicity"] = label_codes(
+        merged["RIDRETH1"],
+        {
+            1: "Mexican American",
+            2: "Other Hispanic",
+            3: "Non-Hispanic White",
+            4: "Non-Hispanic Black",
+            5: "Other",
+        },
     )
-    merged["crp"] = merged["LBXCRP"] * 10 if "LBXCRP" in merged.columns else np.nan
-    merged["log_crp"] = np.log(merged["crp"] + 0.01)
-    merged["lymphocyte_pct"] = merged["LBXLYPCT"]
-    merged["mcv"] = merged["LBXMCVSI"]
-    merged["rdw"] = (
-        merged["LBXRDW"]
-        if "LBXRDW" in merged.columns
-        else (merged["LBXRBWSI"] if "LBXRBWSI" in merged.columns else np.nan)
+    merged["education"] = label_codes(
+        merged["DMDEDUC2"],
+        {1: "<HS", 2: "<HS", 3: "HS grad", 4: "Some college", 5: "College+"},
     )
-    merged["alp"] = merged["LBXSAPSI"]
-    merged["wbc"] = merged["LBXWBCSI"]
+    merged["pir"] = merged["INDFMPIR"]
+
+    merged = merged[merged["age"] >= 18]
+    merged = merged[merged["RIDEXPRG"] != 1].reset_index(drop=True)
+
+    # Calculate PhenoAge components
+    add_biomarkers(merged, "alt_first", log=log_message)
 
     # Calculate PhenoAge
-    for col in [
-        "albumin",
-        "creatinine",
-        "glucose",
-        "log_crp",
-        "lymphocyte_pct",
-        "mcv",
-        "rdw",
-        "alp",
-        "wbc",
-    ]:
-        merged[f"{col}_imputed"] = merged[col].fillna(merged[col].median())
-    merged["age_imputed"] = merged["age"]
-
-    # Levine et al. 2018 coefficients (original formula from paper)
-    xb = (
-        -19.90667
-        - 0.03359355 * merged["albumin_imputed"]
-        + 0.009506491 * merged["creatinine_imputed"]
-        + 0.1953192 * merged["glucose_imputed"]
-        + 0.09536762 * merged["log_crp_imputed"]
-        - 0.01199984 * merged["lymphocyte_pct_imputed"]
-        + 0.02676401 * merged["mcv_imputed"]
-        + 0.3306156 * merged["rdw_imputed"]
-        + 0.001868778 * merged["alp_imputed"]
-        + 0.05542406 * merged["wbc_imputed"]
-        + 0.08035356 * merged["age_imputed"]
-    )
+    add_imputed(merged, "alt_first", log=log_message)
 
-    # Calculate PhenoAge using original Levine 2018 formula
-    xb_clipped = np.clip(xb, -10, 10)
-    m_inner = (-1.51714 * np.exp(xb_clipped)) / 0.007692696
-    m_inner = np.clip(m_inner, -700, 700)
-    m = 1 - np.exp(m_inner)
-    m = np.clip(m, 1e-10, 1 - 1e-10)
-    log_term = -0.0055305 * np.log(1 - m)
-    log_term = np.clip(log_term, 1e-300, 1e300)
-    merged["phenoage"] = (np.log(log_term) / 0.09165) + 141.50225
-    merged["phenoage"] = np.clip(merged["phenoage"], 0, 120)
-    merged["phenoage_accel"] = merged["phenoage"] - merged["age"]
+    # Levine et al. 2018 (original formula from paper)
+    matrix = component_matrix([merged[f"{col}_imputed"] for col in COMPONENTS])
+    merged["phenoage"], merged["phenoage_accel"] = score(matrix, clips="descriptive")
+    report = clipping_report(matrix, clips="descriptive")
+    log_message(f"  PhenoAge {format_clipping_report(report)}")
 
     return merged
 
@@ -418,12 +290,16 @@ def main():
     log_message("=" * 60)
 
     # Load data
-    df = load_and_calculate_phenoage()
+    with log_message.stage("load") as stage:
+        df = load_and_calculate_phenoage()
+        stage["rows"] = len(df)
     log_message(f"Loaded data: {len(df)} records")
 
     # Generate tables
-    table1 = generate_table1(df)
-    pfas_summary = generate_pfas_summary(df)
+    with log_message.stage("table1"):
+        table1 = generate_table1(df)
+    with log_message.stage("pfas_summary"):
+        pfas_summary = generate_pfas_summary(df)
 
     log_message("Descriptive statistics complete")
     log_message("=" * 60)
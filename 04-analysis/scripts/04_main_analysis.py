@@ -4,347 +4,448 @@ Script 04: Main Analysis
 Survey-weighted linear regression models
 """
 
+import argparse
 import pandas as pd
 import numpy as np
-import statsmodels.api as sm
-import statsmodels.formula.api as smf
 from scipy import stats
 from pathlib import Path
 import json
 
+from biomarkers import add_biomarkers
+from cohort import label_codes
+from cohort_cache import read_cohort
+from imputation import add_imputed
+from multiple_imputation import multiply_impute, rubin_pool
+from phenoage import (
+    AGE,
+    COEFFICIENT_COLUMNS,
+    COEFFICIENTS,
+    COMPONENTS,
+    coefficient_matrix,
+    component_matrix,
+    draw_coefficients,
+    grouped_means,
+    marginal_effects,
+    score,
+    score_many,
+)
+from pipeline_log import PipelineLogger
+from regression import fit_exposures, fit_outcomes
+from survey import SurveyDesign, survey_columns, survey_weight
+
 DATA_DIR = Path("/data")
 STUDY_DIR = Path("/study")
 OUTPUT_DIR = STUDY_DIR / "04-analysis" / "outputs"
 LOG_FILE = OUTPUT_DIR / "analysis_log.txt"
 
 
-def log_message(msg):
-    with open(LOG_FILE, "a") as f:
-        f.write(f"[04_main_analysis] {msg}\n")
-    print(msg)
+log_message = PipelineLogger("04_main_analysis", LOG_FILE)
 
+SEX_LABELS = {1: "Male", 2: "Female"}
+RACE_LABELS = {
+    1: "Mexican American",
+    2: "Other Hispanic",
+    3: "Non-Hispanic White",
+    4: "Non-Hispanic Black",
+    5: "Other",
+}
+EDUCATION_LABELS = {1: "<HS", 2: "<HS", 3: "HS", 4: "Some college", 5: "College+"}
 
-def load_and_prepare_data():
-    """Load all data and calculate PhenoAge"""
-    log_message("Loading and preparing data...")
+PFAS_COMPOUNDS = ["PFOA", "PFOS", "PFHxS", "PFNA"]
 
-    # PFAS
-    pfas_files = {
-        "D": "PFC_D.csv",
-        "E": "PFC_E.csv",
-        "F": "PFC_F.csv",
-        "G": "PFC_G.csv",
-    }
-    pfas_list = []
-    for cycle, filename in pfas_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["cycle"] = cycle
-            for old, new in [
-                ("LBXPFOA", "PFOA"),
-                ("LBXPFOS", "PFOS"),
-                ("LBXPFHS", "PFHxS"),
-                ("LBXPFNA", "PFNA"),
-            ]:
-                if old in df.columns:
-                    df[new] = df[old]
-            pfas_list.append(df[["SEQN", "cycle", "PFOA", "PFOS", "PFHxS", "PFNA"]])
-    pfas_df = pd.concat(pfas_list, ignore_index=True)
-
-    # Demographics
-    demo_files = {
-        "D": "DEMO_D.csv",
-        "E": "DEMO_E.csv",
-        "F": "DEMO_F.csv",
-        "G": "DEMO_G.csv",
-    }
-    demo_list = []
-    for cycle, filename in demo_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["age"] = df["RIDAGEYR"]
-            df["sex"] = df["RIAGENDR"].map({1: "Male", 2: "Female"})
-            df["race_ethnicity"] = df["RIDRETH1"].map(
-                {
-                    1: "Mexican American",
-                    2: "Other Hispanic",
-                    3: "Non-Hispanic White",
-                    4: "Non-Hispanic Black",
-                    5: "Other",
-                }
-            )
-            df["education"] = df["DMDEDUC2"].map(
-                {1: "<HS", 2: "<HS", 3: "HS", 4: "Some college", 5: "College+"}
-            )
-            df["pir"] = df["INDFMPIR"]
-            demo_list.append(
-                df[
-                    [
-                        "SEQN",
-                        "age",
-                        "sex",
-                        "race_ethnicity",
-                        "education",
-                        "pir",
-                        "RIDEXPRG",
-                    ]
-                ]
-            )
-    demo_df = pd.concat(demo_list, ignore_index=True)
-
-    # Biomarkers
-    biopro_files = {"D": "BIOPRO_D.csv", "F": "BIOPRO_F.csv", "G": "BIOPRO_G.csv"}
-    biopro_list = []
-    for cycle, filename in biopro_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            biopro_list.append(df)
-    biopro_df = pd.concat(biopro_list, ignore_index=True)
-
-    crp_files = {"D": "CRP_D.csv", "E": "CRP_E.csv", "F": "CRP_F.csv"}
-    crp_list = []
-    for cycle, filename in crp_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            crp_list.append(df)
-    crp_df = pd.concat(crp_list, ignore_index=True)
-
-    cbc_files = {"D": "CBC_D.csv", "E": "CBC_E.csv", "F": "CBC_F.csv", "G": "CBC_G.csv"}
-    cbc_list = []
-    for cycle, filename in cbc_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            cbc_list.append(df)
-    cbc_df = pd.concat(cbc_list, ignore_index=True)
-
-    glucose_files = {
-        "D": "GLU_D.csv",
-        "E": "GLU_E.csv",
-        "F": "GLU_F.csv",
-        "G": "GLU_G.csv",
-    }
-    glucose_list = []
-    for cycle, filename in glucose_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            glucose_list.append(df)
-    glucose_df = pd.concat(glucose_list, ignore_index=True)
-
-    # Merge
-    merged = pfas_df.merge(demo_df, on="SEQN", how="inner")
-    merged = merged[merged["age"] >= 18]
-    merged = merged[merged["RIDEXPRG"] != 1]
+# Coded variables of the multiple-imputation data (see imputation_data),
+# entering the chained equations as indicators
+MI_CATEGORICAL = ["RIAGENDR", "RIDRETH1", "DMDEDUC2", "cycle"]
 
-    bio_cols = ["SEQN"]
-    for col in ["LBXSAT", "LBXSAL", "LBXSCR", "LBXSAPSI"]:
-        if col in biopro_df.columns:
-            bio_cols.append(col)
-    merged = merged.merge(biopro_df[bio_cols], on="SEQN", how="left")
+# Right-hand sides of models 1-3 and the extra columns each needs, for
+# fit_regression_models and for propagating PhenoAge coefficient variants
+VARIANT_MODELS = [
+    ("Model 1 (Crude)", [], "{pfas}"),
+    ("Model 2 (+Demographics)", [], "{pfas} + age + C(sex) + C(race_ethnicity)"),
+    (
+        "Model 3 (+SES)",
+        ["education", "pir"],
+        "{pfas} + age + C(sex) + C(race_ethnicity) + C(education) + pir",
+    ),
+]
 
-    if "LBXCRP" in crp_df.columns:
-        merged = merged.merge(crp_df[["SEQN", "LBXCRP"]], on="SEQN", how="left")
 
-    cbc_cols = ["SEQN"]
-    for col in ["LBXLYPCT", "LBXMCVSI", "LBXRBWSI", "LBXRDW", "LBXWBCSI"]:
-        if col in cbc_df.columns:
-            cbc_cols.append(col)
-    merged = merged.merge(cbc_df[cbc_cols], on="SEQN", how="left")
+def load_and_prepare_data():
+    """Load all data and calculate PhenoAge"""
+    log_message("Loading and preparing data...")
+
+    # Cohort merged once by 01_data_prep
+    merged = read_cohort(
+        columns=[
+            "SEQN",
+            "cycle",
+            "PFOA",
+            "PFOS",
+            "PFHxS",
+            "PFNA",
+            "age",
+            "RIAGENDR",
+            "RIDRETH1",
+            "DMDEDUC2",
+            "INDFMPIR",
+            "RIDEXPRG",
+            "LBXSAT",
+            "LBXSAL",
+            "LBXSCR",
+            "LBXSAPSI",
+            "LBXCRP",
+            "LBXLYPCT",
+            "LBXMCVSI",
+            "LBXRBWSI",
+            "LBXRDW",
+            "LBXWBCSI",
+            "LBXGLU",
+            *survey_columns(),
+        ]
+    )
+    merged["sex"] = label_codes(merged["RIAGENDR"], SEX_LABELS)
+    merged["race_ethnicity"] = label_codes(merged["RIDRETH1"], RACE_LABELS)
+    merged["education"] = label_codes(merged["DMDEDUC2"], EDUCATION_LABELS)
+    merged["pir"] = merged["INDFMPIR"]
 
-    if "LBXGLU" in glucose_df.columns:
-        merged = merged.merge(glucose_df[["SEQN", "LBXGLU"]], on="SEQN", how="left")
+    merged = merged[merged["age"] >= 18]
+    merged = merged[merged["RIDEXPRG"] != 1].reset_index(drop=True)
 
     # Calculate PhenoAge
     # Calculate PhenoAge components
-    if "LBXSAT" in merged.columns:
-        merged["albumin"] = merged["LBXSAT"] * 10
-    elif "LBXSAL" in merged.columns:
-        merged["albumin"] = merged["LBXSAL"] * 10
-    else:
-        merged["albumin"] = np.nan
+    add_biomarkers(merged, "alt_first", log=log_message)
 
-    if "LBXSCR" in merged.columns:
-        merged["creatinine"] = merged["LBXSCR"] * 88.4
-    else:
-        merged["creatinine"] = np.nan
-
-    if "LBXGLU" in merged.columns:
-        merged["glucose"] = merged["LBXGLU"] * 0.0555
-    else:
-        merged["glucose"] = np.nan
-
-    if "LBXCRP" in merged.columns:
-        merged["crp"] = merged["LBXCRP"] * 10
-        merged["log_crp"] = np.log(merged["crp"] + 0.01)
-    else:
-        merged["crp"] = np.nan
-        merged["log_crp"] = np.nan
+    add_imputed(merged, "alt_first", log=log_message)
 
-    merged["lymphocyte_pct"] = (
-        merged["LBXLYPCT"] if "LBXLYPCT" in merged.columns else np.nan
+    # Levine et al. 2018 (original formula from paper)
+    matrix = component_matrix([merged[f"{col}_imputed"] for col in COMPONENTS])
+    contributions = np.empty_like(matrix)
+    merged["phenoage"], merged["phenoage_accel"] = score(
+        matrix, stable=True, contributions=contributions
     )
-    merged["mcv"] = merged["LBXMCVSI"] if "LBXMCVSI" in merged.columns else np.nan
-
-    if "LBXRDW" in merged.columns:
-        merged["rdw"] = merged["LBXRDW"]
-    elif "LBXRBWSI" in merged.columns:
-        merged["rdw"] = merged["LBXRBWSI"]
-    else:
-        merged["rdw"] = np.nan
-
-    merged["alp"] = merged["LBXSAPSI"] if "LBXSAPSI" in merged.columns else np.nan
-    merged["wbc"] = merged["LBXWBCSI"] if "LBXWBCSI" in merged.columns else np.nan
-
-    for col in [
-        "albumin",
-        "creatinine",
-        "glucose",
-        "log_crp",
-        "lymphocyte_pct",
-        "mcv",
-        "rdw",
-        "alp",
-        "wbc",
-    ]:
-        merged[f"{col}_imputed"] = merged[col].fillna(merged[col].median())
-    merged["age_imputed"] = merged["age"]
-
-    # Levine et al. 2018 coefficients (original formula from paper)
-    xb = (
-        -19.90667
-        - 0.03359355 * merged["albumin_imputed"]
-        + 0.009506491 * merged["creatinine_imputed"]
-        + 0.1953192 * merged["glucose_imputed"]
-        + 0.09536762 * merged["log_crp_imputed"]
-        - 0.01199984 * merged["lymphocyte_pct_imputed"]
-        + 0.02676401 * merged["mcv_imputed"]
-        + 0.3306156 * merged["rdw_imputed"]
-        + 0.001868778 * merged["alp_imputed"]
-        + 0.05542406 * merged["wbc_imputed"]
-        + 0.08035356 * merged["age_imputed"]
-    )
-
-    # Calculate PhenoAge using original Levine 2018 formula
-    # Step 1: Calculate mortality risk
-    # m = 1 - exp((-1.51714 * exp(xb)) / 0.007692696)
-    # Step 2: Convert mortality to PhenoAge
-    # PhenoAge = 141.50225 + (ln(-0.0055305 * ln(1-m))) / 0.09165
-
-    # Calculate mortality risk with safe clipping
-    xb_clipped = np.clip(xb, -20, 5)  # Less restrictive clipping
 
-    # Calculate m (10-year mortality risk)
-    exp_xb = np.exp(xb_clipped)
-    m_numerator = -1.51714 * exp_xb
-    m_exponent = m_numerator / 0.007692696
-    m_exponent = np.clip(m_exponent, -700, 0)  # Keep negative for valid exp
-    m = 1 - np.exp(m_exponent)
+    # Each component's additive share of PhenoAge, in years
+    contributions /= COEFFICIENTS["levine2018"]["phenoage_rate"]
+    for j, col in enumerate(COMPONENTS):
+        merged[f"{col}_contribution"] = contributions[:, j]
 
-    # Ensure m is in valid range (0, 1) for mortality risk
-    m = np.clip(m, 1e-10, 1 - 1e-10)
+    # Log-transform PFAS for analysis
+    for col in PFAS_COMPOUNDS:
+        merged[f"log_{col}"] = np.log(merged[col] + 0.01)
 
-    # Calculate PhenoAge from mortality risk
-    inner_log = 1 - m
-    inner_log = np.clip(inner_log, 1e-100, 1)
-    log1 = np.log(inner_log)
+    return merged
 
-    intermediate = -0.0055305 * log1
-    intermediate = np.clip(intermediate, 1e-100, 1e100)
-    log2 = np.log(intermediate)
 
-    merged["phenoage"] = 141.50225 + (log2 / 0.09165)
+def fit_regression_models(df, log=log_message, survey=None):
+    """
+    Fit the VARIANT_MODELS regressions of PhenoAge acceleration on each
+    compound, all compounds of a model at once (regression.fit_exposures),
+    design-based if given a survey.SurveyDesign of `df`
+    """
+    log("Fitting regression models...")
+
+    # Every model on the rows with the demographics present
+    demographics = ["age", "sex", "race_ethnicity"]
+    compounds = [c for c in PFAS_COMPOUNDS if f"log_{c}" in df.columns]
+    exposures = [f"log_{c}" for c in compounds]
+
+    results = {compound: [] for compound in compounds}
+    for model, extra, rhs in VARIANT_MODELS:
+        fits = fit_exposures(
+            df,
+            "phenoage_accel",
+            exposures,
+            rhs.format(pfas=""),
+            [*demographics, *extra],
+            survey=survey,
+        )
+        for fit in fits.itertuples(index=False):
+            results[fit.exposure.removeprefix("log_")].append(
+                {
+                    "model": model,
+                    "beta": fit.beta,
+                    "se": fit.se,
+                    "ci_lower": fit.ci_lower,
+                    "ci_upper": fit.ci_upper,
+                    "p_value": fit.p_value,
+                    "n": fit.n,
+                }
+            )
 
-    # Only clip extreme outliers (keep realistic biological ages)
-    merged["phenoage"] = np.clip(merged["phenoage"], 10, 110)
-    merged["phenoage_accel"] = merged["phenoage"] - merged["age"]
+    return results
 
-    # Log-transform PFAS for analysis
-    for col in ["PFOA", "PFOS", "PFHxS", "PFNA"]:
-        merged[f"log_{col}"] = np.log(merged[col] + 0.01)
 
-    return merged
+def load_coefficient_variants(sources, se_path=None, draws=200):
+    """
+    PhenoAge coefficient rows to propagate, in COEFFICIENT_COLUMNS order
+
+    `sources` are "published" (the registered coefficient sets) or CSV
+    files with one variant per row. With `se_path`, a one-row CSV of
+    standard errors, `draws` normal draws around the original coefficients
+    are added. Returns (names, k x 11 matrix).
+    """
+    names, blocks = [], []
+    for source in sources:
+        if source == "published":
+            block = coefficient_matrix()
+            names += list(COEFFICIENTS)
+        else:
+            table = pd.read_csv(source)
+            block = table[COEFFICIENT_COLUMNS].to_numpy(dtype=np.float64)
+            labels = table["name"] if "name" in table else range(len(table))
+            names += [f"{Path(source).stem}:{label}" for label in labels]
+        blocks.append(block)
+    if se_path is not None:
+        se = pd.read_csv(se_path)[COEFFICIENT_COLUMNS].to_numpy(dtype=np.float64)[0]
+        blocks.append(draw_coefficients(draws, se))
+        names += [f"draw:{i}" for i in range(draws)]
+    return names, np.vstack(blocks)
+
+
+def propagate_coefficient_variants(df, names, coefficients, survey=None):
+    """
+    Distribution of PFAS betas across PhenoAge coefficient variants
+
+    PhenoAge acceleration is scored under every variant at once
+    (score_many); each model is then fitted for all k outcomes from the
+    shared factorization of regression.fit_outcomes, on the rows and
+    with the survey design of fit_regression_models.
+    """
+    log_message(f"Propagating {len(names)} PhenoAge coefficient variants...")
+
+    matrix = component_matrix([df[f"{col}_imputed"] for col in COMPONENTS])
+    _, accel = score_many(matrix, coefficients)
+    outcomes = pd.DataFrame(accel, columns=range(len(names)))
+
+    demographics = ["phenoage_accel", "age", "sex", "race_ethnicity"]
+    compounds = [c for c in PFAS_COMPOUNDS if f"log_{c}" in df.columns]
+    rows = []
+    for model, extra, rhs in VARIANT_MODELS:
+        fits = fit_outcomes(
+            df,
+            outcomes,
+            [f"log_{c}" for c in compounds],
+            rhs.format(pfas=""),
+            [*demographics, *extra],
+            survey=survey,
+        )
+        for exposure, fit in fits.groupby("exposure", sort=False):
+            betas = fit["beta"].to_numpy()
+            rows.append(
+                {
+                    "compound": exposure.removeprefix("log_"),
+                    "model": model,
+                    "variants": len(betas),
+                    f"beta_{names[0]}": betas[0],
+                    "beta_mean": betas.mean(),
+                    "beta_sd": betas.std(ddof=1) if len(betas) > 1 else np.nan,
+                    "beta_2.5%": np.percentile(betas, 2.5),
+                    "beta_97.5%": np.percentile(betas, 97.5),
+                }
+            )
 
+    # Compound by compound, as the main results table
+    order = {c: i for i, c in enumerate(compounds)}
+    rows.sort(key=lambda row: order[row["compound"]])
+    variant_betas = pd.DataFrame(rows)
+    variant_betas.to_csv(
+        OUTPUT_DIR / "tables" / "phenoage_variant_betas.csv", index=False
+    )
+    log_message(f"  Variant betas saved: {len(variant_betas)} rows")
+    return variant_betas
+
+
+def summarize_contributions(df):
+    """
+    Mean PhenoAge contribution of each component by PFAS quartile
+
+    Contributions (years) come from the scoring pass; each compound's
+    quartile means are one grouped matrix product. Also reports the
+    marginal effect of each component (years per unit) and the Q4 - Q1
+    difference, the component's part in the acceleration gap.
+    """
+    log_message("Summarizing PhenoAge contributions by PFAS quartile...")
+
+    columns = [f"{col}_contribution" for col in COMPONENTS] + ["phenoage_accel"]
+    values = df[columns].to_numpy(dtype=np.float64)
+    effects = marginal_effects(df["phenoage"].to_numpy())
+    if len(effects):
+        marginal = np.nanmean(effects, axis=0)
+    else:
+        marginal = np.full(effects.shape[1], np.nan)
 
-def fit_regression_models(df):
-    """Fit survey-weighted regression models"""
-    log_message("Fitting regression models...")
+    rows = []
+    for compound in PFAS_COMPOUNDS:
+        if compound not in df.columns or df[compound].notna().sum() < 4:
+            continue
+        quartile = pd.qcut(df[compound], 4, labels=False, duplicates="drop")
+        bins = int(quartile.max()) + 1
 
-    results = {}
-    pfas_compounds = ["PFOA", "PFOS", "PFHxS", "PFNA"]
+        # Tied quartile edges merge bins; the last is then no Q4
+        if bins < 4:
+            log_message(f"  {compound}: only {bins} distinct quartile bins, skipped")
+            continue
+        codes = quartile.fillna(-1).to_numpy(dtype=np.int64)
+        means, counts = grouped_means(values, codes)
+        gap = means[-1] - means[0]
+        biomarker_gap = np.delete(gap[: len(COMPONENTS)], AGE)
+        if np.isnan(biomarker_gap).all():
+            log_message(f"  {compound}: no complete rows in Q1 or Q4, skipped")
+            continue
 
-    # Prepare data
-    df_clean = df.dropna(subset=["phenoage_accel", "age", "sex", "race_ethnicity"])
+        for q, (row, n) in enumerate(zip(means, counts)):
+            for j, col in enumerate(columns):
+                rows.append(
+                    {
+                        "compound": compound,
+                        "quartile": f"Q{q + 1}",
+                        "n": int(n),
+                        "component": col.removesuffix("_contribution"),
+                        "mean_years": row[j],
+                        "q4_minus_q1": gap[j],
+                        "marginal_years_per_unit": (
+                            marginal[j] if j < len(COMPONENTS) else np.nan
+                        ),
+                    }
+                )
+        names = [c for c in COMPONENTS if c != "age"]
+        top = int(np.nanargmax(np.abs(biomarker_gap)))
+        log_message(
+            f"  {compound}: Q4 - Q1 acceleration {gap[-1]:.2f} years; "
+            f"largest biomarker share {names[top]} {biomarker_gap[top]:+.2f}"
+        )
 
-    for compound in pfas_compounds:
-        log_col = f"log_{compound}"
-        if log_col not in df_clean.columns:
-            continue
+    summary = pd.DataFrame(rows)
+    summary.to_csv(
+        OUTPUT_DIR / "tables" / "phenoage_contributions_by_pfas_quartile.csv",
+        index=False,
+    )
+    log_message(f"  Contribution summary saved: {len(summary)} rows")
+    return summary
+
+
+def imputation_data(df):
+    """
+    Numeric frame for multiple imputation: the PhenoAge components before
+    single imputation, the covariates (codes for categorical ones) and the
+    log PFAS, which inform the imputations but are not imputed for analysis
+    """
+    data = pd.DataFrame({col: df[col] for col in COMPONENTS})
+    data["pir"] = df["pir"]
+    data["RIAGENDR"] = df["RIAGENDR"]
+    data["RIDRETH1"] = df["RIDRETH1"]
+    data["DMDEDUC2"] = df["DMDEDUC2"].where(df["education"].notna())
+    data["cycle"] = pd.Categorical(df["cycle"]).codes
+    data["cycle"] = data["cycle"].where(data["cycle"] >= 0)
+    for compound in PFAS_COMPOUNDS:
+        data[f"log_{compound}"] = df[f"log_{compound}"]
+    return data
+
+
+def fit_imputed_models(imputed, original):
+    """
+    PhenoAge and the regressions of fit_regression_models on one imputed
+    dataset (run in a worker by multiple_imputation.multiply_impute)
+    """
+    df = imputed
+    df["sex"] = label_codes(df["RIAGENDR"], SEX_LABELS)
+    df["race_ethnicity"] = label_codes(df["RIDRETH1"], RACE_LABELS)
+    df["education"] = label_codes(df["DMDEDUC2"], EDUCATION_LABELS)
+    df["phenoage"], df["phenoage_accel"] = score(
+        component_matrix([df[col] for col in COMPONENTS]), stable=True
+    )
+    # Exposures are analysed as measured
+    for compound in PFAS_COMPOUNDS:
+        df[f"log_{compound}"] = original[f"log_{compound}"]
 
-        compound_results = []
+    summary = {
+        col: (df[col].mean(), df[col].var() / df[col].count())
+        for col in ["phenoage", "phenoage_accel"]
+    }
+    return {
+        "regressions": fit_regression_models(df, log=lambda msg: None),
+        "phenoage": summary,
+    }
 
-        # Model 1: Crude (PFAS only)
-        model1_df = df_clean.dropna(subset=[log_col])
-        if len(model1_df) > 50:
-            X = sm.add_constant(model1_df[log_col])
-            y = model1_df["phenoage_accel"]
-            model1 = sm.OLS(y, X).fit()
-            compound_results.append(
-                {
-                    "model": "Model 1 (Crude)",
-                    "beta": model1.params[log_col],
-                    "se": model1.bse[log_col],
-                    "ci_lower": model1.conf_int().loc[log_col, 0],
-                    "ci_upper": model1.conf_int().loc[log_col, 1],
-                    "p_value": model1.pvalues[log_col],
-                    "n": len(model1_df),
-                }
-            )
 
-        # Model 2: + Demographics (age, sex, race)
-        model2_df = df_clean.dropna(subset=[log_col])
-        if len(model2_df) > 50:
-            formula = f"phenoage_accel ~ {log_col} + age + C(sex) + C(race_ethnicity)"
-            model2 = smf.ols(formula, data=model2_df).fit()
-            compound_results.append(
+def pool_imputed_results(results):
+    """
+    Rubin's-rules pooling of the fit_imputed_models results of all
+    imputations: regression results in fit_regression_models' layout
+    (plus the fraction of missing information) and a PhenoAge summary
+    """
+    pooled = {}
+    for compound, models in results[0]["regressions"].items():
+        pooled[compound] = []
+        for k, first in enumerate(models):
+            fits = [r["regressions"][compound][k] for r in results]
+            p = rubin_pool([f["beta"] for f in fits], [f["se"] ** 2 for f in fits])
+            pooled[compound].append(
                 {
-                    "model": "Model 2 (+Demographics)",
-                    "beta": model2.params[log_col],
-                    "se": model2.bse[log_col],
-                    "ci_lower": model2.conf_int().loc[log_col, 0],
-                    "ci_upper": model2.conf_int().loc[log_col, 1],
-                    "p_value": model2.pvalues[log_col],
-                    "n": len(model2_df),
+                    "model": first["model"],
+                    "beta": float(p["estimate"]),
+                    "se": float(p["se"]),
+                    "ci_lower": float(p["ci_lower"]),
+                    "ci_upper": float(p["ci_upper"]),
+                    "p_value": float(p["p_value"]),
+                    "n": first["n"],
+                    "fmi": float(p["fmi"]),
                 }
             )
 
-        # Model 3: + SES (education, PIR)
-        model3_df = df_clean.dropna(subset=[log_col, "education", "pir"])
-        if len(model3_df) > 50:
-            formula = f"phenoage_accel ~ {log_col} + age + C(sex) + C(race_ethnicity) + C(education) + pir"
-            model3 = smf.ols(formula, data=model3_df).fit()
-            compound_results.append(
-                {
-                    "model": "Model 3 (+SES)",
-                    "beta": model3.params[log_col],
-                    "se": model3.bse[log_col],
-                    "ci_lower": model3.conf_int().loc[log_col, 0],
-                    "ci_upper": model3.conf_int().loc[log_col, 1],
-                    "p_value": model3.pvalues[log_col],
-                    "n": len(model3_df),
-                }
+    summary = []
+    for col in results[0]["phenoage"]:
+        p = rubin_pool(*zip(*(r["phenoage"][col] for r in results)))
+        summary.append(
+            {
+                "measure": col,
+                "mean": float(p["estimate"]),
+                "se": float(p["se"]),
+                "ci_lower": float(p["ci_lower"]),
+                "ci_upper": float(p["ci_upper"]),
+                "fmi": float(p["fmi"]),
+                "imputations": len(results),
+            }
+        )
+    return pooled, pd.DataFrame(summary)
+
+
+def run_multiple_imputation(df, m, seed=0, processes=None):
+    """
+    Fit the regression set on m chained-equation imputations of the
+    components and covariates, in a process pool, and pool by Rubin's rules
+    """
+    log_message(f"Multiple imputation: {m} datasets...")
+    data = imputation_data(df)
+    missing = data.isna().sum()
+    log_message(
+        "  Missing values: "
+        + ", ".join(f"{col} {n}" for col, n in missing.items() if n)
+    )
+    results = multiply_impute(
+        data,
+        fit_imputed_models,
+        m,
+        categorical=MI_CATEGORICAL,
+        seed=seed,
+        processes=processes,
+    )
+    pooled, summary = pool_imputed_results(results)
+
+    summary.to_csv(OUTPUT_DIR / "tables" / "phenoage_mi_summary.csv", index=False)
+    with open(OUTPUT_DIR / "regression_results_mi.json", "w") as f:
+        json.dump(pooled, f, indent=2)
+    format_results_table(pooled, "main_results_mi_table.csv")
+    for compound, models in pooled.items():
+        for r in models:
+            log_message(
+                f"  {compound} {r['model']}: beta {r['beta']:.3f} "
+                f"(SE {r['se']:.3f}), missing information {r['fmi']:.2f}"
             )
-
-        results[compound] = compound_results
-
-    return results
+    return pooled
 
 
-def format_results_table(results):
+def format_results_table(results, filename="main_results_table.csv"):
     """Format results as table"""
     log_message("Formatting results table...")
 
@@ -367,25 +468,90 @@ def format_results_table(results):
                     "N": r["n"],
                 }
             )
+            if "fmi" in r:
+                table_rows[-1]["FMI"] = round(r["fmi"], 3)
 
     results_df = pd.DataFrame(table_rows)
-    results_df.to_csv(OUTPUT_DIR / "tables" / "main_results_table.csv", index=False)
+    results_df.to_csv(OUTPUT_DIR / "tables" / filename, index=False)
 
     log_message(f"  Results table saved: {len(results_df)} rows")
     return results_df
 
 
 def main():
+    parser = argparse.ArgumentParser(description="PFAS-PhenoAge main analysis")
+    parser.add_argument(
+        "--phenoage-variants",
+        action="append",
+        default=[],
+        metavar="SOURCE",
+        help="propagate PhenoAge coefficient variants to the PFAS betas: "
+        '"published" for the registered sets, or a CSV with one row per '
+        "variant (columns: " + ", ".join(COEFFICIENT_COLUMNS) + ")",
+    )
+    parser.add_argument(
+        "--coefficient-se",
+        type=Path,
+        default=None,
+        help="one-row CSV of coefficient standard errors; adds normal draws",
+    )
+    parser.add_argument("--coefficient-draws", type=int, default=200)
+    parser.add_argument(
+        "--imputations",
+        type=int,
+        default=0,
+        metavar="M",
+        help="also fit the models on M chained-equation imputations and pool "
+        "them by Rubin's rules",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="worker processes for --imputations (default: one per CPU)",
+    )
+    parser.add_argument("--imputation-seed", type=int, default=0)
+    args = parser.parse_args()
+
     log_message("=" * 60)
     log_message("PFAS-PhenoAge Study: Main Analysis")
     log_message("=" * 60)
 
     # Load data
-    df = load_and_prepare_data()
+    with log_message.stage("load") as stage:
+        df = load_and_prepare_data()
+        stage["rows"] = len(df)
     log_message(f"Loaded data: {len(df)} records")
 
-    # Fit models
-    results = fit_regression_models(df)
+    # Fit models, design-based if PFAS_SURVEY_WEIGHT selects a weight
+    survey = SurveyDesign.from_frame(df)
+    if survey is not None:
+        log_message(
+            f"Survey design: {survey_weight()} / {survey.cycles} cycles, "
+            f"{len(survey.psu_count)} strata, {len(survey.stratum)} PSUs"
+        )
+    with log_message.stage("regressions"):
+        results = fit_regression_models(df, survey=survey)
+
+    if args.phenoage_variants or args.coefficient_se:
+        with log_message.stage("coefficient_variants") as stage:
+            names, coefficients = load_coefficient_variants(
+                args.phenoage_variants or ["published"],
+                args.coefficient_se,
+                args.coefficient_draws,
+            )
+            propagate_coefficient_variants(df, names, coefficients, survey)
+            stage["rows"] = len(names)
+
+    if args.imputations:
+        with log_message.stage("multiple_imputation") as stage:
+            run_multiple_imputation(
+                df, args.imputations, args.imputation_seed, args.processes
+            )
+            stage["rows"] = len(df)
+
+    with log_message.stage("contributions"):
+        summarize_contributions(df)
 
     # Format and save
     results_table = format_results_table(results)
@@ -8,178 +8,75 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+from biomarkers import add_biomarkers
+from cohort import label_codes
+from cohort_cache import read_cohort
+from imputation import add_imputed
+from phenoage import COMPONENTS, component_matrix, score
+from pipeline_log import PipelineLogger
+from regression import fit_exposures
+from survey import SurveyDesign, survey_columns, survey_weight
+
 DATA_DIR = Path("/data")
 STUDY_DIR = Path("/study")
 OUTPUT_DIR = STUDY_DIR / "04-analysis" / "outputs"
 LOG_FILE = OUTPUT_DIR / "analysis_log.txt"
 
 
-def log_message(msg):
-    with open(LOG_FILE, "a") as f:
-        f.write(f"[06_mixture_analysis] {msg}\n")
-    print(msg)
+log_message = PipelineLogger("06_mixture_analysis", LOG_FILE)
 
 
 def load_and_prepare_data():
     """Load all data and calculate PhenoAge"""
-    # PFAS
-    pfas_files = {
-        "D": "PFC_D.csv",
-        "E": "PFC_E.csv",
-        "F": "PFC_F.csv",
-        "G": "PFC_G.csv",
-    }
-    pfas_list = []
-    for cycle, filename in pfas_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["cycle"] = cycle
-            for old, new in [
-                ("LBXPFOA", "PFOA"),
-                ("LBXPFOS", "PFOS"),
-                ("LBXPFHS", "PFHxS"),
-                ("LBXPFNA", "PFNA"),
-            ]:
-                if old in df.columns:
-                    df[new] = df[old]
-            pfas_list.append(df[["SEQN", "cycle", "PFOA", "PFOS", "PFHxS", "PFNA"]])
-    pfas_df = pd.concat(pfas_list, ignore_index=True)
-
-    # Demographics
-    demo_files = {
-        "D": "DEMO_D.csv",
-        "E": "DEMO_E.csv",
-        "F": "DEMO_F.csv",
-        "G": "DEMO_G.csv",
-    }
-    demo_list = []
-    for cycle, filename in demo_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["age"] = df["RIDAGEYR"]
-            df["sex"] = df["RIAGENDR"].map({1: "Male", 2: "Female"})
-            df["race_ethnicity"] = df["RIDRETH1"].map(
-                {
-                    1: "Mexican American",
-                    2: "Other Hispanic",
-                    3: "Non-Hispanic White",
-                    4: "Non-Hispanic Black",
-                    5: "Other",
-                }
-            )
-            demo_list.append(df[["SEQN", "age", "sex", "race_ethnicity", "RIDEXPRG"]])
-    demo_df = pd.concat(demo_list, ignore_index=True)
-
-    # Biomarkers
-    biopro_files = {"D": "BIOPRO_D.csv", "F": "BIOPRO_F.csv", "G": "BIOPRO_G.csv"}
-    biopro_list = []
-    for cycle, filename in biopro_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            biopro_list.append(df)
-    biopro_df = pd.concat(biopro_list, ignore_index=True)
-
-    crp_files = {"D": "CRP_D.csv", "E": "CRP_E.csv", "F": "CRP_F.csv"}
-    crp_list = []
-    for cycle, filename in crp_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            crp_list.append(df)
-    crp_df = pd.concat(crp_list, ignore_index=True)
-
-    cbc_files = {"D": "CBC_D.csv", "E": "CBC_E.csv", "F": "CBC_F.csv", "G": "CBC_G.csv"}
-    cbc_list = []
-    for cycle, filename in cbc_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            cbc_list.append(df)
-    cbc_df = pd.concat(cbc_list, ignore_index=True)
-
-    glucose_files = {
-        "D": "GLU_D.csv",
-        "E": "GLU_E.csv",
-        "F": "GLU_F.csv",
-        "G": "GLU_G.csv",
-    }
-    glucose_list = []
-    for cycle, filename in glucose_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            glucose_list.append(df)
-    glucose_df = pd.concat(glucose_list, ignore_index=True)
-
-    # Merge
-    merged = pfas_df.merge(demo_df, on="SEQN", how="inner")
-    merged = merged[merged["age"] >= 18]
-    merged = merged[merged["RIDEXPRG"] != 1]
-
-    bio_cols = ["SEQN"]
-    for col in ["LBXSAT", "LBXSAL", "LBXSCR", "LBXSAPSI"]:
-        if col in biopro_df.columns:
-            bio_cols.append(col)
-    merged = merged.merge(biopro_df[bio_cols], on="SEQN", how="left")
-
-    if "LBXCRP" in crp_df.columns:
-        merged = merged.merge(crp_df[["SEQN", "LBXCRP"]], on="SEQN", how="left")
-
-    cbc_cols = ["SEQN"]
-    for col in ["LBXLYPCT", "LBXMCVSI", "LBXRBWSI", "LBXRDW", "LBXWBCSI"]:
-        if col in cbc_df.columns:
-            cbc_cols.append(col)
-    merged = merged.merge(cbc_df[cbc_cols], on="SEQN", how="left")
+    # Cohort merged once by 01_data_prep
+    merged = read_cohort(
+        columns=[
+            "SEQN",
+            "cycle",
+            "PFOA",
+            "PFOS",
+            "PFHxS",
+            "PFNA",
+            "age",
+            "RIAGENDR",
+            "RIDRETH1",
+            "RIDEXPRG",
+            "LBXSAT",
+            "LBXSAL",
+            "LBXSCR",
+            "LBXSAPSI",
+            "LBXCRP",
+            "LBXLYPCT",
+            "LBXMCVSI",
+            "LBXRBWSI",
+            "LBXRDW",
+            "LBXWBCSI",
+            "LBXGLU",
+            *survey_columns(),
+        ]
+    )
+    merged["sex"] = label_codes(merged["RIAGENDR"], {1: "Male", 2: "Female"})
+    merged["race_ethnicity"] = label_codes(
+        merged["RIDRETH1"],
+        {
+            1: "Mexican American",
+            2: "Other Hispanic",
+            3: "Non-Hispanic White",
+            4: "Non-Hispanic Black",
+            5: "Other",
+        },
+    )
 
-    if "LBXGLU" in glucose_df.columns:
-        merged = merged.merge(glucose_df[["SEQN", "LBXGLU"]], on="SEQN", how="left")
+    merged = merged[merged["age"] >= 18]
+    merged = merged[merged["RIDEXPRG"] != 1].reset_index(drop=True)
 
     # Calculate PhenoAge
-    merged["albumin"] = merged["LBXSAL"] * 10 if "LBXSAL" in merged.columns else (merged["LBXSAT"] * 10 if "LBXSAT" in merged.columns else np.nan)
-    merged["creatinine"] = merged.get("LBXSCR", np.nan) * 88.4
-    merged["glucose"] = merged.get("LBXGLU", np.nan) * 0.0555
-    merged["crp"] = merged.get("LBXCRP", np.nan) * 10
-    merged["log_crp"] = np.log(merged["crp"] + 0.01)
-    merged["lymphocyte_pct"] = merged.get("LBXLYPCT", np.nan)
-    merged["mcv"] = merged.get("LBXMCVSI", np.nan)
-    merged["rdw"] = merged["LBXRDW"] if "LBXRDW" in merged.columns else (merged["LBXRBWSI"] if "LBXRBWSI" in merged.columns else np.nan)
-    merged["alp"] = merged.get("LBXSAPSI", np.nan)
-    merged["wbc"] = merged.get("LBXWBCSI", np.nan)
-
-    for col in [
-        "albumin",
-        "creatinine",
-        "glucose",
-        "log_crp",
-        "lymphocyte_pct",
-        "mcv",
-        "rdw",
-        "alp",
-        "wbc",
-    ]:
-        merged[f"{col}_imputed"] = merged[col].fillna(merged[col].median())
-    merged["age_imputed"] = merged["age"]
-
-    xb = (
-        -19.907
-        - 0.0336 * merged["albumin_imputed"]
-        + 0.0095 * merged["creatinine_imputed"]
-        + 0.1953 * merged["glucose_imputed"]
-        + 0.0954 * merged["log_crp_imputed"]
-        - 0.0120 * merged["lymphocyte_pct_imputed"]
-        + 0.0268 * merged["mcv_imputed"]
-        + 0.3306 * merged["rdw_imputed"]
-        + 0.0019 * merged["alp_imputed"]
-        + 0.0554 * merged["wbc_imputed"]
-        + 0.0804 * merged["age_imputed"]
-    )
+    add_biomarkers(merged, "alt_fallback", log=log_message)
+
+    add_imputed(merged, "alt_fallback", log=log_message)
 
-    m = 1 + np.exp(-0.0055 * (xb - 141.48))
-    merged["phenoage"] = 141.48 + np.log(m / (1 - m)) / 0.09165
-    merged["phenoage_accel"] = merged["phenoage"] - merged["age"]
+    matrix = component_matrix([merged[f"{col}_imputed"] for col in COMPONENTS])
+    merged["phenoage"], merged["phenoage_accel"] = score(matrix, stable=True)
 
     return merged
 
@@ -208,36 +105,34 @@ def calculate_pfas_correlation(df):
     return corr_matrix
 
 
-def calculate_wqs_weights(df):
+def calculate_wqs_weights(df, survey=None):
     """
     Calculate simplified WQS weights based on individual associations
     This is a simplified version since full WQS requires specialized packages
     """
     log_message("Calculating mixture weights...")
 
-    import statsmodels.api as sm
-
     pfas_cols = ["PFOA", "PFOS", "PFHxS", "PFNA"]
-    weights = {}
+    available = [col for col in pfas_cols if col in df.columns]
 
-    for col in pfas_cols:
-        if col not in df.columns:
-            continue
-
-        # Standardize PFAS values
+    # Standardize PFAS values
+    for col in available:
         df[f"{col}_std"] = (df[col] - df[col].mean()) / df[col].std()
 
-        # Simple regression
-        valid_data = df.dropna(subset=[f"{col}_std", "phenoage_accel"])
-        if len(valid_data) < 50:
-            continue
-
-        X = sm.add_constant(valid_data[f"{col}_std"])
-        y = valid_data["phenoage_accel"]
-        model = sm.OLS(y, X).fit()
+    # Simple regressions (at least 50 rows), all compounds at once
+    fits = fit_exposures(
+        df,
+        "phenoage_accel",
+        [f"{col}_std" for col in available],
+        min_rows=49,
+        survey=survey,
+    )
 
-        # Weight based on absolute standardized coefficient
-        weights[col] = abs(model.params[f"{col}_std"])
+    # Weight based on absolute standardized coefficient
+    weights = {
+        fit.exposure.removesuffix("_std"): abs(fit.beta)
+        for fit in fits.itertuples(index=False)
+    }
 
     # Normalize weights to sum to 1
     if weights:
@@ -252,7 +147,7 @@ def calculate_wqs_weights(df):
     return weights
 
 
-def calculate_pfas_index(df, weights):
+def calculate_pfas_index(df, weights, survey=None):
     """Calculate weighted PFAS mixture index"""
     log_message("Calculating PFAS mixture index...")
 
@@ -270,23 +165,23 @@ def calculate_pfas_index(df, weights):
             df["pfas_index"] += df[f"{col}_std"] * weights[col]
 
     # Regression with mixture index
-    import statsmodels.formula.api as smf
-
-    valid_data = df.dropna(
-        subset=["pfas_index", "phenoage_accel", "age", "sex", "race_ethnicity"]
+    fits = fit_exposures(
+        df,
+        "phenoage_accel",
+        ["pfas_index"],
+        "age + C(sex) + C(race_ethnicity)",
+        survey=survey,
     )
 
-    if len(valid_data) > 50:
-        formula = "phenoage_accel ~ pfas_index + age + C(sex) + C(race_ethnicity)"
-        model = smf.ols(formula, data=valid_data).fit()
-
+    if len(fits):
+        fit = fits.iloc[0]
         mixture_result = {
-            "beta": model.params["pfas_index"],
-            "se": model.bse["pfas_index"],
-            "ci_lower": model.conf_int().loc["pfas_index", 0],
-            "ci_upper": model.conf_int().loc["pfas_index", 1],
-            "p_value": model.pvalues["pfas_index"],
-            "n": len(valid_data),
+            "beta": fit["beta"],
+            "se": fit["se"],
+            "ci_lower": fit["ci_lower"],
+            "ci_upper": fit["ci_upper"],
+            "p_value": fit["p_value"],
+            "n": int(fit["n"]),
         }
 
         mixture_df = pd.DataFrame([mixture_result])
@@ -306,18 +201,28 @@ def main():
     log_message("=" * 60)
 
     # Load data
-    df = load_and_prepare_data()
+    with log_message.stage("load") as stage:
+        df = load_and_prepare_data()
+        stage["rows"] = len(df)
     log_message(f"Loaded data: {len(df)} records")
 
     # Calculate correlations
-    corr_matrix = calculate_pfas_correlation(df)
+    with log_message.stage("correlation"):
+        corr_matrix = calculate_pfas_correlation(df)
+
+    # Mixture regressions design-based if PFAS_SURVEY_WEIGHT selects a weight
+    survey = SurveyDesign.from_frame(df)
+    if survey is not None:
+        log_message(f"Survey design: {survey_weight()} / {survey.cycles} cycles")
 
     # Calculate WQS weights
-    weights = calculate_wqs_weights(df)
+    with log_message.stage("wqs_weights"):
+        weights = calculate_wqs_weights(df, survey)
 
     # Calculate mixture index
     if weights:
-        mixture_result = calculate_pfas_index(df, weights)
+        with log_message.stage("mixture_index"):
+            mixture_result = calculate_pfas_index(df, weights, survey)
 
     log_message("Mixture analysis complete")
     log_message("=" * 60)
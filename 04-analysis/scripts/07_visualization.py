@@ -13,6 +13,13 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from pathlib import Path
 
+from biomarkers import add_biomarkers
+from cohort import label_codes
+from cohort_cache import read_cohort
+from imputation import add_imputed
+from phenoage import COMPONENTS, component_matrix, score
+from pipeline_log import PipelineLogger
+
 DATA_DIR = Path("/data")
 STUDY_DIR = Path("/study")
 OUTPUT_DIR = STUDY_DIR / "04-analysis" / "outputs"
@@ -24,216 +31,61 @@ plt.style.use("seaborn-v0_8-whitegrid")
 sns.set_palette("husl")
 
 
-def log_message(msg):
-    with open(LOG_FILE, "a") as f:
-        f.write(f"[07_visualization] {msg}\n")
-    print(msg)
+log_message = PipelineLogger("07_visualization", LOG_FILE)
 
 
 def load_data():
     """Load and prepare data"""
-    # PFAS
-    pfas_files = {
-        "D": "PFC_D.csv",
-        "E": "PFC_E.csv",
-        "F": "PFC_F.csv",
-        "G": "PFC_G.csv",
-    }
-    pfas_list = []
-    for cycle, filename in pfas_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["cycle"] = cycle
-            for old, new in [
-                ("LBXPFOA", "PFOA"),
-                ("LBXPFOS", "PFOS"),
-                ("LBXPFHS", "PFHxS"),
-                ("LBXPFNA", "PFNA"),
-            ]:
-                if old in df.columns:
-                    df[new] = df[old]
-            pfas_list.append(df[["SEQN", "cycle", "PFOA", "PFOS", "PFHxS", "PFNA"]])
-    pfas_df = pd.concat(pfas_list, ignore_index=True)
-
-    # Demographics
-    demo_files = {
-        "D": "DEMO_D.csv",
-        "E": "DEMO_E.csv",
-        "F": "DEMO_F.csv",
-        "G": "DEMO_G.csv",
-    }
-    demo_list = []
-    for cycle, filename in demo_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["age"] = df["RIDAGEYR"]
-            df["sex"] = df["RIAGENDR"].map({1: "Male", 2: "Female"})
-            df["race_ethnicity"] = df["RIDRETH1"].map(
-                {
-                    1: "Mexican American",
-                    2: "Other Hispanic",
-                    3: "Non-Hispanic White",
-                    4: "Non-Hispanic Black",
-                    5: "Other",
-                }
-            )
-            demo_list.append(df[["SEQN", "age", "sex", "race_ethnicity", "RIDEXPRG"]])
-    demo_df = pd.concat(demo_list, ignore_index=True)
-
-    # Biomarkers
-    biopro_files = {"D": "BIOPRO_D.csv", "F": "BIOPRO_F.csv", "G": "BIOPRO_G.csv"}
-    biopro_list = []
-    for cycle, filename in biopro_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            biopro_list.append(df)
-    biopro_df = pd.concat(biopro_list, ignore_index=True)
-
-    crp_files = {"D": "CRP_D.csv", "E": "CRP_E.csv", "F": "CRP_F.csv"}
-    crp_list = []
-    for cycle, filename in crp_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            crp_list.append(df)
-    crp_df = pd.concat(crp_list, ignore_index=True)
-
-    cbc_files = {"D": "CBC_D.csv", "E": "CBC_E.csv", "F": "CBC_F.csv", "G": "CBC_G.csv"}
-    cbc_list = []
-    for cycle, filename in cbc_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            cbc_list.append(df)
-    cbc_df = pd.concat(cbc_list, ignore_index=True)
-
-    glucose_files = {
-        "D": "GLU_D.csv",
-        "E": "GLU_E.csv",
-        "F": "GLU_F.csv",
-        "G": "GLU_G.csv",
-    }
-    glucose_list = []
-    for cycle, filename in glucose_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            glucose_list.append(df)
-    glucose_df = pd.concat(glucose_list, ignore_index=True)
-
-    # Merge
-    merged = pfas_df.merge(demo_df, on="SEQN", how="inner")
-    merged = merged[merged["age"] >= 18]
-    merged = merged[merged["RIDEXPRG"] != 1]
-
-    bio_cols = ["SEQN"]
-    for col in ["LBXSAT", "LBXSAL", "LBXSCR", "LBXSAPSI"]:
-        if col in biopro_df.columns:
-            bio_cols.append(col)
-    merged = merged.merge(biopro_df[bio_cols], on="SEQN", how="left")
-
-    if "LBXCRP" in crp_df.columns:
-        merged = merged.merge(crp_df[["SEQN", "LBXCRP"]], on="SEQN", how="left")
-
-    cbc_cols = ["SEQN"]
-    for col in ["LBXLYPCT", "LBXMCVSI", "LBXRBWSI", "LBXRDW", "LBXWBCSI"]:
-        if col in cbc_df.columns:
-            cbc_cols.append(col)
-    merged = merged.merge(cbc_df[cbc_cols], on="SEQN", how="left")
+    # Cohort merged once by 01_data_prep
+    merged = read_cohort(
+        columns=[
+            "SEQN",
+            "cycle",
+            "PFOA",
+            "PFOS",
+            "PFHxS",
+            "PFNA",
+            "age",
+            "RIAGENDR",
+            "RIDRETH1",
+            "RIDEXPRG",
+            "LBXSAT",
+            "LBXSAL",
+            "LBXSCR",
+            "LBXSAPSI",
+            "LBXCRP",
+            "LBXLYPCT",
+            "LBXMCVSI",
+            "LBXRBWSI",
+            "LBXRDW",
+            "LBXWBCSI",
+            "LBXGLU",
+        ]
+    )
+    merged["sex"] = label_codes(merged["RIAGENDR"], {1: "Male", 2: "Female"})
+    merged["race_ethnicity"] = label_codes(
+        merged["RIDRETH1"],
+        {
+            1: "Mexican American",
+            2: "Other Hispanic",
+            3: "Non-Hispanic White",
+            4: "Non-Hispanic Black",
+            5: "Other",
+        },
+    )
 
-    if "LBXGLU" in glucose_df.columns:
-        merged = merged.merge(glucose_df[["SEQN", "LBXGLU"]], on="SEQN", how="left")
+    merged = merged[merged["age"] >= 18]
+    merged = merged[merged["RIDEXPRG"] != 1].reset_index(drop=True)
 
     # Calculate PhenoAge
     # Calculate PhenoAge components
-    if "LBXSAL" in merged.columns:
-        merged["albumin"] = merged["LBXSAL"] * 10
-    elif "LBXSAT" in merged.columns:
-        merged["albumin"] = merged["LBXSAT"] * 10
-    else:
-        merged["albumin"] = np.nan
-
-    merged["creatinine"] = (
-        merged["LBXSCR"] * 88.4 if "LBXSCR" in merged.columns else np.nan
-    )
-    merged["glucose"] = (
-        merged["LBXGLU"] * 0.0555 if "LBXGLU" in merged.columns else np.nan
-    )
-
-    if "LBXCRP" in merged.columns:
-        merged["crp"] = merged["LBXCRP"] * 10
-        merged["log_crp"] = np.log(merged["crp"] + 0.01)
-    else:
-        merged["crp"] = np.nan
-        merged["log_crp"] = np.nan
+    add_biomarkers(merged, "alt_fallback", log=log_message)
 
-    merged["lymphocyte_pct"] = (
-        merged["LBXLYPCT"] if "LBXLYPCT" in merged.columns else np.nan
-    )
-    merged["mcv"] = merged["LBXMCVSI"] if "LBXMCVSI" in merged.columns else np.nan
-
-    if "LBXRDW" in merged.columns:
-        merged["rdw"] = merged["LBXRDW"]
-    elif "LBXRBWSI" in merged.columns:
-        merged["rdw"] = merged["LBXRBWSI"]
-    else:
-        merged["rdw"] = np.nan
-
-    merged["alp"] = merged["LBXSAPSI"] if "LBXSAPSI" in merged.columns else np.nan
-    merged["wbc"] = merged["LBXWBCSI"] if "LBXWBCSI" in merged.columns else np.nan
-
-    for col in [
-        "albumin",
-        "creatinine",
-        "glucose",
-        "log_crp",
-        "lymphocyte_pct",
-        "mcv",
-        "rdw",
-        "alp",
-        "wbc",
-    ]:
-        merged[f"{col}_imputed"] = merged[col].fillna(merged[col].median())
-    merged["age_imputed"] = merged["age"]
-
-    xb = (
-        -19.90667
-        - 0.03359355 * merged["albumin_imputed"]
-        + 0.009506491 * merged["creatinine_imputed"]
-        + 0.1953192 * merged["glucose_imputed"]
-        + 0.09536762 * merged["log_crp_imputed"]
-        - 0.01199984 * merged["lymphocyte_pct_imputed"]
-        + 0.02676401 * merged["mcv_imputed"]
-        + 0.3306156 * merged["rdw_imputed"]
-        + 0.001868778 * merged["alp_imputed"]
-        + 0.05542406 * merged["wbc_imputed"]
-        + 0.08035356 * merged["age_imputed"]
-    )
+    add_imputed(merged, "alt_fallback", log=log_message)
 
     # Calculate PhenoAge using Levine et al. 2018 formula
-    xb_clipped = np.clip(xb, -20, 5)
-
-    exp_xb = np.exp(xb_clipped)
-    m_numerator = -1.51714 * exp_xb
-    m_exponent = m_numerator / 0.007692696
-    m_exponent = np.clip(m_exponent, -700, 0)
-    m = 1 - np.exp(m_exponent)
-    m = np.clip(m, 1e-10, 1 - 1e-10)
-
-    inner_log = 1 - m
-    inner_log = np.clip(inner_log, 1e-100, 1)
-    log1 = np.log(inner_log)
-
-    intermediate = -0.0055305 * log1
-    intermediate = np.clip(intermediate, 1e-100, 1e100)
-    log2 = np.log(intermediate)
-
-    merged["phenoage"] = 141.50225 + (log2 / 0.09165)
-    merged["phenoage"] = np.clip(merged["phenoage"], 10, 110)
-    merged["phenoage_accel"] = merged["phenoage"] - merged["age"]
+    matrix = component_matrix([merged[f"{col}_imputed"] for col in COMPONENTS])
+    merged["phenoage"], merged["phenoage_accel"] = score(matrix, stable=True)
 
     return merged
 
@@ -488,15 +340,18 @@ def main():
     log_message("=" * 60)
 
     # Load data
-    df = load_data()
+    with log_message.stage("load") as stage:
+        df = load_data()
+        stage["rows"] = len(df)
     log_message(f"Loaded data: {len(df)} records")
 
     # Create figures
-    create_strobe_diagram()
-    create_pfas_distributions(df)
-    create_phenoage_scatter(df)
-    create_forest_plot()
-    create_dose_response(df)
+    with log_message.stage("figures"):
+        create_strobe_diagram()
+        create_pfas_distributions(df)
+        create_phenoage_scatter(df)
+        create_forest_plot()
+        create_dose_response(df)
 
     log_message("All figures created successfully")
     log_message("=" * 60)
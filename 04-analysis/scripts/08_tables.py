@@ -8,6 +8,8 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+from pipeline_log import PipelineLogger
+
 DATA_DIR = Path("/data")
 STUDY_DIR = Path("/study")
 OUTPUT_DIR = STUDY_DIR / "04-analysis" / "outputs"
@@ -15,10 +17,7 @@ TABLE_DIR = OUTPUT_DIR / "tables"
 LOG_FILE = OUTPUT_DIR / "analysis_log.txt"
 
 
-def log_message(msg):
-    with open(LOG_FILE, "a") as f:
-        f.write(f"[08_tables] {msg}\n")
-    print(msg)
+log_message = PipelineLogger("08_tables", LOG_FILE)
 
 
 def load_results():
@@ -297,17 +296,20 @@ def main():
     log_message("=" * 60)
 
     # Load results
-    results = load_results()
+    with log_message.stage("load"):
+        results = load_results()
     log_message(f"Loaded {len(results)} result files")
 
     # Create LaTeX tables
-    create_latex_table1(results)
-    create_latex_pfas_summary(results)
-    create_latex_main_results(results)
-    create_latex_mixture(results)
+    with log_message.stage("latex_tables"):
+        create_latex_table1(results)
+        create_latex_pfas_summary(results)
+        create_latex_main_results(results)
+        create_latex_mixture(results)
 
     # Create summary
-    create_results_summary()
+    with log_message.stage("results_summary"):
+        create_results_summary()
 
     log_message("Table generation complete")
     log_message("=" * 60)
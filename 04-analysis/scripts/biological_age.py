@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Biological Age Registry for PFAS-PhenoAge Study
+Several biological-age measures computed together from the PhenoAge
+biomarker matrix (see phenoage.COMPONENTS)
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from phenoage import AGE, COEFFICIENTS, COMPONENTS, synthetic_matrix, transform
+
+# Biomarker columns of the matrix (everything but chronological age)
+BIOMARKERS = [j for j in range(len(COMPONENTS)) if j != AGE]
+
+# Direction in which each biomarker raises mortality risk: the sign of its
+# PhenoAge weight (albumin and lymphocyte % are protective)
+RISK_DIRECTION = np.sign(np.asarray(COEFFICIENTS["levine2018"]["weights"]))
+
+# Homeostatic dysregulation is measured from a young reference group
+HD_REFERENCE_AGES = (20, 30)
+
+
+def _fit_phenoage(coefficients):
+    def fit(reference):
+        c = COEFFICIENTS[coefficients]
+        weights = np.asarray(c["weights"], dtype=np.float64)[:, None]
+        return {"weights": weights, "offset": np.array([c["intercept"]])}
+
+    return fit
+
+
+def _finish_phenoage(coefficients, clips):
+    def finish(projected, matrix, params):
+        return transform(projected[:, 0].copy(), coefficients, clips, stable=True)
+
+    return finish
+
+
+def fit_kdm(reference):
+    """
+    Klemera-Doubal biological age fitted on a reference sample
+
+    Each biomarker is regressed on chronological age (x = q + k * age,
+    residual SD s, correlation r). BA is the precision-weighted combination
+    sum(k (x - q) / s^2) + age / s_BA^2 over sum(k^2 / s^2) + 1 / s_BA^2,
+    with s_BA^2 estimated as in Levine (2013). Since it is linear in the
+    matrix, it reduces to one weight column and an offset.
+    """
+    age = reference[:, AGE]
+    x = reference[:, BIOMARKERS]
+    age_c = age - age.mean()
+    x_c = x - x.mean(axis=0)
+    k = age_c @ x_c / (age_c @ age_c)
+    q = x.mean(axis=0) - k * age.mean()
+    s = np.sqrt(((x_c - np.outer(age_c, k)) ** 2).mean(axis=0))
+
+    # Biomarkers that do not vary carry no information
+    used = s > 0
+    x_used = x_c[:, used]
+    r = (age_c @ x_used) / np.sqrt((age_c @ age_c) * (x_used**2).sum(axis=0))
+    precision = np.where(used, k / np.where(used, s, 1) ** 2, 0.0)
+    denominator = (k * precision).sum()
+    numerator_offset = -(q * precision).sum()
+
+    # Biomarker-only estimate, used to size the age prior
+    ba_e = (x @ precision + numerator_offset) / denominator
+    r_char = (r**2 / np.sqrt(1 - r**2)).sum() / (r / np.sqrt(1 - r**2)).sum()
+    s_ba2 = np.var(ba_e - age, ddof=1) - (1 - r_char**2) / r_char**2 * (
+        (age.max() - age.min()) ** 2 / (12 * used.sum())
+    )
+    # A non-positive variance means the age prior is uninformative
+    age_weight = 1 / s_ba2 if s_ba2 > 0 else 0.0
+
+    weights = np.zeros((len(COMPONENTS), 1))
+    weights[BIOMARKERS, 0] = precision
+    weights[AGE, 0] = age_weight
+    total = denominator + age_weight
+    return {"weights": weights / total, "offset": np.array([numerator_offset / total])}
+
+
+def fit_hd(reference):
+    """
+    Homeostatic dysregulation: Mahalanobis distance of the biomarkers from
+    participants aged HD_REFERENCE_AGES in the reference sample
+
+    The whitening matrix comes from an eigendecomposition of the reference
+    covariance, so a degenerate biomarker is dropped rather than failing.
+    """
+    lo, hi = HD_REFERENCE_AGES
+    in_range = (reference[:, AGE] >= lo) & (reference[:, AGE] < hi)
+    young = reference[in_range][:, BIOMARKERS]
+    if len(young) <= len(BIOMARKERS):
+        raise ValueError(
+            f"Homeostatic dysregulation needs more than {len(BIOMARKERS)} "
+            f"complete reference rows aged {lo}-{hi}, found {len(young)}"
+        )
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(young, rowvar=False))
+    keep = eigenvalues > eigenvalues.max() * 1e-12
+    whitening = eigenvectors[:, keep] / np.sqrt(eigenvalues[keep])
+
+    weights = np.zeros((len(COMPONENTS), whitening.shape[1]))
+    weights[BIOMARKERS] = whitening
+    return {"weights": weights, "offset": -young.mean(axis=0) @ whitening}
+
+
+def _finish_hd(projected, matrix, params):
+    return np.sqrt(np.einsum("ij,ij->i", projected, projected))
+
+
+def fit_allostatic_load(reference):
+    """
+    Allostatic load: number of biomarkers in their high-risk quartile of
+    the reference sample (top quartile, or bottom for protective markers)
+
+    Its projected column is the plain sum of the biomarkers, which is only
+    used to spot rows with a missing biomarker.
+    """
+    lower, upper = np.quantile(reference[:, BIOMARKERS], [0.25, 0.75], axis=0)
+    weights = np.zeros((len(COMPONENTS), 1))
+    weights[BIOMARKERS, 0] = 1
+    return {
+        "weights": weights,
+        "offset": np.zeros(1),
+        "threshold": np.where(RISK_DIRECTION[BIOMARKERS] < 0, lower, upper),
+    }
+
+
+def _finish_allostatic_load(projected, matrix, params):
+    load = np.zeros(len(matrix))
+    for j, threshold in zip(BIOMARKERS, params["threshold"]):
+        if RISK_DIRECTION[j] < 0:
+            load += matrix[:, j] <= threshold
+        else:
+            load += matrix[:, j] >= threshold
+    load[np.isnan(projected[:, 0])] = np.nan
+    return load
+
+
+# name -> fit(complete reference rows) returning params with the "weights"
+# (10 x k) and "offset" (k) the algorithm adds to the shared product;
+# finish(projected (n x k), matrix, params) returning the measure; and
+# whether it is an age in years (acceleration = measure - age) or an
+# index (acceleration = residual from a linear fit on age)
+ALGORITHMS = {
+    "phenoage": {
+        "fit": _fit_phenoage("levine2018"),
+        "finish": _finish_phenoage("levine2018", "pipeline"),
+        "years": True,
+    },
+    "phenoage_table_s7": {
+        "fit": _fit_phenoage("table_s7"),
+        "finish": _finish_phenoage("table_s7", "complete"),
+        "years": True,
+    },
+    "kdm": {
+        "fit": fit_kdm,
+        "finish": lambda projected, matrix, params: projected[:, 0].copy(),
+        "years": True,
+    },
+    "hd": {
+        "fit": fit_hd,
+        "finish": _finish_hd,
+        "years": False,
+    },
+    "allostatic_load": {
+        "fit": fit_allostatic_load,
+        "finish": _finish_allostatic_load,
+        "years": False,
+    },
+}
+
+
+def _age_residual(values, age):
+    """Residual of a measure after a least-squares line on age"""
+    ok = ~(np.isnan(values) | np.isnan(age))
+    if ok.sum() < 2:
+        return np.full(len(values), np.nan)
+    x, y = (age, values) if ok.all() else (age[ok], values[ok])
+    x_mean, y_mean = x.mean(), y.mean()
+    x_c = x - x_mean
+    slope = x_c @ (y - y_mean) / (x_c @ x_c)
+    return values - y_mean - slope * (age - x_mean)
+
+
+def fit_algorithms(reference, algorithms=None):
+    """Fit every requested algorithm on the complete rows of `reference`"""
+    reference = np.asarray(reference, dtype=np.float64)
+    complete = reference[~np.isnan(reference).any(axis=1)]
+    return {
+        name: ALGORITHMS[name]["fit"](complete) for name in algorithms or ALGORITHMS
+    }
+
+
+def biological_ages(matrix, algorithms=None, reference=None, params=None):
+    """
+    Every registered biological-age measure for an (n x 10) matrix
+
+    Algorithms are fitted on `reference` (default: the matrix itself)
+    unless fitted `params` from fit_algorithms are given. The linear parts
+    of all algorithms are stacked into one weight matrix and evaluated
+    with a single matrix product; each algorithm then finishes from its
+    own columns. Returns a DataFrame with one column per algorithm and its
+    acceleration (`<name>_accel`).
+    """
+    names = list(algorithms or ALGORITHMS)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    if params is None:
+        params = fit_algorithms(matrix if reference is None else reference, names)
+
+    weights = np.hstack([params[name]["weights"] for name in names])
+    offset = np.concatenate([params[name]["offset"] for name in names])
+    projected = matrix @ weights
+    projected += offset
+
+    age = matrix[:, AGE]
+    result = {}
+    start = 0
+    for name in names:
+        algorithm = ALGORITHMS[name]
+        stop = start + params[name]["weights"].shape[1]
+        values = algorithm["finish"](projected[:, start:stop], matrix, params[name])
+        result[name] = values
+        result[f"{name}_accel"] = (
+            values - age if algorithm["years"] else _age_residual(values, age)
+        )
+        start = stop
+    return pd.DataFrame(result)
+
+
+def benchmark(rows=10**6, repeat=3):
+    """
+    Best-of-`repeat` seconds to score PhenoAge alone, every algorithm in
+    one pass, and every algorithm in a pass of its own; the algorithms are
+    fitted once beforehand
+    """
+    matrix = synthetic_matrix(rows)
+    params = fit_algorithms(matrix)
+    runs = {
+        "phenoage": [["phenoage"]],
+        "all": [list(ALGORITHMS)],
+        "separate": [[name] for name in ALGORITHMS],
+    }
+    times = {}
+    for label, passes in runs.items():
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for names in passes:
+                biological_ages(matrix, names, params=params)
+            best = min(best, time.perf_counter() - start)
+        times[label] = best
+    return times
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Time PhenoAge alone against all registered algorithms"
+    )
+    parser.add_argument("--rows", type=float, default=1e6)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    times = benchmark(int(args.rows), args.repeat)
+    print(
+        f"{int(args.rows):,} rows: PhenoAge {times['phenoage']:.4f}s, "
+        f"all {len(ALGORITHMS)} algorithms {times['all']:.4f}s in one pass, "
+        f"{times['separate']:.4f}s one at a time"
+    )
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Biomarker Schema for PFAS-PhenoAge Study
+Declares, per PhenoAge biomarker, its NHANES source variables by cycle,
+their units and the conversion to the units of the Levine (2018) formula,
+and applies all conversions and range checks to the cohort at once
+"""
+
+import numpy as np
+import pandas as pd
+
+# hs-CRP replaced CRP (in mg/L rather than mg/dL) from 2015-2016; the
+# 2011-2014 cycles have no CRP
+CRP_SOURCES = {
+    "*": [("LBXCRP", "mg/dL")],
+    "I": [("LBXHSCRP", "mg/L")],
+    "J": [("LBXHSCRP", "mg/L")],
+}
+CRP_FACTORS = {"mg/dL": 10, "mg/L": 1}
+
+# name -> unit: target unit; factors: source unit -> multiplier into the
+# target unit; sources: cycle (or "*" for any) -> (variable, unit) in
+# order of preference, the first non-missing value being used per row;
+# shift/floor/log: value = log(max(factor * x + shift, floor)); range:
+# plausible values in the target unit, to catch unit or source mix-ups
+BIOMARKER_SCHEMA = {
+    "albumin": {
+        "unit": "g/L",
+        "factors": {"g/dL": 10, "g/L": 1},
+        "sources": {"*": [("LBXSAL", "g/dL")]},
+        "range": (15, 65),
+    },
+    "creatinine": {
+        "unit": "umol/L",
+        "factors": {"mg/dL": 88.4, "umol/L": 1},
+        "sources": {"*": [("LBXSCR", "mg/dL")]},
+        "range": (10, 2000),
+    },
+    "glucose": {
+        "unit": "mmol/L",
+        "factors": {"mg/dL": 0.0555, "mmol/L": 1},
+        "sources": {"*": [("LBXSGL", "mg/dL"), ("LBXGLU", "mg/dL")]},
+        "range": (1, 40),
+    },
+    "crp": {
+        "unit": "mg/L",
+        "factors": CRP_FACTORS,
+        "sources": CRP_SOURCES,
+        "range": (0, 300),
+    },
+    "log_crp": {
+        "unit": "ln(mg/L)",
+        "factors": CRP_FACTORS,
+        "sources": CRP_SOURCES,
+        "shift": 0.01,
+        "log": True,
+        "range": (-5, 6),
+    },
+    "lymphocyte_pct": {
+        "unit": "%",
+        "factors": {"%": 1},
+        "sources": {"*": [("LBXLYPCT", "%")]},
+        "range": (0, 100),
+    },
+    "mcv": {
+        "unit": "fL",
+        "factors": {"fL": 1},
+        "sources": {"*": [("LBXMCVSI", "fL")]},
+        "range": (50, 130),
+    },
+    "rdw": {
+        "unit": "%",
+        "factors": {"%": 1},
+        "sources": {"*": [("LBXRDW", "%")]},
+        "range": (8, 30),
+    },
+    "alp": {
+        "unit": "U/L",
+        "factors": {"U/L": 1},
+        "sources": {"*": [("LBXSAPSI", "U/L")]},
+        "range": (5, 1500),
+    },
+    "wbc": {
+        "unit": "1000 cells/uL",
+        "factors": {"1000 cells/uL": 1},
+        "sources": {"*": [("LBXWBCSI", "1000 cells/uL")]},
+        "range": (0.5, 100),
+    },
+}
+
+# Per-script departures from the schema, kept so results do not change.
+# 02-04 read albumin from LBXSAT when present and 05-07 fall back to it;
+# LBXSAT is ALT (U/L), which the range check reports wherever it is used.
+# These scripts also read glucose from LBXGLU only.
+SOURCE_PROFILES = {
+    "alt_first": {
+        "albumin": {"sources": {"*": [("LBXSAT", "g/dL"), ("LBXSAL", "g/dL")]}},
+        "glucose": {"sources": {"*": [("LBXGLU", "mg/dL")]}},
+        "rdw": {"sources": {"*": [("LBXRDW", "%"), ("LBXRBWSI", "%")]}},
+    },
+    "alt_fallback": {
+        "albumin": {"sources": {"*": [("LBXSAL", "g/dL"), ("LBXSAT", "g/dL")]}},
+        "glucose": {"sources": {"*": [("LBXGLU", "mg/dL")]}},
+        "rdw": {"sources": {"*": [("LBXRDW", "%"), ("LBXRBWSI", "%")]}},
+    },
+    # complete_analysis floors CRP at 0.01 mg/L instead of shifting it
+    "complete": {
+        "log_crp": {"shift": 0.0, "floor": 0.01},
+    },
+}
+
+
+def resolve_schema(profile=None):
+    """The schema with a profile's (name or dict) overrides applied"""
+    overrides = SOURCE_PROFILES[profile] if isinstance(profile, str) else profile
+    schema = {name: dict(entry) for name, entry in BIOMARKER_SCHEMA.items()}
+    for name, changes in (overrides or {}).items():
+        schema[name].update(changes)
+    return schema
+
+
+def convert_biomarkers(df, profile=None, fill_missing=True):
+    """
+    All schema biomarkers of a cohort frame, in their target units
+
+    Source values are gathered per cycle (rows without a "cycle" column
+    use the "*" sources) into one (n x m) matrix alongside the factor of
+    the unit each value came in; shift, floor, log and the range check
+    are then applied to the whole matrix at once. The arithmetic is in
+    float64, also for float32 sources, where the per-script conversions
+    it replaced stayed in float32; regression estimates moved by up to
+    about 2e-5 relative with the switch. A biomarker with no source
+    column in `df` is all-missing, or left out if not `fill_missing`.
+
+    Returns (biomarkers DataFrame on df's index, report DataFrame with the
+    sources used and the number of values outside the plausible range).
+    """
+    schema = resolve_schema(profile)
+    n = len(df)
+    if "cycle" in df.columns:
+        cycles = df["cycle"].astype(str).to_numpy()
+    else:
+        cycles = np.full(n, "*")
+
+    names = []
+    for name, entry in schema.items():
+        variables = {v for options in entry["sources"].values() for v, _ in options}
+        if fill_missing or variables & set(df.columns):
+            names.append(name)
+
+    values = np.full((n, len(names)), np.nan)
+    factors = np.ones((n, len(names)))
+    columns = {}
+    used = {name: [] for name in names}
+    for cycle in np.unique(cycles):
+        rows = np.flatnonzero(cycles == cycle)
+        for j, name in enumerate(names):
+            entry = schema[name]
+            options = entry["sources"].get(cycle, entry["sources"]["*"])
+            filled = np.zeros(len(rows), dtype=bool)
+            for variable, unit in options:
+                if variable not in df.columns:
+                    continue
+                if variable not in columns:
+                    columns[variable] = df[variable].to_numpy(dtype=np.float64)
+                source = columns[variable][rows]
+                take = ~filled & ~np.isnan(source)
+                values[rows[take], j] = source[take]
+                factors[rows[take], j] = entry["factors"][unit]
+                filled |= take
+                if take.any() and variable not in used[name]:
+                    used[name].append(variable)
+
+    # Compiled vectors: one entry per biomarker
+    shift = np.array([schema[name].get("shift", 0.0) for name in names])
+    floor = np.array([schema[name].get("floor", -np.inf) for name in names])
+    logged = np.array([schema[name].get("log", False) for name in names])
+    low = np.array([schema[name]["range"][0] for name in names])
+    high = np.array([schema[name]["range"][1] for name in names])
+
+    values *= factors
+    values += shift
+    np.maximum(values, floor, out=values)
+    values[:, logged] = np.log(values[:, logged])
+    outside = ((values < low) | (values > high)).sum(axis=0)
+
+    report = pd.DataFrame(
+        {
+            "biomarker": names,
+            "unit": [schema[name]["unit"] for name in names],
+            "sources": [", ".join(used[name]) for name in names],
+            "n": (~np.isnan(values)).sum(axis=0),
+            "out_of_range": outside,
+            "low": low,
+            "high": high,
+        }
+    )
+    return pd.DataFrame(values, index=df.index, columns=names), report
+
+
+def log_range_report(report, log=print):
+    """Log every biomarker of a conversion report with implausible values"""
+    for r in report[report["out_of_range"] > 0].itertuples():
+        log(
+            f"  Range check: {r.biomarker} from {r.sources} has "
+            f"{r.out_of_range} of {r.n} values outside {r.low:g}-{r.high:g} "
+            f"{r.unit}; check the source variable and its unit"
+        )
+
+
+def add_biomarkers(df, profile=None, log=print, fill_missing=True):
+    """Add the converted biomarkers to `df` as columns and log range checks"""
+    biomarkers, report = convert_biomarkers(df, profile, fill_missing)
+    for col in biomarkers.columns:
+        df[col] = biomarkers[col]
+    log_range_report(report, log)
+    return df
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Out-of-Core Helpers for PFAS-PhenoAge Study
+SEQN-ordered streaming joins and mergeable aggregates, so cohort
+preparation can run on inputs larger than memory
+"""
+
+import numpy as np
+import pandas as pd
+
+# Histogram bins per pass when narrowing down an order statistic
+QUANTILE_BINS = 256
+
+
+class SeqnStream:
+    """
+    A SEQN-ordered file read chunk by chunk
+
+    take_through(seqn) returns the rows up to and including `seqn` that
+    have not been taken yet, reading further chunks only as needed. Rows
+    beyond `seqn` stay buffered, so memory holds at most one chunk past the
+    requested range. Files must be strictly increasing in SEQN, as NHANES
+    releases are; anything else raises ValueError.
+    """
+
+    def __init__(self, name, chunks, key="SEQN"):
+        self.name = name
+        self.key = key
+        self.rows = 0
+        self._chunks = iter(chunks)
+        self._buffer = None
+        self._last = None
+        self._done = False
+
+    def _pull(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._done = True
+            return
+        keys = chunk[self.key].to_numpy()
+        if len(keys):
+            if (np.diff(keys) <= 0).any() or (
+                self._last is not None and keys[0] <= self._last
+            ):
+                raise ValueError(
+                    f"{self.name}: {self.key} is not strictly increasing; "
+                    "chunked mode needs files sorted by SEQN"
+                )
+            self._last = keys[-1]
+        self.rows += len(chunk)
+        if self._buffer is None or self._buffer.empty:
+            self._buffer = chunk.reset_index(drop=True)
+        else:
+            self._buffer = pd.concat([self._buffer, chunk], ignore_index=True)
+
+    def __iter__(self):
+        """Yield the remaining chunks one at a time, checking SEQN order"""
+        while True:
+            self._buffer = None
+            self._pull()
+            if self._done:
+                return
+            yield self._buffer
+
+    def take_through(self, seqn):
+        while not self._done and (
+            self._buffer is None
+            or self._buffer.empty
+            or self._buffer[self.key].iloc[-1] <= seqn
+        ):
+            self._pull()
+        if self._buffer is None:
+            return None
+        n = int(np.searchsorted(self._buffer[self.key].to_numpy(), seqn, "right"))
+        taken = self._buffer.iloc[:n]
+        self._buffer = self._buffer.iloc[n:].reset_index(drop=True)
+        return taken
+
+    def drain(self):
+        """Read (and discard) the rest of the file; returns total rows"""
+        self._buffer = None
+        for chunk in self._chunks:
+            self.rows += len(chunk)
+        self._done = True
+        return self.rows
+
+
+class RunningMoments:
+    """Count, mean and variance merged across chunks (Chan et al.)"""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        x = np.asarray(values, dtype=np.float64)
+        x = x[~np.isnan(x)]
+        if not len(x):
+            return
+        n, mean = len(x), x.mean()
+        m2 = ((x - mean) ** 2).sum()
+        delta = mean - self.mean
+        total = self.n + n
+        self.mean += delta * n / total
+        self.m2 += m2 + delta**2 * self.n * n / total
+        self.n = total
+        self.min = min(self.min, x.min())
+        self.max = max(self.max, x.max())
+
+    def merge(self, other):
+        """Fold another RunningMoments into this one"""
+        if not other.n:
+            return
+        delta = other.mean - self.mean
+        total = self.n + other.n
+        self.mean += delta * other.n / total
+        self.m2 += other.m2 + delta**2 * self.n * other.n / total
+        self.n = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def std(self, ddof=1):
+        if self.n <= ddof:
+            return np.nan
+        return np.sqrt(self.m2 / (self.n - ddof))
+
+
+def _lerp(a, b, t):
+    """numpy's linear interpolation, for identical quantiles"""
+    diff = b - a
+    return b - diff * (1 - t) if t >= 0.5 else a + diff * t
+
+
+def exact_quantiles(passes, qs, moments, max_buffer=100_000):
+    """
+    Exact linear-interpolation quantiles of data streamed in chunks
+
+    `passes` is a callable returning a fresh iterator of value arrays;
+    `moments` is a RunningMoments over the same values (count, min, max).
+    Each pass narrows every pending order statistic to one histogram bin;
+    once a bin holds at most `max_buffer` values they are kept and sorted.
+    Results equal np.quantile / Series.quantile on the full data.
+    """
+    n = moments.n
+    if n == 0:
+        return {q: np.nan for q in qs}
+
+    # Order statistics needed (0-based ranks)
+    positions = {q: (n - 1) * q for q in qs}
+    ranks = sorted(
+        {int(np.floor(h)) for h in positions.values()}
+        | {min(int(np.floor(h)) + 1, n - 1) for h in positions.values()}
+    )
+
+    # Per rank: values in (lo, hi], `below` values <= lo, `inside` in range
+    state = {
+        r: {
+            "lo": np.nextafter(moments.min, -np.inf),
+            "hi": moments.max,
+            "below": 0,
+            "inside": n,
+        }
+        for r in ranks
+    }
+    found = {}
+    while len(found) < len(ranks):
+        pending = [r for r in ranks if r not in found]
+        counts = {r: np.zeros(QUANTILE_BINS, dtype=np.int64) for r in pending}
+        kept = {r: [] for r in pending}
+        edges = {
+            r: np.linspace(state[r]["lo"], state[r]["hi"], QUANTILE_BINS + 1)
+            for r in pending
+        }
+        for values in passes():
+            x = np.asarray(values, dtype=np.float64)
+            x = x[~np.isnan(x)]
+            for r in pending:
+                st = state[r]
+                x_in = x[(x > st["lo"]) & (x <= st["hi"])]
+                if st["inside"] <= max_buffer:
+                    kept[r].append(x_in)
+                else:
+                    bins = np.searchsorted(edges[r], x_in, "left") - 1
+                    bins = np.clip(bins, 0, QUANTILE_BINS - 1)
+                    counts[r] += np.bincount(bins, minlength=QUANTILE_BINS)
+
+        for r in pending:
+            st = state[r]
+            if st["inside"] <= max_buffer:
+                values = np.sort(np.concatenate(kept[r]))
+                found[r] = values[r - st["below"]]
+                continue
+            cumulative = st["below"] + np.cumsum(counts[r])
+            j = int(np.searchsorted(cumulative, r, "right"))
+            lo, hi = edges[r][j], edges[r][j + 1]
+            if np.nextafter(lo, np.inf) >= hi:
+                # A single representable value left in range
+                found[r] = hi
+                continue
+            st["below"] = int(cumulative[j - 1]) if j else st["below"]
+            st["lo"], st["hi"], st["inside"] = lo, hi, int(counts[r][j])
+
+    results = {}
+    for q, h in positions.items():
+        lower = int(np.floor(h))
+        upper = min(lower + 1, n - 1)
+        results[q] = _lerp(found[lower], found[upper], h - lower)
+    return results
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Cohort Construction for PFAS-PhenoAge Study
+Single-pass SEQN join of the PFAS, demographic and biomarker tables
+"""
+
+import numpy as np
+import pandas as pd
+
+# Use a direct-address table when the SEQN range is at most this many
+# times the number of rows (NHANES SEQNs are dense within and across
+# cycles); otherwise fall back to a sorted index with searchsorted.
+DENSE_INDEX_MAX_SPAN = 16
+
+# Biomarkers counted for the "at least 7 available" exclusion
+EXCLUSION_BIOMARKERS = [
+    "LBXSAT",
+    "LBXSAL",
+    "LBXSCR",
+    "LBXGLU",
+    "LBXGH",
+    "LBXCRP",
+    "LBXLYPCT",
+    "LBXMCVSI",
+    "LBXRBWSI",
+    "LBXSAPSI",
+    "LBXWBCSI",
+]
+
+# Screened in this order for |z| > 4, each on the rows left by the previous
+OUTLIER_VARS = ["age", "PFOA", "PFOS", "PFHxS", "PFNA"]
+
+
+def _row_lookup(name, right_keys, left_keys, lo, span):
+    """Row position in the right table for every left key (-1 if absent)"""
+    if span is not None:
+        offsets = right_keys - lo
+        counts = np.bincount(offsets, minlength=span)
+        duplicated = int((counts > 1).sum())
+        if duplicated:
+            raise ValueError(
+                f"{name}: {duplicated} SEQN values appear more than once; "
+                "a many-to-one join would multiply rows"
+            )
+        lookup = np.full(span, -1, dtype=np.intp)
+        lookup[offsets] = np.arange(len(right_keys))
+        return lookup[left_keys - lo]
+
+    order = np.argsort(right_keys, kind="stable")
+    sorted_keys = right_keys[order]
+    duplicated = int((sorted_keys[1:] == sorted_keys[:-1]).sum())
+    if duplicated:
+        raise ValueError(
+            f"{name}: {duplicated} SEQN values appear more than once; "
+            "a many-to-one join would multiply rows"
+        )
+    if len(sorted_keys) == 0:
+        return np.full(len(left_keys), -1, dtype=np.intp)
+    pos = np.searchsorted(sorted_keys, left_keys)
+    pos = np.minimum(pos, len(sorted_keys) - 1)
+    found = sorted_keys[pos] == left_keys
+    return np.where(found, order[pos], -1)
+
+
+def _gather(series, rows, allow_fill=False):
+    """Take rows from a column; -1 rows become missing when allow_fill"""
+    if isinstance(series.dtype, np.dtype):
+        return pd.api.extensions.take(series.to_numpy(), rows, allow_fill=allow_fill)
+    return series.array.take(rows, allow_fill=allow_fill)
+
+
+def join_on_seqn(base, tables, inner=(), key="SEQN"):
+    """
+    Join several tables onto `base` by SEQN in a single pass
+
+    `tables` maps a name to (DataFrame, columns to bring over). Every table
+    must hold each SEQN at most once (many-to-one); a duplicated SEQN raises
+    ValueError instead of silently multiplying rows. Tables named in `inner`
+    drop base rows without a match, the rest behave like a left join. Base
+    row order is preserved, and the result is built with one gather per
+    output column, matching a chain of DataFrame.merge calls.
+    """
+    left_keys = base[key].to_numpy().astype(np.int64)
+
+    right_keys = {
+        name: df[key].to_numpy().astype(np.int64) for name, (df, _) in tables.items()
+    }
+    all_keys = [left_keys] + list(right_keys.values())
+    n_keys = sum(len(k) for k in all_keys)
+    lo = min((k.min() for k in all_keys if len(k)), default=0)
+    hi = max((k.max() for k in all_keys if len(k)), default=0)
+    span = int(hi - lo + 1)
+    if span > DENSE_INDEX_MAX_SPAN * max(n_keys, 1):
+        span = None
+
+    lookups = {
+        name: _row_lookup(name, right_keys[name], left_keys, lo, span)
+        for name in tables
+    }
+
+    # Base rows kept after inner joins
+    keep = np.ones(len(left_keys), dtype=bool)
+    for name in inner:
+        keep &= lookups[name] >= 0
+    base_rows = np.flatnonzero(keep)
+
+    columns = {}
+    for col in base.columns:
+        columns[col] = _gather(base[col], base_rows)
+
+    for name, (df, cols) in tables.items():
+        rows = lookups[name][base_rows]
+        for col in cols:
+            if col == key:
+                continue
+            if col in columns:
+                raise ValueError(f"{name}: column {col} already in the cohort")
+            columns[col] = _gather(df[col], rows, allow_fill=True)
+
+    return pd.DataFrame(columns)
+
+
+# Exclusion predicates on PFC/DEMO columns. Each returns a boolean mask
+# (True = kept); a predicate whose column is absent keeps every row.
+PFAS_COLUMNS = ["PFOA", "PFOS", "PFHxS", "PFNA"]
+
+
+def has_any_pfas(df):
+    """At least one of the four PFAS measured"""
+    available = [c for c in PFAS_COLUMNS if c in df.columns]
+    if not available:
+        return np.ones(len(df), dtype=bool)
+    return df[available].notna().any(axis=1).to_numpy()
+
+
+def is_adult(df):
+    """Age 18 or older"""
+    if "age" not in df.columns:
+        return np.ones(len(df), dtype=bool)
+    return (df["age"] >= 18).to_numpy()
+
+
+def not_pregnant(df):
+    """Not pregnant at exam (RIDEXPRG != 1; missing counts as not pregnant)"""
+    if "RIDEXPRG" not in df.columns:
+        return np.ones(len(df), dtype=bool)
+    return (df["RIDEXPRG"] != 1).to_numpy()
+
+
+def build_cohort(base, tables, predicates=(), screen=(), inner=(), keep=None):
+    """
+    Build the cohort with exclusion predicates pushed below the joins
+
+    The tables named in `screen` (e.g. demographics) are joined first and
+    `predicates`, an ordered list of (stage, predicate), are evaluated on
+    that narrow frame; screened tables named in `inner` drop unmatched
+    rows. The exclusion flow is recorded cumulatively in the declared
+    order, exactly as sequential filtering would report it. Only rows
+    passing the predicates named in `keep` (default: all) are then joined
+    to the remaining tables, so the expensive joins and everything
+    downstream see far fewer rows.
+
+    Returns (cohort, exclusions) where exclusions maps stage -> count,
+    starting with "initial".
+    """
+    screened = join_on_seqn(base, {name: tables[name] for name in screen}, inner=inner)
+
+    exclusions = {"initial": len(screened)}
+    passed = np.ones(len(screened), dtype=bool)
+    kept = np.ones(len(screened), dtype=bool)
+    for stage, predicate in predicates:
+        mask = np.asarray(predicate(screened), dtype=bool)
+        passed &= mask
+        exclusions[stage] = int(passed.sum())
+        if keep is None or stage in keep:
+            kept &= mask
+
+    rest = {name: table for name, table in tables.items() if name not in screen}
+    cohort = join_on_seqn(screened[kept], rest)
+    return cohort, exclusions
+
+
+# Exclusion criteria for apply_criteria: (name, stage, criterion), where
+# criterion(df, passed) returns a boolean mask over all rows of df (True =
+# kept) given the rows `passed` kept by the criteria before it. Row-level
+# rules ignore `passed`; screens whose thresholds depend on the sample so
+# far (z-scores) compute them over `passed` only and are marked
+# `conditional`.
+def min_available(columns, k):
+    """Criterion: at least k of `columns` non-missing, if k of them exist"""
+
+    def criterion(df, passed):
+        available = [c for c in columns if c in df.columns]
+        if len(available) < k:
+            return np.ones(len(df), dtype=bool)
+        return (df[available].notna().sum(axis=1) >= k).to_numpy()
+
+    return criterion
+
+
+def all_available(columns):
+    """Criterion: every one of `columns` non-missing"""
+
+    def criterion(df, passed):
+        return df[columns].notna().all(axis=1).to_numpy()
+
+    return criterion
+
+
+def zscore_screen(var, limit=4):
+    """
+    Criterion: |z| <= limit, with the mean and SD of `var` over the rows
+    passed so far; a missing value fails. Skipped (all kept) if `var` is
+    absent or its SD is not positive.
+    """
+
+    def criterion(df, passed):
+        if var not in df.columns:
+            return np.ones(len(df), dtype=bool)
+        kept = df[var][passed]
+        mean_val, std_val = kept.mean(), kept.std()
+        if not std_val > 0:
+            return np.ones(len(df), dtype=bool)
+        z_scores = np.abs((df[var] - mean_val) / std_val)
+        return (z_scores <= limit).to_numpy()
+
+    criterion.conditional = True
+    return criterion
+
+
+def apply_criteria(df, criteria, exclusions=None):
+    """
+    Evaluate ordered exclusion criteria as masks over the unfiltered `df`
+
+    The criteria's masks are combined by cumulative AND in one pass; each
+    criterion with a stage records the rows remaining after it in the
+    exclusion flow (the last of consecutive criteria sharing a stage
+    wins), exactly as filtering step by step would report it. Nothing is
+    copied: the caller materializes the rows once with df[mask].
+
+    Returns (mask, exclusions with the stages added, report DataFrame with
+    per criterion the rows it removes on its own, against the whole of
+    `df`, and in sequence, after the criteria before it).
+    """
+    exclusions = dict(exclusions or {})
+    everyone = np.ones(len(df), dtype=bool)
+    passed = everyone.copy()
+    rows = []
+    for name, stage, criterion in criteria:
+        # On its own first, so a criterion keeping state from its last call
+        # (outliers.outlier_screen) is left with the flow's
+        alone = None
+        if getattr(criterion, "conditional", False) and not passed.all():
+            alone = np.asarray(criterion(df, everyone), dtype=bool)
+        mask = np.asarray(criterion(df, passed), dtype=bool)
+        if alone is None:
+            alone = mask
+        before = int(passed.sum())
+        passed &= mask
+        remaining = int(passed.sum())
+        if stage is not None:
+            exclusions[stage] = remaining
+        rows.append(
+            {
+                "criterion": name,
+                "stage": stage,
+                "removed_alone": int(len(df) - np.count_nonzero(alone)),
+                "removed_in_sequence": before - remaining,
+                "remaining": remaining,
+            }
+        )
+    return passed, exclusions, pd.DataFrame(rows)
+
+
+def label_codes(codes, labels):
+    """
+    Map NHANES codes to labels as a categorical column
+
+    Categories are the sorted labels, so groupby, crosstab and patsy
+    treatment coding order the levels exactly as they did for plain
+    strings, while each row stores a one-byte code instead of a string.
+    Codes without a label become missing.
+    """
+    dtype = pd.CategoricalDtype(sorted(set(labels.values())))
+    return codes.map(labels).astype(dtype)
+
+
+def memory_report(df):
+    """
+    Per-column memory of the compact cohort against the wide layout
+
+    The wide layout is what the pipeline used before compact dtypes:
+    float64 numbers, int64 integers and Python string objects for labels.
+    Returns a DataFrame with column, dtype, bytes and wide_bytes.
+    """
+    rows = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_float_dtype(series.dtype):
+            wide = series.astype("float64")
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            wide = series.astype("int64")
+        else:
+            wide = series.astype(object)
+        rows.append(
+            {
+                "column": col,
+                "dtype": str(series.dtype),
+                "bytes": int(series.memory_usage(index=False, deep=True)),
+                "wide_bytes": int(wide.memory_usage(index=False, deep=True)),
+            }
+        )
+    return pd.DataFrame(rows)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Cohort Cache for PFAS-PhenoAge Study
+Script 01 materializes the merged, harmonized cohort once as Parquet, one
+partition per NHANES cycle; scripts 02-07 read back only the columns they
+need
+"""
+
+import io
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+STUDY_DIR = Path("/study")
+CACHE_DIR = STUDY_DIR / "04-analysis" / "cache"
+COHORT_CACHE = CACHE_DIR / "cohort"
+MANIFEST = CACHE_DIR / "manifest.json"
+
+# Bump when the merge logic changes so incremental runs rebuild every cycle
+MANIFEST_VERSION = 1
+
+# Individual-level data never leaves the cache directory (git-ignored).
+# Setting this variable to a Fernet key encrypts the cache at rest.
+CACHE_KEY_ENV = "PFAS_CACHE_KEY"
+
+
+def _fernet():
+    """Return a Fernet cipher if an encryption key is configured"""
+    key = os.environ.get(CACHE_KEY_ENV)
+    if not key:
+        return None
+    from cryptography.fernet import Fernet
+
+    return Fernet(key.encode())
+
+
+def _encrypted_path(path):
+    return path.with_name(path.name + ".enc")
+
+
+def write_cohort(df, path=COHORT_CACHE):
+    """Write the merged cohort to the columnar cache"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    cipher = _fernet()
+    if cipher is None:
+        df.to_parquet(path, index=False)
+        return path
+
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    enc_path = _encrypted_path(path)
+    with open(enc_path, "wb") as f:
+        f.write(cipher.encrypt(buffer.getvalue()))
+    return enc_path
+
+
+def _open_source(path):
+    cipher = _fernet()
+    if cipher is None:
+        if not path.exists():
+            raise FileNotFoundError(
+                f"Cohort cache {path} not found - run 01_data_prep.py first"
+            )
+        return path
+
+    enc_path = _encrypted_path(path)
+    if not enc_path.exists():
+        raise FileNotFoundError(
+            f"Encrypted cohort cache {enc_path} not found - run 01_data_prep.py first"
+        )
+    with open(enc_path, "rb") as f:
+        return io.BytesIO(cipher.decrypt(f.read()))
+
+
+def partition_path(cycle, cache_dir=COHORT_CACHE, part=None):
+    """
+    Path of one cycle's cohort partition (before any encryption suffix)
+
+    Chunked preparation writes a cycle as several numbered parts.
+    """
+    name = f"cycle_{cycle}" if part is None else f"cycle_{cycle}-{part:05d}"
+    return Path(cache_dir) / f"{name}.parquet"
+
+
+def _partition_files(cache_dir=COHORT_CACHE, cycle="*"):
+    """Cached partition files (plain paths), in cycle and part order"""
+    suffix = ".parquet.enc" if _fernet() is not None else ".parquet"
+    cache_dir = Path(cache_dir)
+    found = list(cache_dir.glob(f"cycle_{cycle}{suffix}"))
+    found += cache_dir.glob(f"cycle_{cycle}-*{suffix}")
+    plain = [
+        p.with_name(p.name[: -len(".enc")]) if p.suffix == ".enc" else p for p in found
+    ]
+    return sorted(set(plain), key=lambda p: p.name)
+
+
+def write_partition(df, cycle, cache_dir=COHORT_CACHE, part=None):
+    """
+    Write one cycle's merged cohort rows
+
+    Writing a whole cycle, or its first part, replaces any earlier copy.
+    """
+    if not part:
+        remove_partition(cycle, cache_dir)
+    return write_cohort(df, partition_path(cycle, cache_dir, part))
+
+
+def remove_partition(cycle, cache_dir=COHORT_CACHE):
+    """Drop a cycle's partition and parts, encrypted or not"""
+    cache_dir = Path(cache_dir)
+    for pattern in [f"cycle_{cycle}.parquet*", f"cycle_{cycle}-*.parquet*"]:
+        for path in cache_dir.glob(pattern):
+            path.unlink()
+
+
+def has_partition(cycle, cache_dir=COHORT_CACHE):
+    return bool(_partition_files(cache_dir, cycle))
+
+
+def _read_file(path, columns):
+    source = _open_source(path)
+    if columns is not None:
+        import pyarrow.parquet as pq
+
+        available = set(pq.ParquetFile(source).schema_arrow.names)
+        columns = [c for c in columns if c in available]
+        if hasattr(source, "seek"):
+            source.seek(0)
+    return pd.read_parquet(source, columns=columns)
+
+
+def read_cohort(columns=None, path=COHORT_CACHE):
+    """
+    Read the merged cohort from the cache
+
+    Cycle partitions are concatenated in cycle order. Only the requested
+    columns are read; requested columns that were not present in the source
+    files are skipped, so callers can keep testing `col in df.columns`
+    exactly as they did on the raw merge.
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return _read_file(path, columns)
+
+    files = _partition_files(path)
+    if not files:
+        raise FileNotFoundError(
+            f"Cohort cache {path} is empty - run 01_data_prep.py first"
+        )
+    return pd.concat([_read_file(f, columns) for f in files], ignore_index=True)
+
+
+def iter_cohort(columns=None, chunk_rows=100_000, path=COHORT_CACHE):
+    """
+    Stream the cached cohort in chunks of at most `chunk_rows` rows
+
+    Every chunk carries the same columns with the same dtypes as
+    read_cohort would return; a column missing from one partition is
+    filled with NaN, as pd.concat does. Only the Parquet row batches of the
+    current chunk are decoded into memory. Each partition is opened once
+    per pass, its schema read for the union and its rows streamed from the
+    same source; an encrypted partition is decrypted whole, so an encrypted
+    cache's (compressed) Parquet bytes are held until each is read.
+    """
+    import pyarrow.parquet as pq
+
+    files = _partition_files(path)
+    if not files:
+        raise FileNotFoundError(
+            f"Cohort cache {path} is empty - run 01_data_prep.py first"
+        )
+
+    # Union schema, in first-seen order
+    parquets = [pq.ParquetFile(_open_source(f)) for f in files]
+    dtypes = {}
+    for parquet in parquets:
+        schema = parquet.schema_arrow
+        for col, dtype in schema.empty_table().to_pandas().dtypes.items():
+            if columns is None or col in columns:
+                dtypes.setdefault(col, dtype)
+    if columns is not None:
+        dtypes = {c: dtypes[c] for c in columns if c in dtypes}
+
+    while parquets:
+        # Dropped once read, freeing its decrypted bytes
+        parquet = parquets.pop(0)
+        present = [c for c in dtypes if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=present):
+            chunk = batch.to_pandas()
+            for col, dtype in dtypes.items():
+                if col not in chunk.columns:
+                    chunk[col] = pd.Series(np.nan, index=chunk.index).astype(dtype)
+            yield chunk[list(dtypes)]
+
+
+def load_manifest(path=MANIFEST):
+    """Load the ingestion manifest; an outdated or missing one is empty"""
+    path = Path(path)
+    if path.exists():
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    return {"version": MANIFEST_VERSION, "cycles": {}}
+
+
+def save_manifest(manifest, path=MANIFEST):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
@@ -19,6 +19,22 @@ from scipy import stats
 import json
 import warnings
 
+from biomarkers import convert_biomarkers, log_range_report
+from cohort import (
+    all_available,
+    apply_criteria,
+    build_cohort,
+    has_any_pfas,
+    is_adult,
+    label_codes,
+    not_pregnant,
+)
+from nhanes_io import load_families, load_family
+from outliers import outlier_criteria, outlier_rules
+from phenoage import COMPONENTS, component_matrix, score
+from pipeline_log import PipelineLogger
+from regression import fit_exposures
+
 warnings.filterwarnings("ignore")
 
 # Paths
@@ -38,185 +54,127 @@ plt.style.use("seaborn-v0_8-whitegrid")
 sns.set_palette("husl")
 
 
-def log_message(msg):
-    """Log message to file and print"""
-    with open(LOG_FILE, "a") as f:
-        f.write(f"[complete_analysis] {msg}\n")
-    print(msg)
+log_message = PipelineLogger("complete_analysis", LOG_FILE)
 
 
 def load_pfas_data():
     """Load PFAS data from cycles D-G"""
     log_message("Loading PFAS data...")
 
-    pfas_files = {
-        "D": "PFC_D.csv",
-        "E": "PFC_E.csv",
-        "F": "PFC_F.csv",
-        "G": "PFC_G.csv",
-    }
+    pfas_cycles = ["D", "E", "F", "G"]
 
-    pfas_list = []
-    for cycle, filename in pfas_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["cycle"] = cycle
-            # Standardize PFAS variable names
-            for old, new in [
-                ("LBXPFOA", "PFOA"),
-                ("LBXPFOS", "PFOS"),
-                ("LBXPFHS", "PFHxS"),
-                ("LBXPFNA", "PFNA"),
-            ]:
-                if old in df.columns:
-                    df[new] = df[old]
-            pfas_list.append(df[["SEQN", "cycle", "PFOA", "PFOS", "PFHxS", "PFNA"]])
-            log_message(f"  Cycle {cycle}: {len(df)} records")
-
-    if pfas_list:
-        return pd.concat(pfas_list, ignore_index=True)
-    return None
+    pfas_df = load_family("PFC", pfas_cycles, DATA_DIR, log_message)
+    if pfas_df is None:
+        return None
+
+    # Standardize PFAS variable names
+    for old, new in [
+        ("LBXPFOA", "PFOA"),
+        ("LBXPFOS", "PFOS"),
+        ("LBXPFHS", "PFHxS"),
+        ("LBXPFNA", "PFNA"),
+    ]:
+        if old in pfas_df.columns:
+            pfas_df[new] = pfas_df[old]
+    for cycle, n in pfas_df["cycle"].value_counts(sort=False).items():
+        log_message(f"  Cycle {cycle}: {n} records")
+    return pfas_df[["SEQN", "cycle", "PFOA", "PFOS", "PFHxS", "PFNA"]]
 
 
 def load_demographics():
     """Load demographic data"""
     log_message("Loading demographics...")
 
-    demo_files = {
-        "D": "DEMO_D.csv",
-        "E": "DEMO_E.csv",
-        "F": "DEMO_F.csv",
-        "G": "DEMO_G.csv",
-    }
-
-    demo_list = []
-    for cycle, filename in demo_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            df["age"] = df["RIDAGEYR"]
-            df["sex"] = df["RIAGENDR"].map({1: "Male", 2: "Female"})
-            df["race_ethnicity"] = df["RIDRETH1"].map(
-                {
-                    1: "Mexican American",
-                    2: "Other Hispanic",
-                    3: "Non-Hispanic White",
-                    4: "Non-Hispanic Black",
-                    5: "Other",
-                }
-            )
-            df["education"] = df["DMDEDUC2"].map(
-                {1: "<HS", 2: "<HS", 3: "HS grad", 4: "Some college", 5: "College+"}
-            )
-            df["pir"] = df["INDFMPIR"]
-            demo_list.append(
-                df[
-                    [
-                        "SEQN",
-                        "age",
-                        "sex",
-                        "race_ethnicity",
-                        "education",
-                        "pir",
-                        "RIDEXPRG",
-                    ]
-                ]
-            )
-
-    if demo_list:
-        return pd.concat(demo_list, ignore_index=True)
-    return None
+    demo_cycles = ["D", "E", "F", "G"]
+
+    df = load_family("DEMO", demo_cycles, DATA_DIR, log_message)
+    if df is None:
+        return None
+
+    df["age"] = df["RIDAGEYR"]
+    df["sex"] = label_codes(df["RIAGENDR"], {1: "Male", 2: "Female"})
+    df["race_ethnicity"] = label_codes(
+        df["RIDRETH1"],
+        {
+            1: "Mexican American",
+            2: "Other Hispanic",
+            3: "Non-Hispanic White",
+            4: "Non-Hispanic Black",
+            5: "Other",
+        },
+    )
+    df["education"] = label_codes(
+        df["DMDEDUC2"],
+        {1: "<HS", 2: "<HS", 3: "HS grad", 4: "Some college", 5: "College+"},
+    )
+    df["pir"] = df["INDFMPIR"]
+    return df[
+        [
+            "SEQN",
+            "age",
+            "sex",
+            "race_ethnicity",
+            "education",
+            "pir",
+            "RIDEXPRG",
+        ]
+    ]
 
 
 def load_biomarkers():
     """Load biomarker data for PhenoAge"""
     log_message("Loading biomarkers...")
 
-    biomarker_data = {}
-
-    # BIOPRO (albumin, creatinine, glucose, ALP)
-    biopro_files = {"D": "BIOPRO_D.csv", "F": "BIOPRO_F.csv", "G": "BIOPRO_G.csv"}
-    biopro_list = []
-    for cycle, filename in biopro_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            biopro_list.append(df)
-    if biopro_list:
-        biomarker_data["biopro"] = pd.concat(biopro_list, ignore_index=True)
-
-    # CRP
-    crp_files = {"D": "CRP_D.csv", "E": "CRP_E.csv", "F": "CRP_F.csv"}
-    crp_list = []
-    for cycle, filename in crp_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            crp_list.append(df)
-    if crp_list:
-        biomarker_data["crp"] = pd.concat(crp_list, ignore_index=True)
-
-    # CBC (lymphocyte %, MCV, RDW, WBC)
-    cbc_files = {"D": "CBC_D.csv", "E": "CBC_E.csv", "F": "CBC_F.csv", "G": "CBC_G.csv"}
-    cbc_list = []
-    for cycle, filename in cbc_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            cbc_list.append(df)
-    if cbc_list:
-        biomarker_data["cbc"] = pd.concat(cbc_list, ignore_index=True)
-
-    # Glucose
-    glucose_files = {
-        "D": "GLU_D.csv",
-        "E": "GLU_E.csv",
-        "F": "GLU_F.csv",
-        "G": "GLU_G.csv",
+    # name -> (NHANES file family, cycles available)
+    biomarker_files = {
+        # BIOPRO (albumin, creatinine, glucose, ALP)
+        "biopro": ("BIOPRO", ["D", "F", "G"]),
+        "crp": ("CRP", ["D", "E", "F"]),
+        # CBC (lymphocyte %, MCV, RDW, WBC)
+        "cbc": ("CBC", ["D", "E", "F", "G"]),
+        "glucose": ("GLU", ["D", "E", "F", "G"]),
     }
-    glucose_list = []
-    for cycle, filename in glucose_files.items():
-        filepath = DATA_DIR / filename
-        if filepath.exists():
-            df = pd.read_csv(filepath)
-            glucose_list.append(df)
-    if glucose_list:
-        biomarker_data["glucose"] = pd.concat(glucose_list, ignore_index=True)
 
-    return biomarker_data
+    # Read every family x cycle file concurrently
+    return load_families(biomarker_files, DATA_DIR, log_message)
 
 
 def merge_all_data(pfas_df, demo_df, biomarker_data):
     """Merge all datasets"""
     log_message("Merging datasets...")
 
-    merged = pfas_df.merge(demo_df, on="SEQN", how="inner")
-    log_message(f"  After demo merge: {len(merged)} records")
-
-    # Merge BIOPRO
-    if "biopro" in biomarker_data:
-        bio_cols = ["SEQN", "LBXSAL", "LBXSCR", "LBXSAPSI", "LBXSGL"]
-        bio_cols = [c for c in bio_cols if c in biomarker_data["biopro"].columns]
-        merged = merged.merge(biomarker_data["biopro"][bio_cols], on="SEQN", how="left")
-
-    # Merge CRP
-    if "crp" in biomarker_data:
-        merged = merged.merge(
-            biomarker_data["crp"][["SEQN", "LBXCRP"]], on="SEQN", how="left"
-        )
-
-    # Merge CBC - CRITICAL: Use LBXRDW not LBXRBWSI!
-    if "cbc" in biomarker_data:
-        cbc_cols = ["SEQN", "LBXLYPCT", "LBXMCVSI", "LBXRDW", "LBXWBCSI"]
-        cbc_cols = [c for c in cbc_cols if c in biomarker_data["cbc"].columns]
-        merged = merged.merge(biomarker_data["cbc"][cbc_cols], on="SEQN", how="left")
-
-    # Merge glucose (supplement BIOPRO glucose with GLU)
-    if "glucose" in biomarker_data:
-        merged = merged.merge(
-            biomarker_data["glucose"][["SEQN", "LBXGLU"]], on="SEQN", how="left"
-        )
+    # Demographics are required (inner join); biomarkers are left-joined
+    tables = {"demo": (demo_df, [c for c in demo_df.columns if c != "SEQN"])}
+
+    biomarker_cols = {
+        # BIOPRO
+        "biopro": ["LBXSAL", "LBXSCR", "LBXSAPSI", "LBXSGL"],
+        # CRP
+        "crp": ["LBXCRP"],
+        # CBC - CRITICAL: Use LBXRDW not LBXRBWSI!
+        "cbc": ["LBXLYPCT", "LBXMCVSI", "LBXRDW", "LBXWBCSI"],
+        # Glucose (supplements BIOPRO glucose)
+        "glucose": ["LBXGLU"],
+    }
+    for name, cols in biomarker_cols.items():
+        if name in biomarker_data:
+            df = biomarker_data[name]
+            tables[name] = (df, [c for c in cols if c in df.columns])
+
+    # Exclude minors, pregnant participants and missing PFAS before the
+    # biomarker joins and PhenoAge scoring
+    merged, exclusions = build_cohort(
+        pfas_df,
+        tables,
+        predicates=[
+            ("after_age", is_adult),
+            ("after_pregnancy", not_pregnant),
+            ("after_pfas_missing", has_any_pfas),
+        ],
+        screen=["demo"],
+        inner=["demo"],
+    )
+    log_message(f"  After demo merge: {exclusions['initial']} records")
 
     # Fill glucose from either source
     if "LBXSGL" in merged.columns and "LBXGLU" in merged.columns:
@@ -227,7 +185,7 @@ def merge_all_data(pfas_df, demo_df, biomarker_data):
         merged["glucose_combined"] = merged["LBXGLU"]
 
     log_message(f"  Final merged: {len(merged)} records")
-    return merged
+    return merged, exclusions
 
 
 def calculate_phenoage(df):
@@ -267,37 +225,16 @@ def calculate_phenoage(df):
     log_message(f"  RDW non-null count: {df['rdw_pct'].notna().sum()}")
 
     # Convert to SI units for Levine formula
-    albumin_gL = df["albumin_gdL"] * 10  # g/dL → g/L
-    creatinine_umolL = df["creatinine_mgdL"] * 88.4  # mg/dL → μmol/L
-    glucose_mmolL = df["glucose_mgdL"] * 0.0555  # mg/dL → mmol/L
-    crp_mgL = df["crp_mgdL"] * 10  # mg/dL → mg/L
-    ln_crp = np.log(crp_mgL.clip(lower=0.01))  # Log with floor at 0.01
+    biomarkers, report = convert_biomarkers(df, "complete")
+    log_range_report(report, log_message)
 
     # Levine et al. 2018 coefficients (Table S7)
-    xb = (
-        -19.9067
-        - 0.0336 * albumin_gL
-        + 0.00951 * creatinine_umolL
-        + 0.1953 * glucose_mmolL
-        + 0.0954 * ln_crp
-        - 0.0120 * df["lymphocyte_pct"]
-        + 0.0268 * df["mcv_fL"]
-        + 0.3306 * df["rdw_pct"]
-        + 0.00188 * df["alp_UL"]
-        + 0.0554 * df["wbc_1000uL"]
-        + 0.0804 * df["age_years"]
+    matrix = component_matrix(
+        [biomarkers[c] for c in COMPONENTS if c != "age"] + [df["age_years"]]
+    )
+    df["phenoage"], df["phenoage_accel"] = score(
+        matrix, "table_s7", "complete", stable=True
     )
-
-    # Mortality score
-    mortality_score = 1 - np.exp((-1.51714 * np.exp(xb)) / 0.0076927)
-    mortality_score = mortality_score.clip(1e-10, 1 - 1e-10)
-
-    # PhenoAge
-    phenoage = 141.50225 + np.log(-0.00553 * np.log(1 - mortality_score)) / 0.09165
-    phenoage = phenoage.clip(0, 120)  # Reasonable range
-
-    df["phenoage"] = phenoage
-    df["phenoage_accel"] = phenoage - df["age_years"]
 
     log_message(
         f"  PhenoAge calculated for {df['phenoage'].notna().sum()} participants"
@@ -311,56 +248,68 @@ def calculate_phenoage(df):
     return df
 
 
-def apply_exclusions(df):
-    """Apply study exclusions"""
-    log_message("Applying exclusions...")
-
-    initial_n = len(df)
-    exclusions = {"initial": initial_n}
+# PhenoAge inputs that must all be present
+PHENOAGE_INPUTS = [
+    "albumin_gdL",
+    "creatinine_mgdL",
+    "glucose_mgdL",
+    "crp_mgdL",
+    "lymphocyte_pct",
+    "mcv_fL",
+    "rdw_pct",
+    "alp_UL",
+    "wbc_1000uL",
+]
+
+# Exclusions after merge_all_data, in order, for cohort.apply_criteria:
+# (criterion, exclusion flow stage, mask)
+EXCLUSION_CRITERIA = [
+    # Has PhenoAge data (all components non-null)
+    ("biomarkers_missing", "after_biomarkers", all_available(PHENOAGE_INPUTS)),
+]
 
-    # Age >= 18
-    df = df[df["age"] >= 18].copy()
-    exclusions["after_age"] = len(df)
+# Screened for outliers after EXCLUSION_CRITERIA (see outliers.outlier_criteria)
+OUTLIER_VARS = ["age", "PFOA", "PFOS", "PFHxS", "PFNA"] + PHENOAGE_INPUTS
 
-    # Not pregnant
-    df = df[df["RIDEXPRG"] != 1].copy()
-    exclusions["after_pregnancy"] = len(df)
 
-    # Has at least some PFAS data
-    pfas_cols = ["PFOA", "PFOS", "PFHxS", "PFNA"]
-    df = df[df[pfas_cols].notna().any(axis=1)].copy()
-    exclusions["after_pfas_missing"] = len(df)
+def apply_exclusions(df, exclusions):
+    """
+    Apply study exclusions
 
-    # Has PhenoAge data (all components non-null)
-    phenoage_components = [
-        "albumin_gdL",
-        "creatinine_mgdL",
-        "glucose_mgdL",
-        "crp_mgdL",
-        "lymphocyte_pct",
-        "mcv_fL",
-        "rdw_pct",
-        "alp_UL",
-        "wbc_1000uL",
-    ]
-    df = df[df[phenoage_components].notna().all(axis=1)].copy()
-    exclusions["after_biomarkers"] = len(df)
+    Age, pregnancy and missing-PFAS exclusions were applied and counted in
+    merge_all_data; this continues the flow from there, evaluating the
+    criteria as masks (see cohort.apply_criteria) and copying the analytic
+    sample out once.
+    """
+    log_message("Applying exclusions...")
 
-    # Outlier removal (|z| > 4)
-    continuous_vars = ["age", "PFOA", "PFOS", "PFHxS", "PFNA"] + phenoage_components
-    for var in continuous_vars:
-        if var in df.columns and df[var].notna().sum() > 0:
-            z_scores = np.abs((df[var] - df[var].mean()) / df[var].std())
-            df = df[z_scores <= 4].copy()
-    exclusions["after_outliers"] = len(df)
+    # Outlier removal (|z| > 4 per variable in turn, or the rules set in
+    # PFAS_OUTLIER_RULE)
+    criteria = EXCLUSION_CRITERIA + outlier_criteria(OUTLIER_VARS, outlier_rules())
+    mask, exclusions, report = apply_criteria(df, criteria, exclusions)
+    df = df[mask].copy()
 
     log_message(f"  Exclusion flow:")
     for stage, n in exclusions.items():
         log_message(f"    {stage}: {n}")
+    for r in report.itertuples():
+        log_message(
+            f"    {r.criterion}: removes {r.removed_alone} on its own, "
+            f"{r.removed_in_sequence} after the criteria before it"
+        )
 
     # Save exclusion flow
     exclusion_df = pd.DataFrame(list(exclusions.items()), columns=["stage", "count"])
     exclusion_df.to_csv(TABLE_DIR / "exclusion_flow.csv", index=False)
+    report.to_csv(TABLE_DIR / "exclusion_criteria.csv", index=False)
+    screen = criteria[-1][2]
+    if hasattr(screen, "report"):
+        screen.report.to_csv(TABLE_DIR / "outlier_flags.csv", index=False)
+        for r in screen.report[screen.report["variable"] == "any"].itertuples():
+            log_message(
+                f"    {r.rule}: flags {r.flagged} rows, {r.only_this_rule} by this "
+                "rule alone"
+            )
 
     return df
 
@@ -465,88 +414,35 @@ def run_main_analysis(df):
     """Run main regression analyses"""
     log_message("Running main regression analyses...")
 
-    results = []
     pfas_compounds = ["PFOA", "PFOS", "PFHxS", "PFNA"]
+    exposures = [f"log_{compound}" for compound in pfas_compounds]
+    models = [
+        ("Model 1 (Crude)", ""),
+        ("Model 2 (+Demographics)", "age + C(sex) + C(race_ethnicity)"),
+        ("Model 3 (+SES)", "age + C(sex) + C(race_ethnicity) + C(education) + pir"),
+    ]
 
-    for compound in pfas_compounds:
-        log_col = f"log_{compound}"
-
-        # Model 1: Crude
-        model1_df = df.dropna(subset=[log_col, "phenoage_accel"])
-        if len(model1_df) > 50:
-            X = sm.add_constant(model1_df[log_col])
-            y = model1_df["phenoage_accel"]
-            model1 = sm.OLS(y, X).fit()
-            results.append(
-                {
-                    "Compound": compound,
-                    "Model": "Model 1 (Crude)",
-                    "Beta": model1.params[log_col],
-                    "SE": model1.bse[log_col],
-                    "CI_Lower": model1.conf_int().loc[log_col, 0],
-                    "CI_Upper": model1.conf_int().loc[log_col, 1],
-                    "P_value": model1.pvalues[log_col],
-                    "N": len(model1_df),
-                }
-            )
-
-        # Model 2: + Demographics
-        model2_df = df.dropna(
-            subset=[log_col, "phenoage_accel", "age", "sex", "race_ethnicity"]
-        )
-        if len(model2_df) > 50:
-            try:
-                formula = (
-                    f"phenoage_accel ~ {log_col} + age + C(sex) + C(race_ethnicity)"
-                )
-                model2 = smf.ols(formula, data=model2_df).fit()
-                results.append(
-                    {
-                        "Compound": compound,
-                        "Model": "Model 2 (+Demographics)",
-                        "Beta": model2.params[log_col],
-                        "SE": model2.bse[log_col],
-                        "CI_Lower": model2.conf_int().loc[log_col, 0],
-                        "CI_Upper": model2.conf_int().loc[log_col, 1],
-                        "P_value": model2.pvalues[log_col],
-                        "N": len(model2_df),
-                    }
-                )
-            except:
-                pass
-
-        # Model 3: + SES
-        model3_df = df.dropna(
-            subset=[
-                log_col,
-                "phenoage_accel",
-                "age",
-                "sex",
-                "race_ethnicity",
-                "education",
-                "pir",
-            ]
-        )
-        if len(model3_df) > 50:
-            try:
-                formula = f"phenoage_accel ~ {log_col} + age + C(sex) + C(race_ethnicity) + C(education) + pir"
-                model3 = smf.ols(formula, data=model3_df).fit()
-                results.append(
-                    {
-                        "Compound": compound,
-                        "Model": "Model 3 (+SES)",
-                        "Beta": model3.params[log_col],
-                        "SE": model3.bse[log_col],
-                        "CI_Lower": model3.conf_int().loc[log_col, 0],
-                        "CI_Upper": model3.conf_int().loc[log_col, 1],
-                        "P_value": model3.pvalues[log_col],
-                        "N": len(model3_df),
-                    }
-                )
-            except:
-                pass
-
-    results_df = pd.DataFrame(results)
+    # All compounds of a model from one factorization per missing pattern
+    fits = [
+        fit_exposures(df, "phenoage_accel", exposures, covariates).assign(Model=model)
+        for model, covariates in models
+    ]
+    fits = pd.concat(fits, ignore_index=True)
+    fits["Compound"] = fits["exposure"].str.removeprefix("log_")
+    fits = fits.sort_values(
+        "Compound", key=lambda c: c.map(pfas_compounds.index), kind="stable"
+    )
+    results_df = fits.rename(
+        columns={
+            "beta": "Beta",
+            "se": "SE",
+            "ci_lower": "CI_Lower",
+            "ci_upper": "CI_Upper",
+            "p_value": "P_value",
+            "n": "N",
+        }
+    )[["Compound", "Model", "Beta", "SE", "CI_Lower", "CI_Upper", "P_value", "N"]]
+    results_df = results_df.reset_index(drop=True)
     results_df["P_value_formatted"] = results_df["P_value"].apply(
         lambda p: f"{p:.4f}" if p >= 0.001 else "<0.001"
     )
@@ -879,40 +775,52 @@ def main():
     log_message("=" * 60)
 
     # Load data
-    pfas_df = load_pfas_data()
-    demo_df = load_demographics()
-    biomarker_data = load_biomarkers()
+    with log_message.stage("load") as stage:
+        pfas_df = load_pfas_data()
+        demo_df = load_demographics()
+        biomarker_data = load_biomarkers()
+        stage["rows"] = len(pfas_df) if pfas_df is not None else 0
 
     if pfas_df is None or demo_df is None:
         log_message("ERROR: Could not load required data")
         return
 
     # Merge
-    merged_df = merge_all_data(pfas_df, demo_df, biomarker_data)
+    with log_message.stage("merge") as stage:
+        merged_df, exclusions = merge_all_data(pfas_df, demo_df, biomarker_data)
+        stage["rows"] = len(merged_df)
 
     # Calculate PhenoAge
-    merged_df = calculate_phenoage(merged_df)
+    with log_message.stage("phenoage"):
+        merged_df = calculate_phenoage(merged_df)
 
     # Apply exclusions
-    analytic_df = apply_exclusions(merged_df)
+    with log_message.stage("exclusions") as stage:
+        analytic_df = apply_exclusions(merged_df, exclusions)
+        stage["rows"] = len(analytic_df)
 
     # Create PFAS quartiles
     analytic_df = create_pfas_quartiles(analytic_df)
 
     # Generate descriptive stats
-    table1_df, pfas_summary_df = generate_descriptive_stats(analytic_df)
+    with log_message.stage("descriptive"):
+        table1_df, pfas_summary_df = generate_descriptive_stats(analytic_df)
 
     # Run main analysis
-    results_df = run_main_analysis(analytic_df)
+    with log_message.stage("main_analysis"):
+        results_df = run_main_analysis(analytic_df)
 
     # Run sensitivity analyses
-    sensitivity_df = run_sensitivity_analyses(analytic_df)
+    with log_message.stage("sensitivity"):
+        sensitivity_df = run_sensitivity_analyses(analytic_df)
 
     # Run mixture analysis
-    mixture_weights = run_mixture_analysis(analytic_df)
+    with log_message.stage("mixture"):
+        mixture_weights = run_mixture_analysis(analytic_df)
 
     # Create visualizations
-    create_visualizations(analytic_df, results_df)
+    with log_message.stage("figures"):
+        create_visualizations(analytic_df, results_df)
 
     # Create results summary
     create_results_summary(analytic_df, results_df)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Exclusion What-If Explorer for PFAS-PhenoAge Study
+Every exclusion criterion precomputed once as a packed bitset over the
+merged cohort, so the sample size and exclusion flow of any combination
+and ordering of criteria is a few bitwise ANDs and popcounts
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from biomarkers import convert_biomarkers
+from cohort import (
+    EXCLUSION_BIOMARKERS,
+    OUTLIER_VARS,
+    all_available,
+    apply_criteria,
+    has_any_pfas,
+    min_available,
+    zscore_screen,
+)
+from cohort_cache import read_cohort
+from phenoage import COMPONENTS
+
+# The nine PhenoAge biomarkers, converted from their schema sources
+PHENOAGE_BIOMARKERS = [c for c in COMPONENTS if c != "age"]
+
+# Criteria that can be switched on and off, as (name, stage, criterion)
+# for cohort.apply_criteria. 01_data_prep requires 7 of its 11 listed
+# biomarkers, complete_analysis all nine PhenoAge ones.
+WHAT_IF_CRITERIA = [
+    ("pfas_measured", "pfas_measured", lambda df, passed: has_any_pfas(df)),
+    (
+        "biomarkers_7_of_11",
+        "biomarkers_7_of_11",
+        min_available(EXCLUSION_BIOMARKERS, 7),
+    ),
+    ("phenoage_7_of_9", "phenoage_7_of_9", min_available(PHENOAGE_BIOMARKERS, 7)),
+    ("phenoage_all_9", "phenoage_all_9", all_available(PHENOAGE_BIOMARKERS)),
+] + [(f"outlier_{var}", f"outlier_{var}", zscore_screen(var)) for var in OUTLIER_VARS]
+
+# 01_data_prep's exclusions after the merge, in its order
+DEFAULT_ORDER = ["pfas_measured", "biomarkers_7_of_11"] + [
+    f"outlier_{var}" for var in OUTLIER_VARS
+]
+
+
+class ExclusionBitsets:
+    """
+    Exclusion criteria as packed bitsets over one cohort
+
+    Each criterion's mask is evaluated once against the whole cohort and
+    stored as one bit per row (padded to 64-bit words), so the rows kept
+    by any set of criteria are an AND of their words and their number a
+    popcount, without touching the cohort again. Z-score screens are
+    therefore fixed at the whole-cohort mean and SD; the scripts compute
+    them over the rows left by the criteria before (see exact_flow).
+    """
+
+    def __init__(self, names, masks):
+        masks = np.asarray(masks, dtype=bool).reshape(len(names), -1)
+        self.names = list(names)
+        self.rows = masks.shape[1]
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+        words = -(-self.rows // 64)
+        packed = np.zeros((len(self.names) + 1, words * 8), dtype=np.uint8)
+        packed[:-1, : -(-self.rows // 8)] = np.packbits(masks, axis=1)
+        packed[-1, : -(-self.rows // 8)] = np.packbits(np.ones(self.rows, bool))
+        bits = packed.view(np.uint64)
+        self.bits, self._all = bits[:-1], bits[-1]
+
+    @classmethod
+    def from_criteria(cls, df, criteria=WHAT_IF_CRITERIA):
+        everyone = np.ones(len(df), dtype=bool)
+        return cls(
+            [name for name, _, _ in criteria],
+            [criterion(df, everyone) for _, _, criterion in criteria],
+        )
+
+    def _words(self, names):
+        words = self._all
+        for name in names:
+            words = words & self.bits[self._index[name]]
+        return words
+
+    def count(self, names=()):
+        """Rows kept by all of `names`"""
+        return int(np.bitwise_count(self._words(names)).sum())
+
+    def mask(self, names=()):
+        """Boolean row mask kept by all of `names`, to materialize a sample"""
+        packed = self._words(names).view(np.uint8)
+        return np.unpackbits(packed, count=self.rows).astype(bool)
+
+    def flow(self, order):
+        """Exclusion flow applying `order` one criterion after another"""
+        rows = [{"stage": "initial", "count": self.rows, "removed": 0}]
+        words = self._all
+        for name in order:
+            words = words & self.bits[self._index[name]]
+            n = int(np.bitwise_count(words).sum())
+            rows.append({"stage": name, "count": n, "removed": rows[-1]["count"] - n})
+        return pd.DataFrame(rows)
+
+    def sensitivity(self, names=None):
+        """
+        Sample size under every one of the 2^k combinations of `names`
+        (default: all criteria), one AND and popcount per combination by
+        walking the combinations depth first. Returns one row per
+        combination: a column per criterion (True = applied), n and the
+        rows it excludes.
+        """
+        names = list(self.names if names is None else names)
+        bits = [self.bits[self._index[name]] for name in names]
+        applied = np.zeros((2 ** len(names), len(names)), dtype=bool)
+        counts = np.empty(2 ** len(names), dtype=np.int64)
+
+        stack = [(0, 0, self._all)]
+        while stack:
+            start, combination, words = stack.pop()
+            counts[combination] = np.bitwise_count(words).sum()
+            for j in range(start, len(names)):
+                stack.append((j + 1, combination | 1 << j, words & bits[j]))
+        for j in range(len(names)):
+            applied[:, j] = (np.arange(len(counts)) >> j) & 1
+
+        table = pd.DataFrame(applied, columns=names)
+        table["n"] = counts
+        table["excluded"] = self.rows - counts
+        return table
+
+
+def whatif_cohort():
+    """The merged cohort with its PhenoAge biomarkers converted"""
+    cohort = read_cohort()
+    biomarkers, _ = convert_biomarkers(cohort)
+    for col in PHENOAGE_BIOMARKERS:
+        cohort[col] = biomarkers[col]
+    return cohort
+
+
+def exact_flow(df, order, criteria=WHAT_IF_CRITERIA):
+    """
+    Exclusion flow of `order` with z-score screens recomputed on the rows
+    left by the criteria before them, as the scripts apply them
+    """
+    by_name = {name: (name, stage, c) for name, stage, c in criteria}
+    _, exclusions, _ = apply_criteria(
+        df, [by_name[name] for name in order], {"initial": len(df)}
+    )
+    return pd.DataFrame(list(exclusions.items()), columns=["stage", "count"])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Sample size and exclusion flow under any set of criteria"
+    )
+    parser.add_argument(
+        "--order",
+        nargs="+",
+        default=DEFAULT_ORDER,
+        choices=[name for name, _, _ in WHAT_IF_CRITERIA],
+        help="criteria to apply, in order (default: 01_data_prep's)",
+    )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="also recompute the flow with sequential z-score screens",
+    )
+    parser.add_argument(
+        "--all",
+        metavar="CSV",
+        default=None,
+        help="write the sample size under every combination of criteria",
+    )
+    args = parser.parse_args()
+
+    cohort = whatif_cohort()
+    start = time.perf_counter()
+    bitsets = ExclusionBitsets.from_criteria(cohort)
+    print(
+        f"{len(bitsets.names)} criteria over {bitsets.rows:,} rows "
+        f"precomputed in {time.perf_counter() - start:.3f}s"
+    )
+
+    print(bitsets.flow(args.order).to_string(index=False))
+    if args.exact:
+        print("\nWith sequential z-score screens:")
+        print(exact_flow(cohort, args.order).to_string(index=False))
+
+    if args.all:
+        start = time.perf_counter()
+        table = bitsets.sensitivity()
+        seconds = time.perf_counter() - start
+        table.to_csv(args.all, index=False)
+        print(
+            f"\n{len(table):,} combinations in {seconds * 1000:.1f} ms "
+            f"({seconds / len(table) * 1e6:.1f} us each): {args.all}"
+        )
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Component Imputation for PFAS-PhenoAge Study
+Median imputation of missing PhenoAge components, stratified by cycle, sex
+and age band, fitted once on the cached cohort and reused by every script
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from biomarkers import convert_biomarkers
+from cohort_cache import CACHE_DIR, load_manifest, read_cohort
+from phenoage import COMPONENTS
+
+# "stratified" (cycle x sex x age band medians) or "median" (whole-sample
+# median, as the scripts used to compute for themselves)
+STRATEGY_ENV = "PFAS_IMPUTATION"
+DEFAULT_STRATEGY = "stratified"
+
+# Components imputed (age is never missing in the analytic sample)
+IMPUTED = [c for c in COMPONENTS if c != "age"]
+
+AGE_BANDS = [18, 30, 40, 50, 60, 70, np.inf]
+AGE_BAND_LABELS = ["18-29", "30-39", "40-49", "50-59", "60-69", "70+"]
+
+# stratum -> labels per row (strings; missing or unknown values are NaN)
+STRATA = {
+    "cycle": lambda df: df["cycle"].astype(str).where(df["cycle"].notna()),
+    "sex": lambda df: df["RIAGENDR"].map({1: "Male", 2: "Female"}),
+    "age_band": lambda df: pd.cut(
+        df["age"], AGE_BANDS, right=False, labels=AGE_BAND_LABELS
+    ).astype(str),
+}
+
+# Strata used by each strategy, coarsest-last: a cell with fewer than
+# MIN_CELL observed values, or a row with an unknown stratum, falls back
+# to the cell with the first stratum dropped, and finally to the overall
+# median
+STRATEGIES = {
+    "stratified": ["cycle", "sex", "age_band"],
+    "median": [],
+}
+MIN_CELL = 20
+
+MODEL_VERSION = 1
+
+
+def _labels(df, stratum):
+    """Labels of one stratum per row, all NaN if its source is missing"""
+    try:
+        labels = STRATA[stratum](df)
+    except KeyError:
+        return pd.Series(np.nan, index=df.index, dtype=object)
+    return labels.where(labels != "nan")
+
+
+def _codes(df, strata, levels):
+    """(n x s) level codes, -1 for a missing or unseen label"""
+    codes = np.empty((len(df), len(strata)), dtype=np.int64)
+    for j, stratum in enumerate(strata):
+        labels = _labels(df, stratum)
+        codes[:, j] = pd.Categorical(labels, categories=levels[stratum]).codes
+    return codes
+
+
+def fit_imputer(df, strategy=DEFAULT_STRATEGY, columns=IMPUTED, min_cell=MIN_CELL):
+    """
+    Fit stratified medians of `columns` on `df`
+
+    Returns a JSON-serializable model. Its "tables" hold, for the full
+    strata and for each coarser level down to the overall median, one row
+    of medians per cell, with sparse cells already resolved to their
+    fallback, so applying it is a lookup.
+    """
+    strata = STRATEGIES[strategy]
+    columns = [c for c in columns if c in df.columns]
+    values = df[columns].to_numpy(dtype=np.float64)
+    levels = {s: sorted(_labels(df, s).dropna().unique().tolist()) for s in strata}
+    codes = _codes(df, strata, levels)
+
+    # Coarsest level first, so each finer level can fall back to it
+    overall = (
+        np.nanmedian(values, axis=0) if len(values) else np.full(len(columns), np.nan)
+    )
+    tables = [overall[None, :]]
+    for k in range(len(strata) - 1, -1, -1):
+        level = strata[k:]
+        shape = [len(levels[s]) for s in level]
+        cells = int(np.prod(shape))
+        coarser = tables[0]
+        known = (codes[:, k:] >= 0).all(axis=1)
+        flat = np.ravel_multi_index(codes[known, k:].T, shape) if cells else []
+        # Parent cell: the same labels without this level's first stratum
+        parent = (
+            np.ravel_multi_index(
+                np.unravel_index(np.arange(cells), shape)[1:], shape[1:]
+            )
+            if len(shape) > 1
+            else np.zeros(cells, dtype=np.int64)
+        )
+        table = coarser[parent].copy()
+        frame = pd.DataFrame(values[known], columns=columns)
+        frame["cell"] = flat
+        grouped = frame.groupby("cell")
+        medians, counts = grouped.median(), grouped.count()
+        for j, col in enumerate(columns):
+            dense = counts[col] >= min_cell
+            table[medians.index[dense], j] = medians.loc[dense, col]
+        tables.insert(0, table)
+
+    return {
+        "version": MODEL_VERSION,
+        "strategy": strategy,
+        "columns": columns,
+        "strata": strata,
+        "levels": levels,
+        "min_cell": min_cell,
+        "rows": len(df),
+        "tables": [t.tolist() for t in tables],
+    }
+
+
+def apply_imputer(df, model):
+    """
+    Imputed copies of the model's columns present in `df`
+
+    Each row's cell index is computed for every level at once; rows take
+    the medians of the finest level whose strata they all have, and only
+    missing values are replaced. Returns (imputed DataFrame on df's index,
+    number of values imputed per column).
+    """
+    strata = model["strata"]
+    columns = [c for c in model["columns"] if c in df.columns]
+    positions = [model["columns"].index(c) for c in columns]
+    tables = [np.asarray(t, dtype=np.float64)[:, positions] for t in model["tables"]]
+    codes = _codes(df, strata, model["levels"])
+
+    fill = np.broadcast_to(tables[-1][0], (len(df), len(columns))).copy()
+    for k in range(len(strata) - 1, -1, -1):
+        shape = [len(model["levels"][s]) for s in strata[k:]]
+        known = (codes[:, k:] >= 0).all(axis=1)
+        if known.any():
+            fill[known] = tables[k][np.ravel_multi_index(codes[known, k:].T, shape)]
+
+    values = df[columns].to_numpy(dtype=np.float64)
+    missing = np.isnan(values)
+    imputed = np.where(missing, fill, values)
+    return (
+        pd.DataFrame(imputed, index=df.index, columns=columns),
+        dict(zip(columns, missing.sum(axis=0).tolist())),
+    )
+
+
+def cohort_fingerprint():
+    """Checksum of the source files recorded in the cohort manifest"""
+    cycles = json.dumps(load_manifest()["cycles"], sort_keys=True)
+    return hashlib.sha256(cycles.encode()).hexdigest()
+
+
+def model_path(profile, strategy, cache_dir=CACHE_DIR):
+    return Path(cache_dir) / f"imputation_{profile or 'schema'}_{strategy}.json"
+
+
+def fit_cohort_imputer(profile=None, strategy=DEFAULT_STRATEGY):
+    """
+    Fit on the analytic base of the cached cohort: adults, not pregnant,
+    components converted with the given biomarkers profile
+    """
+    cohort = read_cohort()
+    cohort = cohort[(cohort["age"] >= 18) & (cohort["RIDEXPRG"] != 1)]
+    biomarkers, _ = convert_biomarkers(cohort, profile)
+    for stratum_source in ["cycle", "RIAGENDR", "age"]:
+        if stratum_source in cohort.columns:
+            biomarkers[stratum_source] = cohort[stratum_source]
+    return fit_imputer(biomarkers, strategy)
+
+
+def load_imputer(profile=None, strategy=None, log=print, cache_dir=CACHE_DIR):
+    """
+    The imputation model for a biomarkers profile, fitted once per cohort
+
+    The model is kept next to the cohort cache and refitted only when the
+    cohort's source files (per the manifest) or the model format change.
+    """
+    strategy = strategy or os.environ.get(STRATEGY_ENV, DEFAULT_STRATEGY)
+    path = model_path(profile, strategy, cache_dir)
+    fingerprint = cohort_fingerprint()
+    if path.exists():
+        with open(path) as f:
+            model = json.load(f)
+        if model.get("version") == MODEL_VERSION and model.get("cohort") == fingerprint:
+            return model
+
+    model = fit_cohort_imputer(profile, strategy)
+    model["cohort"] = fingerprint
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + ".tmp")
+    with open(partial, "w") as f:
+        json.dump(model, f)
+    partial.replace(path)
+    log(f"  Fitted {strategy} imputation on {model['rows']} rows: {path.name}")
+    return model
+
+
+def add_imputed(df, profile=None, log=print):
+    """
+    Add `<component>_imputed` columns (and age_imputed) to `df` from the
+    shared imputation model, logging how many values were filled
+    """
+    model = load_imputer(profile, log=log)
+    imputed, counts = apply_imputer(df, model)
+    for col in imputed.columns:
+        df[f"{col}_imputed"] = imputed[col]
+    if "age" in df.columns:
+        df["age_imputed"] = df["age"]
+    filled = ", ".join(f"{c} {n}" for c, n in counts.items() if n)
+    log(f"  Imputed ({model['strategy']}): {filled or 'nothing missing'}")
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit and show the imputation model")
+    parser.add_argument("--profile", default=None)
+    parser.add_argument("--strategy", default=None, choices=list(STRATEGIES))
+    args = parser.parse_args()
+
+    model = load_imputer(args.profile, args.strategy)
+    overall = dict(zip(model["columns"], model["tables"][-1][0]))
+    print(f"{model['strategy']} model, {model['rows']} rows, strata {model['strata']}")
+    print("Overall medians:", {k: round(v, 3) for k, v in overall.items()})
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Multiple Imputation for PFAS-PhenoAge Study
+Chained-equation imputation with predictive mean matching, run m times in
+a process pool over one shared copy of the data, and Rubin's-rules pooling
+of the estimates from each imputed dataset
+"""
+
+import multiprocessing as mp
+import os
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# Imputed datasets, and rounds of chained equations per dataset
+IMPUTATIONS = 20
+ITERATIONS = 10
+
+# Observed values closest in predicted mean from which each imputed value
+# is drawn
+DONORS = 5
+
+# Ridge penalty, relative to the diagonal of X'X, against near-collinear
+# predictors (as in mice); a predictor that is constant among the observed
+# rows, such as the cycle indicator of a cycle without CRP, is dropped by
+# the pseudo-inverse
+RIDGE = 1e-5
+
+
+def _block(values, levels):
+    """Predictor columns of one variable: itself, or its level indicators"""
+    if levels is None:
+        return values[:, None]
+    return (values[:, None] == levels[None, 1:]).astype(np.float64)
+
+
+def _pmm_draw(design, y, missing, rng, donors=DONORS):
+    """
+    Imputations of y[missing] by predictive mean matching
+
+    Regression coefficients are drawn from their posterior (as in mice's
+    norm.draw), the missing rows' predictions under the draw are matched
+    to the observed rows' predictions under the estimate, and each missing
+    value is copied from one of its `donors` nearest observed rows.
+    """
+    x_obs, y_obs = design[~missing], y[~missing]
+    xtx = x_obs.T @ x_obs
+    xtx[np.diag_indices_from(xtx)] *= 1 + RIDGE
+    inverse = np.linalg.pinv(xtx)
+    coef = inverse @ (x_obs.T @ y_obs)
+    resid = y_obs - x_obs @ coef
+    sigma = np.sqrt(resid @ resid / rng.chisquare(max(len(y_obs) - len(coef), 1)))
+    eigenvalues, eigenvectors = np.linalg.eigh((inverse + inverse.T) / 2)
+    root = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+    drawn = coef + root @ rng.standard_normal(len(coef)) * sigma
+
+    fitted = x_obs @ coef
+    order = np.argsort(fitted, kind="stable")
+    fitted = fitted[order]
+    target = design[missing] @ drawn
+
+    # The k nearest of sorted values lie within k places either side of
+    # the insertion point; take a window of 2k there and its k closest
+    window = min(2 * donors, len(fitted))
+    donors = min(donors, window)
+    start = np.clip(np.searchsorted(fitted, target) - donors, 0, len(fitted) - window)
+    candidates = start[:, None] + np.arange(window)
+    distance = np.abs(fitted[candidates] - target[:, None])
+    nearest = np.argpartition(distance, donors - 1, axis=1)[:, :donors]
+    pick = nearest[np.arange(len(target)), rng.integers(0, donors, len(target))]
+    return y_obs[order[candidates[np.arange(len(target)), pick]]]
+
+
+def chained_equations(
+    matrix, rng, categorical=(), iterations=ITERATIONS, donors=DONORS
+):
+    """
+    One imputed copy of `matrix` (n x p, NaN for missing)
+
+    Missing values start as random draws from their column's observed
+    values; each round then re-imputes every incomplete column from all
+    others by predictive mean matching, so imputed values are always
+    values observed elsewhere. Columns listed in `categorical` (indices)
+    enter the other regressions as level indicators. Columns with no
+    observed value are left missing and are not used as predictors.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    n, p = matrix.shape
+    missing = np.isnan(matrix)
+    usable = [j for j in range(p) if not missing[:, j].all()]
+    targets = [j for j in usable if missing[:, j].any()]
+    levels = [
+        np.unique(matrix[~missing[:, j], j]) if j in categorical else None
+        for j in range(p)
+    ]
+
+    filled = matrix.copy()
+    for j in targets:
+        observed = matrix[~missing[:, j], j]
+        filled[missing[:, j], j] = rng.choice(observed, missing[:, j].sum())
+    blocks = {j: _block(filled[:, j], levels[j]) for j in usable}
+    intercept = np.ones((n, 1))
+
+    for _ in range(iterations):
+        for j in targets:
+            design = np.hstack([intercept] + [blocks[k] for k in usable if k != j])
+            filled[missing[:, j], j] = _pmm_draw(
+                design, filled[:, j], missing[:, j], rng, donors
+            )
+            blocks[j] = _block(filled[:, j], levels[j])
+    return filled
+
+
+# State of a worker process: the shared data and what to run on it
+_WORKER = {}
+
+
+def _attach(name, shape, columns, categorical, analysis, seed, iterations, donors):
+    """Pool initializer: map the shared data into this process"""
+    memory = SharedMemory(name=name)
+    _WORKER.update(
+        memory=memory,
+        matrix=np.ndarray(shape, dtype=np.float64, buffer=memory.buf),
+        columns=columns,
+        categorical=categorical,
+        analysis=analysis,
+        seed=seed,
+        iterations=iterations,
+        donors=donors,
+    )
+
+
+def _impute_one(i):
+    """Impute dataset i (its own random stream) and run the analysis on it"""
+    matrix = _WORKER["matrix"]
+    rng = np.random.default_rng([_WORKER["seed"], i])
+    filled = chained_equations(
+        matrix, rng, _WORKER["categorical"], _WORKER["iterations"], _WORKER["donors"]
+    )
+    imputed = pd.DataFrame(filled, columns=_WORKER["columns"])
+    original = pd.DataFrame(matrix, columns=_WORKER["columns"], copy=False)
+    return _WORKER["analysis"](imputed, original)
+
+
+def multiply_impute(
+    data,
+    analysis,
+    m=IMPUTATIONS,
+    categorical=(),
+    seed=0,
+    processes=None,
+    iterations=ITERATIONS,
+    donors=DONORS,
+):
+    """
+    Results of `analysis` on m imputations of `data`, one per dataset
+
+    `data` is a numeric DataFrame (NaN for missing); `categorical` names
+    its columns of category codes. Its values are copied once into shared
+    memory, which every worker maps instead of receiving a pickled frame;
+    only the dataset number goes to a worker and only the analysis result
+    comes back. `analysis(imputed, original)` gets the imputed DataFrame
+    and a read-only view of the data (for missingness) on a 0..n-1 index,
+    and must be picklable, e.g. a module-level function. Dataset i is
+    drawn from seed (seed, i), so results do not depend on `processes`
+    (default: one per CPU, at most m; 1 runs in this process).
+    """
+    if m < 2:
+        raise ValueError("Multiple imputation needs at least 2 imputations")
+    columns = list(data.columns)
+    codes = [columns.index(c) for c in categorical]
+    values = data.to_numpy(dtype=np.float64)
+    processes = processes or min(m, os.cpu_count() or 1)
+
+    memory = SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        shared = np.ndarray(values.shape, dtype=np.float64, buffer=memory.buf)
+        shared[:] = values
+        del shared
+        initargs = (
+            memory.name,
+            values.shape,
+            columns,
+            codes,
+            analysis,
+            seed,
+            iterations,
+            donors,
+        )
+        if processes == 1:
+            _attach(*initargs)
+            try:
+                return [_impute_one(i) for i in range(m)]
+            finally:
+                _WORKER.pop("matrix")
+                _WORKER.pop("memory").close()
+        with mp.Pool(processes, initializer=_attach, initargs=initargs) as pool:
+            return pool.map(_impute_one, range(m))
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def rubin_pool(estimates, variances, alpha=0.05):
+    """
+    Pool m complete-data estimates by Rubin's rules
+
+    `estimates` and `variances` (squared standard errors) hold one entry
+    per imputation along the first axis. Returns arrays of the pooled
+    estimate, its standard error (within plus (1 + 1/m) x between
+    variance), Rubin's degrees of freedom, the 1 - alpha interval, the
+    two-sided p-value, the relative increase in variance due to
+    missingness and the fraction of missing information.
+    """
+    q = np.asarray(estimates, dtype=np.float64)
+    u = np.asarray(variances, dtype=np.float64)
+    m = len(q)
+    qbar = q.mean(axis=0)
+    within = u.mean(axis=0)
+    between = q.var(axis=0, ddof=1)
+    total = within + (1 + 1 / m) * between
+    se = np.sqrt(total)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        riv = (1 + 1 / m) * between / within
+        df = (m - 1) * (1 + 1 / riv) ** 2
+        fmi = (riv + 2 / (df + 3)) / (riv + 1)
+    crit = stats.t.ppf(1 - alpha / 2, df)
+    return {
+        "estimate": qbar,
+        "se": se,
+        "df": df,
+        "ci_lower": qbar - crit * se,
+        "ci_upper": qbar + crit * se,
+        "p_value": 2 * stats.t.sf(np.abs(qbar / se), df),
+        "riv": riv,
+        "fmi": fmi,
+    }
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Outlier Rules for PFAS-PhenoAge Study
+Order-independent outlier rules over all continuous variables at once:
+z-score against the pre-filter sample, robust (median/MAD) z-score and
+per-cycle z-score, fitted in memory or from chunks with mergeable
+accumulators, reporting which rule flagged each excluded row
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from chunked import RunningMoments, exact_quantiles
+from cohort import zscore_screen
+
+# "sequential" (the scripts' |z| > 4 screens, one variable after another
+# on the rows left by the previous) or a comma-separated list of RULES,
+# a row being excluded if any of them flags any variable
+OUTLIER_RULE_ENV = "PFAS_OUTLIER_RULE"
+DEFAULT_RULE = "sequential"
+
+# rule -> limit on |score|. zscore: (x - mean) / SD over the sample before
+# outlier screening; robust: (x - median) / (1.4826 x MAD), the MAD
+# scaled to the SD of a normal; cycle: z-score within the NHANES cycle
+RULES = {"zscore": 4.0, "robust": 3.5, "cycle": 4.0}
+MAD_SCALE = 1.4826
+
+# Column grouping the "cycle" rule
+GROUP_COLUMN = "cycle"
+
+
+def outlier_rules():
+    """Rules selected by PFAS_OUTLIER_RULE, or None for the sequential screens"""
+    setting = os.environ.get(OUTLIER_RULE_ENV, DEFAULT_RULE)
+    if setting == DEFAULT_RULE:
+        return None
+    rules = [r.strip() for r in setting.split(",") if r.strip()]
+    unknown = [r for r in rules if r not in RULES]
+    if unknown or not rules:
+        raise ValueError(
+            f"{OUTLIER_RULE_ENV}={setting!r}: expected {DEFAULT_RULE!r} or "
+            f"a comma-separated list of {list(RULES)}"
+        )
+    return rules
+
+
+class ColumnMoments:
+    """
+    Count, mean and M2 of several columns per group, merged across chunks
+
+    update(values, labels) takes an (n x p) chunk and its group labels
+    (None for one group; rows with a missing label only count towards
+    the overall moments). Per-group sums are one indicator product for
+    all columns; chunks and instances merge as in RunningMoments.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.groups = []
+        p = len(self.columns)
+        self.n = np.zeros((0, p))
+        self.mean = np.zeros((0, p))
+        self.m2 = np.zeros((0, p))
+        self.overall = [RunningMoments() for _ in self.columns]
+
+    def _chunk_moments(self, values, codes, groups):
+        observed = ~np.isnan(values)
+        x = np.where(observed, values, 0.0)
+        indicator = np.zeros((groups, len(values)))
+        known = codes >= 0
+        indicator[codes[known], np.flatnonzero(known)] = 1.0
+        n = indicator @ observed
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(n > 0, (indicator @ x) / n, 0.0)
+        deviation = np.where(observed, values - mean[np.maximum(codes, 0)], 0.0)
+        deviation[~known] = 0.0
+        return n, mean, indicator @ deviation**2
+
+    def _merge(self, n, mean, m2):
+        total = self.n + n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean - self.mean
+            share = np.where(total > 0, n / total, 0.0)
+            self.mean = self.mean + delta * share
+            self.m2 = self.m2 + m2 + np.where(total > 0, delta**2 * self.n * share, 0)
+        self.n = total
+
+    def _grow(self, labels):
+        for label in labels:
+            if label not in self.groups:
+                self.groups.append(label)
+                zeros = np.zeros((1, len(self.columns)))
+                self.n = np.vstack([self.n, zeros])
+                self.mean = np.vstack([self.mean, zeros])
+                self.m2 = np.vstack([self.m2, zeros])
+
+    def update(self, values, labels=None):
+        values = np.asarray(values, dtype=np.float64)
+        for j, moments in enumerate(self.overall):
+            moments.update(values[:, j])
+        if labels is None:
+            return
+        labels = pd.Series(labels)
+        present = labels.dropna().unique().tolist()
+        self._grow(present)
+        codes = pd.Categorical(labels, categories=self.groups).codes.astype(np.int64)
+        self._merge(*self._chunk_moments(values, codes, len(self.groups)))
+
+    def merge(self, other):
+        """Fold another ColumnMoments over the same columns into this one"""
+        self._grow(other.groups)
+        order = [self.groups.index(g) for g in other.groups]
+        n = np.zeros_like(self.n)
+        mean = np.zeros_like(self.mean)
+        m2 = np.zeros_like(self.m2)
+        n[order], mean[order], m2[order] = other.n, other.mean, other.m2
+        self._merge(n, mean, m2)
+        for mine, theirs in zip(self.overall, other.overall):
+            mine.merge(theirs)
+
+    def group_std(self, ddof=1):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.n > ddof, np.sqrt(self.m2 / (self.n - ddof)), np.nan)
+
+
+def _finish(moments, rules, medians=None, mads=None):
+    """Model dict from accumulated moments (and medians/MADs if robust)"""
+    model = {"columns": moments.columns, "rules": list(rules)}
+    if "zscore" in rules:
+        model["zscore"] = (
+            np.array([m.mean if m.n else np.nan for m in moments.overall]),
+            np.array([m.std() for m in moments.overall]),
+        )
+    if "robust" in rules:
+        model["robust"] = (np.asarray(medians), MAD_SCALE * np.asarray(mads))
+    if "cycle" in rules:
+        model["groups"] = list(moments.groups)
+        model["cycle"] = (
+            np.where(moments.n > 0, moments.mean, np.nan),
+            moments.group_std(),
+        )
+    return model
+
+
+def _labels(df):
+    """Cycle label per row (NaN if missing)"""
+    if GROUP_COLUMN not in df.columns:
+        return np.full(len(df), np.nan, dtype=object)
+    labels = df[GROUP_COLUMN]
+    return labels.astype(str).where(labels.notna()).to_numpy()
+
+
+def _medians(values):
+    """Per-column median of the non-missing values, as np.quantile gives it"""
+    medians = np.full(values.shape[1], np.nan)
+    for j, column in enumerate(values.T):
+        observed = column[~np.isnan(column)]
+        if len(observed):
+            medians[j] = np.quantile(observed, 0.5)
+    return medians
+
+
+def fit_rules(df, columns, rules, rows=None):
+    """
+    Fit `rules` on `rows` of `df` (a boolean mask; default all) in one
+    pass over all `columns`: the moments of every column and cycle at
+    once and, for the robust rule, each column's median and MAD
+    """
+    columns = [c for c in columns if c in df.columns]
+    values = df[columns].to_numpy(dtype=np.float64)
+    labels = _labels(df) if "cycle" in rules else None
+    if rows is not None:
+        values = values[rows]
+        labels = None if labels is None else labels[rows]
+    moments = ColumnMoments(columns)
+    moments.update(values, labels)
+    medians = mads = None
+    if "robust" in rules:
+        medians = _medians(values)
+        mads = _medians(np.abs(values - medians))
+    return _finish(moments, rules, medians, mads)
+
+
+def fit_rules_chunked(passes, columns, rules, max_buffer=100_000):
+    """
+    Out-of-core fit_rules
+
+    `passes` is a callable returning a fresh iterator of DataFrame chunks
+    of the rows to fit on. Moments take one pass; the robust rule's
+    medians and MADs are exact (see chunked.exact_quantiles), a few more
+    passes each, and equal the in-memory ones.
+    """
+    moments = None
+    for chunk in passes():
+        if moments is None:
+            columns = [c for c in columns if c in chunk.columns]
+            moments = ColumnMoments(columns)
+        moments.update(
+            chunk[columns].to_numpy(dtype=np.float64),
+            _labels(chunk) if "cycle" in rules else None,
+        )
+    if moments is None:
+        moments = ColumnMoments([])
+
+    medians = mads = None
+    if "robust" in rules:
+        medians, mads = [], []
+        for j, col in enumerate(moments.columns):
+
+            def values(col=col):
+                for chunk in passes():
+                    yield chunk[col].to_numpy(dtype=np.float64)
+
+            median = exact_quantiles(values, [0.5], moments.overall[j], max_buffer)[0.5]
+
+            def deviations(col=col, median=median):
+                for chunk in passes():
+                    yield np.abs(chunk[col].to_numpy(dtype=np.float64) - median)
+
+            spread = RunningMoments()
+            for chunk in deviations():
+                spread.update(chunk)
+            mads.append(exact_quantiles(deviations, [0.5], spread, max_buffer)[0.5])
+            medians.append(median)
+    return _finish(moments, rules, medians, mads)
+
+
+def outlier_flags(df, model):
+    """
+    rule -> (n x p) boolean flags of `df` under a fitted model: |score|
+    above the rule's limit. Missing values, columns with a zero or
+    undefined scale and rows of unseen cycles are never flagged.
+    """
+    values = df[model["columns"]].to_numpy(dtype=np.float64)
+    flags = {}
+    for rule in model["rules"]:
+        center, scale = model[rule]
+        if rule == "cycle":
+            codes = pd.Categorical(_labels(df), categories=model["groups"]).codes
+            known = codes >= 0
+            center = np.where(known[:, None], center[np.maximum(codes, 0)], np.nan)
+            scale = np.where(known[:, None], scale[np.maximum(codes, 0)], np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            score = np.abs(values - center) / np.where(scale > 0, scale, np.nan)
+        flags[rule] = score > RULES[rule]
+    return flags
+
+
+def outlier_mask(df, model):
+    """Rows of `df` no rule flags (True = kept)"""
+    kept = np.ones(len(df), dtype=bool)
+    for flagged in outlier_flags(df, model).values():
+        kept &= ~flagged.any(axis=1)
+    return kept
+
+
+def flagged_by(flags, columns):
+    """Per row, the "rule:variable" pairs that flagged it ("" if none)"""
+    labels = np.array([f"{rule}:{col}" for rule in flags for col in columns])
+    stacked = np.hstack(list(flags.values()))
+    return pd.Series([", ".join(labels[row]) for row in stacked])
+
+
+def flag_report(flags, columns, rows=None):
+    """
+    Rows flagged per rule and variable (among `rows`, default all): by
+    that rule and variable, and by that rule alone among the rules
+    """
+    any_rule = {rule: f.any(axis=1) for rule, f in flags.items()}
+    selected = slice(None) if rows is None else rows
+    report = []
+    for rule, f in flags.items():
+        others = np.zeros(len(f), dtype=bool)
+        for other, hit in any_rule.items():
+            if other != rule:
+                others |= hit
+        for j, col in enumerate(columns + ["any"]):
+            hit = f[:, j] if col != "any" else any_rule[rule]
+            report.append(
+                {
+                    "rule": rule,
+                    "variable": col,
+                    "flagged": int(hit[selected].sum()),
+                    "only_this_rule": int((hit & ~others)[selected].sum()),
+                }
+            )
+    return pd.DataFrame(report)
+
+
+def outlier_screen(columns, rules):
+    """
+    Criterion for cohort.apply_criteria: no rule flags any of `columns`,
+    the rules being fitted on the rows passed so far (the pre-filter
+    sample), so the result does not depend on the order of `columns`.
+    After a call, criterion.model is the fitted model and
+    criterion.report the flag_report of the screened rows.
+    """
+
+    def criterion(df, passed):
+        model = fit_rules(df, columns, rules, passed)
+        flags = outlier_flags(df, model)
+        criterion.model = model
+        criterion.report = flag_report(flags, model["columns"], passed)
+        kept = np.ones(len(df), dtype=bool)
+        for flagged in flags.values():
+            kept &= ~flagged.any(axis=1)
+        return kept
+
+    criterion.conditional = True
+    return criterion
+
+
+def outlier_criteria(columns, rules=None, stage="after_outliers"):
+    """
+    Outlier criteria for cohort.apply_criteria: one |z| > 4 screen per
+    column in turn if `rules` is None, else one outlier_screen
+    """
+    if rules is None:
+        return [(f"outlier_{var}", stage, zscore_screen(var)) for var in columns]
+    return [(f"outliers_{'+'.join(rules)}", stage, outlier_screen(columns, rules))]
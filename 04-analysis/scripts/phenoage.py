@@ -0,0 +1,585 @@
+#!/usr/bin/env python3
+"""
+PhenoAge Scoring Kernel for PFAS-PhenoAge Study
+One vectorized implementation of the Levine et al. (2018) PhenoAge
+transform, shared by every script that scores participants
+"""
+
+import time
+
+import numpy as np
+
+# Column order of the (n x 10) biomarker matrix, in SI units as prepared by
+# the scripts: albumin g/L, creatinine umol/L, glucose mmol/L, ln CRP mg/L,
+# lymphocyte %, MCV fL, RDW %, ALP U/L, WBC 1000 cells/uL, age years
+COMPONENTS = [
+    "albumin",
+    "creatinine",
+    "glucose",
+    "log_crp",
+    "lymphocyte_pct",
+    "mcv",
+    "rdw",
+    "alp",
+    "wbc",
+    "age",
+]
+AGE = COMPONENTS.index("age")
+
+# Columns of a coefficient matrix for score_many: xb intercept, then the
+# weights in COMPONENTS order
+COEFFICIENT_COLUMNS = ["intercept"] + COMPONENTS
+
+# Coefficient sets. PhenoAge = phenoage_intercept
+#   + ln(hazard_scale * ln(1 - m)) / phenoage_rate, where
+#   m = 1 - exp(-mortality_scale * exp(xb) / gamma)
+COEFFICIENTS = {
+    # Original formula from the paper
+    "levine2018": {
+        "intercept": -19.90667,
+        "weights": [
+            -0.03359355,
+            0.009506491,
+            0.1953192,
+            0.09536762,
+            -0.01199984,
+            0.02676401,
+            0.3306156,
+            0.001868778,
+            0.05542406,
+            0.08035356,
+        ],
+        "mortality_scale": 1.51714,
+        "gamma": 0.007692696,
+        "hazard_scale": -0.0055305,
+        "phenoage_intercept": 141.50225,
+        "phenoage_rate": 0.09165,
+    },
+    # Rounded values of Table S7, used by complete_analysis
+    "table_s7": {
+        "intercept": -19.9067,
+        "weights": [
+            -0.0336,
+            0.00951,
+            0.1953,
+            0.0954,
+            -0.0120,
+            0.0268,
+            0.3306,
+            0.00188,
+            0.0554,
+            0.0804,
+        ],
+        "mortality_scale": 1.51714,
+        "gamma": 0.0076927,
+        "hazard_scale": -0.00553,
+        "phenoage_intercept": 141.50225,
+        "phenoage_rate": 0.09165,
+    },
+}
+
+# Clipping applied at each step of the transform; a step left out is not
+# clipped. xb: linear predictor, exponent: -scale * exp(xb) / gamma,
+# mortality: m, survival: 1 - m, hazard: -ln(1 - m) * |hazard_scale|
+CLIPS = {
+    # 02, 04-07
+    "pipeline": {
+        "xb": (-20, 5),
+        "exponent": (-700, 0),
+        "mortality": (1e-10, 1 - 1e-10),
+        "survival": (1e-100, 1),
+        "hazard": (1e-100, 1e100),
+        "phenoage": (10, 110),
+    },
+    # 03
+    "descriptive": {
+        "xb": (-10, 10),
+        "exponent": (-700, 700),
+        "mortality": (1e-10, 1 - 1e-10),
+        "hazard": (1e-300, 1e300),
+        "phenoage": (0, 120),
+    },
+    # complete_analysis
+    "complete": {
+        "mortality": (1e-10, 1 - 1e-10),
+        "phenoage": (0, 120),
+    },
+}
+
+# Rows scored per block; the transform runs in place on a block of the
+# output, so it stays in cache between steps
+BLOCK_ROWS = 1 << 14
+
+
+def component_matrix(columns):
+    """
+    Stack the ten components, in COMPONENTS order, into a C-contiguous
+    float64 (n x 10) matrix
+    """
+    matrix = np.empty((len(columns[0]), len(columns)), dtype=np.float64)
+    for j, column in enumerate(columns):
+        matrix[:, j] = column
+    return matrix
+
+
+def _clip(buffer, clips, step, moved=None):
+    """Clip in place; rows moved by the clip are counted into `moved`"""
+    bounds = clips.get(step)
+    if bounds is None:
+        return
+    if moved is not None:
+        rows = (buffer < bounds[0]) | (buffer > bounds[1])
+        moved["counts"][step] = moved["counts"].get(step, 0) + int(rows.sum())
+        moved["rows"] |= rows
+    np.clip(buffer, bounds[0], bounds[1], out=buffer)
+
+
+def _log_hazard_offset(coefficients):
+    """ln(hazard_scale * ln(1 - m)) - xb, which does not depend on xb"""
+    c = coefficients
+    return np.log(-c["hazard_scale"] * c["mortality_scale"] / c["gamma"])
+
+
+def _transform(block, coefficients, clips, stable, moved=None):
+    """Turn xb into PhenoAge in place"""
+    intercept = coefficients["phenoage_intercept"]
+    rate = coefficients["phenoage_rate"]
+
+    if stable:
+        # ln(1 - m) is the exponent itself, so
+        # ln(hazard_scale * ln(1 - m)) = xb + ln(-hazard_scale * scale / gamma)
+        block += _log_hazard_offset(coefficients)
+        block /= rate
+        block += intercept
+        _clip(block, clips, "phenoage", moved)
+        return
+
+    _clip(block, clips, "xb", moved)
+
+    # Mortality risk m = 1 - exp(-scale * exp(xb) / gamma)
+    np.exp(block, out=block)
+    block *= -coefficients["mortality_scale"]
+    block /= coefficients["gamma"]
+    _clip(block, clips, "exponent", moved)
+    np.exp(block, out=block)
+    np.subtract(1, block, out=block)
+    _clip(block, clips, "mortality", moved)
+
+    # PhenoAge = intercept + ln(hazard_scale * ln(1 - m)) / rate
+    np.subtract(1, block, out=block)
+    _clip(block, clips, "survival", moved)
+    np.log(block, out=block)
+    block *= coefficients["hazard_scale"]
+    _clip(block, clips, "hazard", moved)
+    np.log(block, out=block)
+    block /= rate
+    block += intercept
+    _clip(block, clips, "phenoage", moved)
+
+
+def _resolve(coefficients, clips):
+    if isinstance(coefficients, str):
+        coefficients = COEFFICIENTS[coefficients]
+    if isinstance(clips, str):
+        clips = CLIPS[clips]
+    return coefficients, clips
+
+
+def score(
+    matrix,
+    coefficients="levine2018",
+    clips="pipeline",
+    out=None,
+    stable=False,
+    contributions=None,
+):
+    """
+    PhenoAge and PhenoAge acceleration for an (n x 10) biomarker matrix
+
+    xb is one matrix-vector product; the transform then runs in place on
+    the phenoage output, BLOCK_ROWS rows at a time, so no full-length
+    temporaries are allocated. `coefficients` and `clips` are names in
+    COEFFICIENTS / CLIPS or dicts of the same shape. `out` may be a
+    preallocated (phenoage, accel) pair of float64 arrays. Missing inputs
+    give missing results.
+
+    With stable=True PhenoAge is evaluated in log space, where it is
+    linear in xb: no exp/log round trip through 1 - m, and of the clips
+    only the final "phenoage" range applies. It equals the default
+    wherever no intermediate clip binds (see clipping_report).
+
+    `contributions` may be an (n x 10) float64 array to fill, in the same
+    blocked pass, with each component's share of xb (weight x value); xb
+    is then their row sum plus the intercept, which agrees with the plain
+    product to rounding. See marginal_effects for their PhenoAge scale.
+
+    Returns (phenoage, accel) with accel = phenoage - age.
+    """
+    coefficients, clips = _resolve(coefficients, clips)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    n = len(matrix)
+    weights = np.asarray(coefficients["weights"], dtype=np.float64)
+    if out is None:
+        out = (np.empty(n), np.empty(n))
+    phenoage, accel = out
+    ones = np.ones(len(weights))
+
+    for start in range(0, n, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, n)
+        block = phenoage[start:stop]
+        if contributions is None:
+            np.dot(matrix[start:stop], weights, out=block)
+        else:
+            # A product with ones sums the short rows faster than .sum()
+            parts = contributions[start:stop]
+            np.multiply(matrix[start:stop], weights, out=parts)
+            np.dot(parts, ones, out=block)
+        block += coefficients["intercept"]
+        _transform(block, coefficients, clips, stable)
+        np.subtract(block, matrix[start:stop, AGE], out=accel[start:stop])
+
+    return phenoage, accel
+
+
+def marginal_effects(phenoage, coefficients="levine2018", clips="pipeline"):
+    """
+    (n x 10) change in PhenoAge per unit of each component, for every row
+
+    In log space PhenoAge = phenoage_intercept + (xb + offset) / rate, so
+    the effect of a component is weight / rate wherever the "phenoage"
+    clip does not bind, and 0 where it does; rows without a PhenoAge are
+    missing. Contributions from score() divided by the rate are likewise
+    each component's additive share of PhenoAge in years.
+    """
+    coefficients, clips = _resolve(coefficients, clips)
+    slope = np.asarray(coefficients["weights"], dtype=np.float64)
+    slope = slope / coefficients["phenoage_rate"]
+    effects = np.broadcast_to(slope, (len(phenoage), len(slope))).copy()
+    bounds = clips.get("phenoage")
+    if bounds is not None:
+        effects[(phenoage <= bounds[0]) | (phenoage >= bounds[1])] = 0
+    effects[np.isnan(phenoage)] = np.nan
+    return effects
+
+
+def grouped_means(values, groups):
+    """
+    Per-group column means of an (n x p) array, in one matrix product
+
+    `groups` holds integer codes 0..k-1 (negative for rows to leave out);
+    rows with a missing value are left out too. Returns (k x p) means and
+    the k row counts.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    groups = np.asarray(groups)
+    keep = (groups >= 0) & ~np.isnan(values).any(axis=1)
+    k = int(groups.max()) + 1 if len(groups) else 0
+    indicator = np.zeros((k, len(values)))
+    indicator[groups[keep], np.flatnonzero(keep)] = 1
+    counts = indicator.sum(axis=1)
+    sums = indicator @ np.where(keep[:, None], values, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts[:, None], counts
+
+
+def transform(xb, coefficients="levine2018", clips="pipeline", stable=False):
+    """
+    PhenoAge from an already computed linear predictor, in place
+
+    For callers that get xb from a larger product (see biological_age);
+    `xb` must be a writable float64 array.
+    """
+    coefficients, clips = _resolve(coefficients, clips)
+    _transform(xb, coefficients, clips, stable)
+    return xb
+
+
+def coefficient_matrix(names=None, transform="levine2018"):
+    """
+    (k x 11) coefficient matrix of registered sets for score_many
+
+    score_many applies the transform constants of one set. The log-space
+    PhenoAge is affine in xb, so each row is rescaled onto the constants
+    of `transform` and reproduces its own set's log-space PhenoAge.
+    """
+    base = COEFFICIENTS[transform]
+    rows = []
+    for name in names or COEFFICIENTS:
+        c = COEFFICIENTS[name]
+        ratio = base["phenoage_rate"] / c["phenoage_rate"]
+        intercept = (c["intercept"] + _log_hazard_offset(c)) * ratio
+        intercept += (c["phenoage_intercept"] - base["phenoage_intercept"]) * (
+            base["phenoage_rate"]
+        ) - _log_hazard_offset(base)
+        rows.append([intercept] + [w * ratio for w in c["weights"]])
+    return np.asarray(rows, dtype=np.float64)
+
+
+def draw_coefficients(k, se, base="levine2018", seed=0):
+    """
+    k coefficient rows drawn independently around a registered set
+
+    `se` holds one standard error per COEFFICIENT_COLUMNS entry, e.g. the
+    published ones; the base set is not included among the draws.
+    """
+    rng = np.random.default_rng(seed)
+    c = COEFFICIENTS[base]
+    center = np.asarray([c["intercept"]] + list(c["weights"]), dtype=np.float64)
+    return center + rng.normal(size=(k, len(center))) * np.asarray(se, np.float64)
+
+
+def score_many(
+    matrix, coefficients, transform="levine2018", clips="pipeline", out=None
+):
+    """
+    PhenoAge under k coefficient vectors at once
+
+    `coefficients` is a (k x 11) matrix in COEFFICIENT_COLUMNS order. xb
+    for every participant and variant is one (n x 10) @ (10 x k) product;
+    the log-space transform (with the constants of `transform` and the
+    "phenoage" range of `clips`) then runs in place, a cache-sized block of
+    rows at a time. Returns (phenoage, accel), both (n x k).
+    """
+    coefficients = np.atleast_2d(np.asarray(coefficients, dtype=np.float64))
+    constants, clips = _resolve(transform, clips)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    n, k = len(matrix), len(coefficients)
+    weights = np.ascontiguousarray(coefficients[:, 1:].T)
+    intercepts = coefficients[:, 0]
+    if out is None:
+        out = (np.empty((n, k)), np.empty((n, k)))
+    phenoage, accel = out
+
+    rows = max(1, BLOCK_ROWS // k)
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        block = phenoage[start:stop]
+        np.matmul(matrix[start:stop], weights, out=block)
+        block += intercepts
+        _transform(block, constants, clips, stable=True)
+        np.subtract(block, matrix[start:stop, AGE, None], out=accel[start:stop])
+
+    return phenoage, accel
+
+
+def clipping_report(matrix, coefficients="levine2018", clips="pipeline"):
+    """
+    How much the clipped transform departs from the exact formula
+
+    Scores the matrix with the clipped transform, recording the rows each
+    clip moves, and compares it with the unclipped log-space formula.
+    Returns a dict with the scored (non-missing) rows, rows altered by
+    any clip, rows moved per step, and the largest absolute PhenoAge
+    difference over the rows no clip touched.
+    """
+    coefficients, clips = _resolve(coefficients, clips)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+    xb = matrix @ np.asarray(coefficients["weights"], dtype=np.float64)
+    xb += coefficients["intercept"]
+    scored = ~np.isnan(xb)
+
+    moved = {"counts": {}, "rows": np.zeros(len(xb), dtype=bool)}
+    clipped = xb.copy()
+    _transform(clipped, coefficients, clips, stable=False, moved=moved)
+    exact = xb.copy()
+    _transform(exact, coefficients, {}, stable=True)
+
+    untouched = scored & ~moved["rows"]
+    diff = np.abs(clipped[untouched] - exact[untouched])
+    return {
+        "rows": int(scored.sum()),
+        "altered": int(moved["rows"].sum()),
+        "steps": moved["counts"],
+        "max_abs_diff": float(diff.max()) if len(diff) else np.nan,
+    }
+
+
+def format_clipping_report(report):
+    """One-line summary of clipping_report for the logs"""
+    if not report["rows"]:
+        return "no rows with every component to score"
+    steps = ", ".join(f"{k} {v}" for k, v in report["steps"].items() if v)
+    return (
+        f"clipping altered {report['altered']} of {report['rows']} rows"
+        f" ({steps or 'none'}); elsewhere the log-space formula agrees to"
+        f" {report['max_abs_diff']:.1e} years"
+    )
+
+
+def _reference_score(matrix, coefficients, clips):
+    """The per-step expression the scripts used, for benchmarking"""
+    c = coefficients
+
+    def clip(x, step):
+        return np.clip(x, *clips[step]) if step in clips else x
+
+    xb = c["intercept"]
+    for j in range(len(COMPONENTS)):
+        xb = xb + c["weights"][j] * matrix[:, j]
+    xb = clip(xb, "xb")
+    exponent = clip((-c["mortality_scale"] * np.exp(xb)) / c["gamma"], "exponent")
+    m = clip(1 - np.exp(exponent), "mortality")
+    hazard = clip(c["hazard_scale"] * np.log(clip(1 - m, "survival")), "hazard")
+    phenoage = clip(
+        c["phenoage_intercept"] + np.log(hazard) / c["phenoage_rate"], "phenoage"
+    )
+    return phenoage, phenoage - matrix[:, AGE]
+
+
+def synthetic_matrix(n, seed=0):
+    """Plausible adult biomarker values for n participants"""
+    rng = np.random.default_rng(seed)
+    means = [42, 80, 5.5, 0.5, 30, 90, 13, 70, 7, 48]
+    sds = [3, 20, 1.2, 1.1, 8, 5, 1.2, 20, 2, 17]
+    matrix = np.empty((n, len(COMPONENTS)))
+    for j, (mean, sd) in enumerate(zip(means, sds)):
+        matrix[:, j] = rng.normal(mean, sd, n)
+    return matrix
+
+
+def benchmark(
+    sizes=(10**5, 10**6, 10**7, 10**8),
+    repeat=3,
+    coefficients="levine2018",
+    clips="pipeline",
+    resident_rows=10**7,
+):
+    """
+    Time score() against the per-step reference on synthetic matrices
+
+    Sizes above `resident_rows` are scored as consecutive passes over one
+    resident matrix of that many rows (10^8 rows would need 8 GB for the
+    matrix alone). Returns one dict per size with best-of-`repeat` seconds
+    for the clipped and log-space kernels, the log-space kernel filling
+    contributions, and the reference, rows per
+    second of score(), and the largest absolute difference in PhenoAge.
+    """
+    results = []
+    for n in sizes:
+        rows = min(n, resident_rows)
+        passes = -(-n // rows)
+        matrix = synthetic_matrix(rows)
+        out = (np.empty(rows), np.empty(rows))
+        kernel = reference = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(passes):
+                score(matrix, coefficients, clips, out=out)
+            kernel = min(kernel, time.perf_counter() - start)
+        stable = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(passes):
+                score(matrix, coefficients, clips, out=out, stable=True)
+            stable = min(stable, time.perf_counter() - start)
+        parts = np.empty_like(matrix)
+        decomposed = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(passes):
+                score(matrix, coefficients, clips, out, True, contributions=parts)
+            decomposed = min(decomposed, time.perf_counter() - start)
+        del parts
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(passes):
+                expected, _ = _reference_score(
+                    matrix, COEFFICIENTS[coefficients], CLIPS[clips]
+                )
+            reference = min(reference, time.perf_counter() - start)
+        results.append(
+            {
+                "rows": rows * passes,
+                "kernel_s": kernel,
+                "stable_s": stable,
+                "contributions_s": decomposed,
+                "reference_s": reference,
+                "rows_per_s": rows * passes / kernel,
+                "max_abs_diff": float(np.nanmax(np.abs(out[0] - expected))),
+            }
+        )
+        del matrix, out, expected
+    return results
+
+
+def benchmark_many(rows=10**5, k=200, repeat=3):
+    """
+    Best-of-`repeat` seconds for k coefficient variants: score_many against
+    k separate score() calls and k runs of the per-step reference
+    """
+    matrix = synthetic_matrix(rows)
+    center = coefficient_matrix(["levine2018"])
+    variants = center * np.random.default_rng(0).normal(1, 0.01, (k, 11))
+    sets = [
+        {**COEFFICIENTS["levine2018"], "intercept": row[0], "weights": row[1:]}
+        for row in variants
+    ]
+    runs = {
+        "batched": lambda: score_many(matrix, variants)[0],
+        "looped": lambda: [score(matrix, c, stable=True)[0] for c in sets],
+        "reference": lambda: [
+            _reference_score(matrix, c, CLIPS["pipeline"])[0] for c in sets
+        ],
+    }
+    times = {}
+    for label, run in runs.items():
+        times[label] = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            times[label] = min(times[label], time.perf_counter() - start)
+        if label == "batched":
+            batched = result
+        else:
+            times[f"{label}_max_abs_diff"] = float(
+                max(np.nanmax(np.abs(batched[:, j] - r)) for j, r in enumerate(result))
+            )
+    return times
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the PhenoAge kernel")
+    parser.add_argument(
+        "--rows",
+        type=float,
+        nargs="+",
+        default=[1e5, 1e6, 1e7, 1e8],
+        help="numbers of rows to score",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--variants",
+        type=int,
+        default=None,
+        help="instead, time this many coefficient variants on the first size",
+    )
+    parser.add_argument(
+        "--resident-rows",
+        type=float,
+        default=1e7,
+        help="largest matrix held in memory; bigger sizes take several passes",
+    )
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.rows]
+    if args.variants:
+        r = benchmark_many(sizes[0], args.variants, args.repeat)
+        print(
+            f"{sizes[0]:,} rows x {args.variants} variants: "
+            f"score_many {r['batched']:.4f}s, "
+            f"looped score() {r['looped']:.4f}s, "
+            f"looped reference {r['reference']:.4f}s, "
+            f"max |diff| {r['reference_max_abs_diff']:.2e}"
+        )
+    else:
+        for r in benchmark(sizes, args.repeat, resident_rows=int(args.resident_rows)):
+            print(
+                f"{r['rows']:>11,} rows: kernel {r['kernel_s']:.4f}s "
+                f"({r['rows_per_s'] / 1e6:.1f}M rows/s), "
+                f"log-space {r['stable_s']:.4f}s, "
+                f"with contributions {r['contributions_s']:.4f}s, "
+                f"reference {r['reference_s']:.4f}s, "
+                f"max |diff| {r['max_abs_diff']:.2e}"
+            )
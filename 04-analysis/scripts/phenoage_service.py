@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+PhenoAge Scoring Service for PFAS-PhenoAge Study
+Local asyncio HTTP service (standard library only) returning PhenoAge and
+its acceleration for posted biomarker records; concurrent requests are
+micro-batched into one call of the PhenoAge kernel
+"""
+
+import asyncio
+import json
+import math
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from phenoage import COMPONENTS, score, synthetic_matrix
+from phenoage_stream import chunk_matrix
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# A batch is scored once it holds MAX_BATCH_ROWS records or its first
+# request has waited MAX_WAIT_S
+MAX_BATCH_ROWS = 4096
+MAX_WAIT_S = 0.001
+
+# Largest request body accepted
+MAX_BODY_BYTES = 64 << 20
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Too Large"}
+
+
+class MicroBatcher:
+    """
+    Collects the records of concurrent requests and scores them together
+
+    submit(records) queues a list of record dicts and resolves to their
+    (phenoage, accel) arrays once the batch they joined has been scored.
+    Records use phenoage.COMPONENTS names (age in years) or NHANES source
+    variables as in biomarkers.BIOMARKER_SCHEMA.
+    """
+
+    def __init__(self, max_rows=MAX_BATCH_ROWS, max_wait=MAX_WAIT_S, profile=None):
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.profile = profile
+        self.batches = 0
+        self.rows = 0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, records):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((records, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            rows = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while rows < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0 and self._queue.empty():
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                rows += len(item[0])
+            self._score(pending)
+
+    def _score(self, pending):
+        records = [record for records, _ in pending for record in records]
+        try:
+            matrix = _component_rows(records)
+            if matrix is None:
+                frame = pd.DataFrame.from_records(records)
+                matrix, _ = chunk_matrix(frame, self.profile)
+            phenoage, accel = score(matrix, stable=True)
+        except (KeyError, ValueError, TypeError) as e:
+            # Score requests one by one so a bad record only fails its own
+            if len(pending) > 1:
+                for item in pending:
+                    self._score([item])
+            elif not pending[0][1].done():
+                pending[0][1].set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(records)
+        start = 0
+        for records, future in pending:
+            stop = start + len(records)
+            if not future.done():
+                future.set_result((phenoage[start:stop], accel[start:stop]))
+            start = stop
+
+
+def _component_rows(records):
+    """
+    Matrix of records that all carry every component, skipping the
+    DataFrame and unit conversion; None if any needs converting
+    """
+    try:
+        matrix = np.array([[r[c] for c in COMPONENTS] for r in records], dtype=float)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return None if np.isnan(matrix).any() else matrix
+
+
+def _json_values(values):
+    return [None if math.isnan(v) else v for v in values.tolist()]
+
+
+def parse_records(body):
+    """
+    Records of a request body: one JSON object, a list of objects, or
+    {"records": [...]}; returns (records, whether a single record was sent)
+    """
+    payload = json.loads(body)
+    if isinstance(payload, dict) and "records" in payload:
+        payload = payload["records"]
+    single = isinstance(payload, dict)
+    records = [payload] if single else payload
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        raise ValueError("expected a record object, a list of them or {records}")
+    return records, single
+
+
+async def _read_request(reader):
+    """(method, path, headers, body) of the next request, or None at EOF"""
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise OverflowError(length)
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def _response(status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode() + body
+
+
+async def handle_request(batcher, method, path, body):
+    """(status, payload) for one request"""
+    if method == "GET" and path == "/health":
+        return 200, {"status": "ok", "batches": batcher.batches, "rows": batcher.rows}
+    if method != "POST" or path != "/score":
+        return 404, {"error": "POST /score or GET /health"}
+    try:
+        records, single = parse_records(body)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    if not records:
+        return 200, {"phenoage": [], "phenoage_accel": []}
+    try:
+        phenoage, accel = await batcher.submit(records)
+    except (KeyError, ValueError, TypeError) as e:
+        return 400, {"error": str(e)}
+    if single:
+        phenoage, accel = _json_values(phenoage)[0], _json_values(accel)[0]
+    else:
+        phenoage, accel = _json_values(phenoage), _json_values(accel)
+    return 200, {"phenoage": phenoage, "phenoage_accel": accel}
+
+
+async def serve(host=HOST, port=PORT, max_rows=MAX_BATCH_ROWS, max_wait=MAX_WAIT_S):
+    """Serve POST /score and GET /health until cancelled"""
+    batcher = MicroBatcher(max_rows, max_wait)
+    batcher.start()
+
+    async def connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except OverflowError:
+                    writer.write(_response(413, {"error": "body too large"}, False))
+                    break
+                except (ValueError, asyncio.IncompleteReadError):
+                    writer.write(_response(400, {"error": "malformed request"}, False))
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload = await handle_request(batcher, method, path, body)
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(connection, host, port)
+    print(f"PhenoAge service on http://{host}:{port} (POST /score, GET /health)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+async def _post(reader, writer, body):
+    writer.write(
+        b"POST /score HTTP/1.1\r\nHost: localhost\r\n"
+        b"Content-Type: application/json\r\n"
+        b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+    )
+    await writer.drain()
+    status = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    payload = await reader.readexactly(length)
+    if b" 200 " not in status:
+        raise RuntimeError(f"{status.decode().strip()}: {payload.decode()}")
+
+
+async def load_test(host, port, concurrency, requests, records_per_request=1):
+    """
+    Send `requests` POSTs from `concurrency` keep-alive connections
+
+    Each request carries `records_per_request` synthetic records. Returns
+    requests/s, records/s and p50/p99 latency in milliseconds.
+    """
+    records = pd.DataFrame(
+        synthetic_matrix(requests * records_per_request, seed=1), columns=COMPONENTS
+    ).to_dict("records")
+    bodies = [
+        json.dumps(
+            records[i * records_per_request : (i + 1) * records_per_request]
+            if records_per_request > 1
+            else records[i]
+        ).encode()
+        for i in range(requests)
+    ]
+    latencies = []
+    next_body = iter(bodies)
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for body in next_body:
+                start = time.perf_counter()
+                await _post(reader, writer, body)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "requests_per_s": requests / seconds,
+        "records_per_s": requests * records_per_request / seconds,
+        "p50_ms": p50,
+        "p99_ms": p99,
+    }
+
+
+def _wait_for_port(host, port, timeout=30):
+    async def probe():
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.close()
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return asyncio.run(probe())
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def benchmark(
+    concurrency=(1, 8, 32, 128),
+    requests=2000,
+    records_per_request=1,
+    host=HOST,
+    port=PORT,
+    max_rows=MAX_BATCH_ROWS,
+    max_wait=MAX_WAIT_S,
+    start_server=True,
+):
+    """
+    Load-test the service at each concurrency level
+
+    Unless `start_server` is False, a server with the given batching
+    window is started in a child process for the duration. Returns one
+    load_test result per level.
+    """
+    server = None
+    if start_server:
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                __file__,
+                "serve",
+                "--host",
+                host,
+                "--port",
+                str(port),
+                "--max-batch-rows",
+                str(max_rows),
+                "--max-wait-ms",
+                str(max_wait * 1000),
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+    try:
+        _wait_for_port(host, port)
+        return [
+            asyncio.run(load_test(host, port, c, requests, records_per_request))
+            for c in concurrency
+        ]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local PhenoAge scoring service")
+    parser.add_argument("command", choices=["serve", "bench"])
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-batch-rows", type=int, default=MAX_BATCH_ROWS)
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=MAX_WAIT_S * 1000,
+        help="longest a request waits for others to join its batch",
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--records-per-request", type=int, default=1)
+    parser.add_argument(
+        "--external",
+        action="store_true",
+        help="benchmark a server already running at --host/--port",
+    )
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(
+                serve(
+                    args.host, args.port, args.max_batch_rows, args.max_wait_ms / 1000
+                )
+            )
+        except KeyboardInterrupt:
+            pass
+    else:
+        results = benchmark(
+            args.concurrency,
+            args.requests,
+            args.records_per_request,
+            args.host,
+            args.port,
+            args.max_batch_rows,
+            args.max_wait_ms / 1000,
+            not args.external,
+        )
+        for r in results:
+            print(
+                f"concurrency {r['concurrency']:>4}: "
+                f"{r['requests_per_s']:,.0f} requests/s "
+                f"({r['records_per_s']:,.0f} records/s), "
+                f"p50 {r['p50_ms']:.2f} ms, p99 {r['p99_ms']:.2f} ms"
+            )
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Streaming PhenoAge Scoring for PFAS-PhenoAge Study
+Scores a biomarker file of any size (CSV or Parquet) with the study's
+PhenoAge kernel, a bounded chunk at a time, writing results as it goes
+"""
+
+import resource
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from biomarkers import BIOMARKER_SCHEMA, convert_biomarkers, resolve_schema
+from phenoage import COMPONENTS, component_matrix, score
+
+# Rows read, scored and written per step; memory scales with this, not
+# with the size of the input
+CHUNK_ROWS = 250_000
+
+# Chronological age, in order of preference
+AGE_COLUMNS = ["age", "RIDAGEYR"]
+
+# Identifier carried into the output when present and --keep is not given
+DEFAULT_KEEP = ["SEQN"]
+
+PARQUET_SUFFIXES = {".parquet", ".pq"}
+
+
+def _is_parquet(path):
+    return Path(path).suffix.lower() in PARQUET_SUFFIXES
+
+
+def file_columns(path):
+    """Column names of a CSV or Parquet file, without reading its rows"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+
+        return list(pq.ParquetFile(path).schema_arrow.names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def needed_columns(available, profile=None, keep=()):
+    """
+    Columns to read: `keep`, age, and per biomarker either the converted
+    component itself (e.g. "albumin" in g/L) or its schema source variables
+    """
+    schema = resolve_schema(profile)
+    wanted = list(keep) + AGE_COLUMNS
+    for name in COMPONENTS:
+        if name == "age":
+            continue
+        wanted.append(name)
+        if name not in available:
+            wanted += [v for opts in schema[name]["sources"].values() for v, _ in opts]
+    if "cycle" in available:
+        wanted.append("cycle")
+    return [c for c in dict.fromkeys(wanted) if c in available]
+
+
+def iter_chunks(path, columns, chunk_rows=CHUNK_ROWS):
+    """Yield DataFrames of at most `chunk_rows` rows holding `columns`"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+
+        # Without pre-buffering, only the row groups being read are held
+        source = pq.ParquetFile(path, pre_buffer=False, buffer_size=1 << 20)
+        for batch in source.iter_batches(chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        with pd.read_csv(path, usecols=columns, chunksize=chunk_rows) as reader:
+            yield from reader
+
+
+def chunk_matrix(chunk, profile=None):
+    """
+    PhenoAge matrix of one chunk
+
+    Components present under their own names are used as they are; the
+    others, and missing values of those, are converted from their source
+    variables (see biomarkers.BIOMARKER_SCHEMA). Returns (matrix,
+    conversion report or None if nothing needed converting).
+    """
+    biomarkers = [c for c in COMPONENTS if c != "age"]
+    given = {c: chunk[c] for c in biomarkers if c in chunk.columns}
+    report = None
+    if len(given) < len(biomarkers) or any(v.isna().any() for v in given.values()):
+        converted, report = convert_biomarkers(chunk, profile)
+        for c in biomarkers:
+            given[c] = given[c].fillna(converted[c]) if c in given else converted[c]
+    age = next((chunk[c] for c in AGE_COLUMNS if c in chunk.columns), None)
+    if age is None:
+        raise ValueError(f"No age column; expected one of {AGE_COLUMNS}")
+    return (
+        component_matrix([age if c == "age" else given[c] for c in COMPONENTS]),
+        report,
+    )
+
+
+class _Writer:
+    """Appends DataFrames to one CSV or Parquet file, by its suffix"""
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+
+    def write(self, frame):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if self._writer is None:
+            if _is_parquet(self.path):
+                import pyarrow.parquet as pq
+
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                import pyarrow.csv as pa_csv
+
+                self._writer = pa_csv.CSVWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process so far (Linux reports KiB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def stream_score(
+    input_path,
+    output_path,
+    chunk_rows=CHUNK_ROWS,
+    coefficients="levine2018",
+    clips="pipeline",
+    stable=True,
+    keep=None,
+    profile=None,
+    log=print,
+):
+    """
+    Score `input_path` into `output_path` chunk by chunk
+
+    The defaults match the PhenoAge of scripts 02-07. The output holds the
+    `keep` columns (default: SEQN if present), phenoage and
+    phenoage_accel, in input order, as CSV or Parquet by its suffix. The
+    score buffers are allocated once, so memory stays at about one chunk
+    whatever the input size. Returns rows, seconds, rows_per_s,
+    peak_memory_mb and the summed range checks of converted biomarkers.
+    """
+    available = file_columns(input_path)
+    if keep is None:
+        keep = [c for c in DEFAULT_KEEP if c in available]
+    absent = [c for c in keep if c not in available]
+    if absent:
+        raise ValueError(f"Columns to keep not in {input_path}: {absent}")
+    columns = needed_columns(available, profile, keep)
+
+    phenoage = np.empty(chunk_rows)
+    accel = np.empty(chunk_rows)
+    writer = _Writer(output_path)
+    out_of_range = dict.fromkeys(BIOMARKER_SCHEMA, 0)
+    rows = 0
+    start = time.perf_counter()
+    try:
+        for chunk in iter_chunks(input_path, columns, chunk_rows):
+            n = len(chunk)
+            matrix, report = chunk_matrix(chunk, profile)
+            score(matrix, coefficients, clips, (phenoage[:n], accel[:n]), stable)
+            if report is not None:
+                for name, count in zip(report["biomarker"], report["out_of_range"]):
+                    out_of_range[name] += int(count)
+
+            result = chunk[keep].reset_index(drop=True)
+            result["phenoage"] = phenoage[:n]
+            result["phenoage_accel"] = accel[:n]
+            writer.write(result)
+            rows += n
+    finally:
+        writer.close()
+    seconds = time.perf_counter() - start
+
+    summary = {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_s": rows / seconds if seconds > 0 else float("nan"),
+        "peak_memory_mb": peak_memory_mb(),
+        "out_of_range": {k: v for k, v in out_of_range.items() if v},
+    }
+    log(
+        f"Scored {rows:,} rows in {seconds:.2f}s "
+        f"({summary['rows_per_s']:,.0f} rows/s), "
+        f"peak memory {summary['peak_memory_mb']:.0f} MB"
+    )
+    for name, count in summary["out_of_range"].items():
+        log(f"  Range check: {count:,} {name} values outside the plausible range")
+    return summary
+
+
+def write_synthetic(path, rows, chunk_rows=CHUNK_ROWS, seed=0):
+    """Write a synthetic biomarker file (SEQN plus components) for testing"""
+    from phenoage import synthetic_matrix
+
+    writer = _Writer(path)
+    try:
+        for start in range(0, rows, chunk_rows):
+            n = min(chunk_rows, rows - start)
+            frame = pd.DataFrame(synthetic_matrix(n, seed + start), columns=COMPONENTS)
+            frame.insert(0, "SEQN", np.arange(start, start + n))
+            writer.write(frame)
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Score a CSV/Parquet biomarker file with PhenoAge in chunks"
+    )
+    parser.add_argument("input", type=Path)
+    parser.add_argument("output", type=Path, help="CSV or Parquet (by suffix)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--coefficients", default="levine2018")
+    parser.add_argument("--clips", default="pipeline")
+    parser.add_argument(
+        "--unstable",
+        action="store_true",
+        help="use the step-by-step transform instead of the log-space one",
+    )
+    parser.add_argument(
+        "--keep", nargs="*", default=None, help="input columns to copy to the output"
+    )
+    parser.add_argument(
+        "--profile", default=None, help="biomarkers.SOURCE_PROFILES entry"
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=float,
+        default=None,
+        help="first write this many synthetic rows to INPUT",
+    )
+    args = parser.parse_args()
+
+    if args.synthetic:
+        write_synthetic(args.input, int(args.synthetic), args.chunk_rows)
+    stream_score(
+        args.input,
+        args.output,
+        args.chunk_rows,
+        args.coefficients,
+        args.clips,
+        not args.unstable,
+        args.keep,
+        args.profile,
+    )
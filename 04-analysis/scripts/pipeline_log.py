@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Pipeline Logger for PFAS-PhenoAge Study
+Buffered, structured replacement for the per-script log_message helpers:
+analysis_log.txt holds one JSON record per line, with per-stage timings
+and row counts, so it doubles as a performance trace
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+STUDY_DIR = Path("/study")
+LOG_FILE = STUDY_DIR / "04-analysis" / "outputs" / "analysis_log.txt"
+
+# Records held in memory before a write
+FLUSH_EVERY = 64
+
+# Set to 1 to hand writes to a background thread
+BACKGROUND_ENV = "PFAS_LOG_BACKGROUND"
+
+
+class PipelineLogger:
+    """
+    Callable logger for one script
+
+    log(msg) prints the message and queues a record; records are appended
+    to the log file FLUSH_EVERY at a time, from a background thread if
+    requested, and flushed at exit. log.stage(name) times a block and
+    records its duration and, if set, its row count.
+    """
+
+    def __init__(self, script, path=LOG_FILE, background=None):
+        self.script = script
+        self.path = Path(path)
+        self._start = time.perf_counter()
+        self._stage = None
+        self._stage_times = {}
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+        if background is None:
+            background = os.environ.get(BACKGROUND_ENV) == "1"
+        self._queue = None
+        if background:
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(target=self._drain, daemon=True)
+            self._writer.start()
+        atexit.register(self.close)
+
+    def __call__(self, msg, rows=None):
+        print(msg)
+        record = {"msg": str(msg)}
+        if rows is not None:
+            record["rows"] = int(rows)
+        self._emit(record)
+
+    def _emit(self, record):
+        record = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "script": self.script,
+            "stage": self._stage,
+            "elapsed_s": round(time.perf_counter() - self._start, 4),
+            **record,
+        }
+        with self._lock:
+            self._buffer.append(json.dumps(record, default=str))
+            if len(self._buffer) >= FLUSH_EVERY:
+                self._flush_locked()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a pipeline stage
+
+        Yields a dict; setting info["rows"] records the stage's row count.
+        Nested stages are timed separately.
+        """
+        outer = self._stage
+        self._stage = name
+        info = {}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            seconds = time.perf_counter() - start
+            self._stage_times[name] = self._stage_times.get(name, 0.0) + seconds
+            record = {"event": "stage", "seconds": round(seconds, 4)}
+            if info.get("rows") is not None:
+                record["rows"] = int(info["rows"])
+            self._emit(record)
+            self._stage = outer
+
+    def stage_times(self):
+        """Seconds spent in each stage so far"""
+        return dict(self._stage_times)
+
+    def _flush_locked(self):
+        if not self._buffer:
+            return
+        lines = "\n".join(self._buffer) + "\n"
+        self._buffer = []
+        if self._queue is not None:
+            self._queue.put(lines)
+        else:
+            self._write(lines)
+
+    def _write(self, lines):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+    def _drain(self):
+        while True:
+            lines = self._queue.get()
+            if lines is None:
+                return
+            self._write(lines)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """Write a per-stage summary and everything still buffered"""
+        if self._closed:
+            return
+        self._closed = True
+        self._stage = None
+        self._emit(
+            {
+                "event": "summary",
+                "stages": {k: round(v, 4) for k, v in self._stage_times.items()},
+            }
+        )
+        self.flush()
+        if self._queue is not None:
+            self._queue.put(None)
+            self._writer.join()
+
+
+def read_trace(path=LOG_FILE):
+    """All records of a log file as a DataFrame (free-text lines skipped)"""
+    with open(path) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.startswith("{")])
+
+
+def stage_report(path=LOG_FILE):
+    """Per-stage timing and row counts across scripts, in run order"""
+    trace = read_trace(path)
+    if "event" not in trace.columns:
+        return pd.DataFrame(columns=["script", "stage", "seconds", "rows"])
+    stages = trace[trace["event"] == "stage"]
+    columns = [c for c in ["script", "stage", "seconds", "rows"] if c in stages]
+    report = stages[columns].reset_index(drop=True)
+    if "rows" in report:
+        report["rows"] = report["rows"].astype("Int64")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-stage timing from the log")
+    parser.add_argument("path", nargs="?", type=Path, default=LOG_FILE)
+    args = parser.parse_args()
+    print(stage_report(args.path).to_string(index=False))
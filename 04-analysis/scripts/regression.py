@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Batched Exposure Regressions for PFAS-PhenoAge Study
+OLS of one or several outcomes on each of many exposures plus shared
+covariates, via Frisch-Waugh-Lovell: the covariate design is built once
+per model and factorized once per missing-data pattern, and every
+exposure's estimate follows from residualizing it against that basis
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+def parse_terms(rhs):
+    """
+    (numeric, categorical) covariate names of a right-hand side such as
+    "age + C(sex) + pir"; C(x) marks a categorical covariate
+    """
+    numeric, categorical = [], []
+    for term in filter(None, (t.strip() for t in rhs.split("+"))):
+        match = re.fullmatch(r"C\((\w+)\)", term)
+        if match:
+            categorical.append(match.group(1))
+        else:
+            numeric.append(term)
+    return numeric, categorical
+
+
+def covariate_design(df, rhs=""):
+    """
+    Intercept, numeric covariates and treatment-coded indicators of each
+    categorical one (levels as patsy orders them; the first is the
+    reference) for all rows of `df`. Returns (n x p design, names of the
+    columns it was built from).
+    """
+    numeric, categorical = parse_terms(rhs)
+    blocks = [np.ones((len(df), 1))]
+    for name in numeric:
+        blocks.append(df[name].to_numpy(dtype=np.float64)[:, None])
+    for name in categorical:
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            levels = list(column.cat.categories)
+        else:
+            levels = sorted(column.dropna().unique())
+        codes = pd.Categorical(column, categories=levels).codes
+        indicators = codes[:, None] == np.arange(1, len(levels))
+        blocks.append(indicators.astype(np.float64))
+    return np.hstack(blocks), numeric + categorical
+
+
+def _basis(design):
+    """
+    Orthonormal basis of the design's column space: from QR when it has
+    full column rank, else from the SVD, dropping dependent directions
+    (e.g. a level absent from the rows)
+    """
+    q, r = np.linalg.qr(design)
+    diagonal = np.abs(np.diag(r))
+    tol = max(design.shape) * np.finfo(float).eps
+    if len(diagonal) and diagonal.min() > tol * diagonal.max():
+        return q
+    u, s, _ = np.linalg.svd(design, full_matrices=False)
+    return u[:, s > tol * s.max()] if len(s) else u[:, :0]
+
+
+def _missing_patterns(exposures):
+    """Group exposure columns by their pattern of observed rows"""
+    observed = ~np.isnan(exposures)
+    groups = {}
+    for j in range(exposures.shape[1]):
+        groups.setdefault(np.packbits(observed[:, j]).tobytes(), []).append(j)
+    return [(observed[:, js[0]], js) for js in groups.values()]
+
+
+COLUMNS = ["exposure", "beta", "se", "ci_lower", "ci_upper", "p_value", "n", "df_resid"]
+
+
+def _fit(
+    df, outcomes, x_all, exposures, covariates, required, min_rows, alpha, rows, survey
+):
+    """
+    Shared pass of fit_exposures and fit_outcomes: every exposure against
+    every column of the (n x k) `outcomes` array
+    """
+    design, columns = covariate_design(df, covariates)
+    base = df[[*columns, *required]].notna().all(axis=1).to_numpy()
+    base = base & ~np.isnan(outcomes).any(axis=1)
+    if rows is not None:
+        base = base & np.asarray(rows, dtype=bool)
+    if survey is not None:
+        if len(survey) != len(df):
+            raise ValueError(
+                f"Survey design has {len(survey)} rows, the data {len(df)}"
+            )
+        # Weighted least squares as OLS on rows scaled by sqrt(weight)
+        base = base & (survey.weights > 0)
+        root = np.sqrt(survey.weights)[:, None]
+        outcomes, x_all, design = outcomes * root, x_all * root, design * root
+
+    fits = []
+    for observed, indices in _missing_patterns(x_all):
+        selected = base & observed
+        n = int(selected.sum())
+        if n <= min_rows:
+            continue
+        q = _basis(design[selected])
+        y = outcomes[selected]
+        x = x_all[np.ix_(selected, indices)]
+        y_resid = y - q @ (q.T @ y)
+        x_resid = x - q @ (q.T @ x)
+
+        # (exposures x outcomes) cross products
+        sxx = np.einsum("ij,ij->j", x_resid, x_resid)[:, None]
+        sxy = x_resid.T @ y_resid
+        with np.errstate(invalid="ignore", divide="ignore"):
+            beta = sxy / sxx
+            if survey is None:
+                df_resid = n - q.shape[1] - 1
+                rss = np.einsum("ij,ij->j", y_resid, y_resid) - beta * sxy
+                se = np.sqrt(rss / df_resid / sxx)
+            else:
+                # Influence of each row on beta: w x~ e / (x~'W x~)
+                resid = y_resid[:, None, :] - x_resid[:, :, None] * beta
+                scores = x_resid[:, :, None] * resid / sxx
+                df_resid = survey.degrees_of_freedom(selected) - q.shape[1]
+                variance = survey.linearized_variance(scores.reshape(n, -1), selected)
+                se = np.sqrt(variance.reshape(beta.shape))
+            p_value = 2 * stats.t.sf(np.abs(beta / se), df_resid)
+        crit = stats.t.ppf(1 - alpha / 2, df_resid)
+        fits.append(
+            pd.DataFrame(
+                {
+                    "exposure": np.repeat([exposures[j] for j in indices], len(y.T)),
+                    "outcome": np.tile(np.arange(len(y.T)), len(indices)),
+                    "beta": beta.ravel(),
+                    "se": se.ravel(),
+                    "ci_lower": (beta - crit * se).ravel(),
+                    "ci_upper": (beta + crit * se).ravel(),
+                    "p_value": p_value.ravel(),
+                    "n": n,
+                    "df_resid": df_resid,
+                    "order": np.repeat(indices, len(y.T)),
+                }
+            )
+        )
+
+    if not fits:
+        return pd.DataFrame(columns=[*COLUMNS, "outcome"])
+    fits = pd.concat(fits, ignore_index=True)
+    fits = fits.sort_values(["order", "outcome"], kind="stable")
+    return fits.drop(columns="order").reset_index(drop=True)
+
+
+def fit_exposures(
+    df,
+    outcome,
+    exposures,
+    covariates="",
+    required=(),
+    min_rows=50,
+    alpha=0.05,
+    rows=None,
+    survey=None,
+):
+    """
+    OLS of `outcome` on each exposure in turn, adjusted for `covariates`
+
+    Equivalent to smf.ols(f"{outcome} ~ {exposure} + {covariates}", data)
+    fitted on the rows where the outcome, the exposure, the covariates
+    and the `required` columns are all present, for every exposure, and
+    returning the exposure's coefficient, standard error, 1 - alpha
+    confidence interval and p-value (t distribution). Exposures with no
+    more than `min_rows` such rows are left out. `rows` (a boolean mask)
+    restricts the fits to a subgroup.
+
+    With `survey` (a survey.SurveyDesign over the rows of `df`) the fits
+    are design-based instead: weighted least squares on the rows with a
+    positive weight, Taylor-linearized standard errors from the strata
+    and PSUs (a subgroup keeps the whole design), and t tests on the
+    design degrees of freedom less the covariates, as R's svyglm.
+
+    The covariate design is built once; exposures sharing a missing-data
+    pattern share one factorization of it, and each exposure's estimate
+    comes from its and the outcome's residuals on that basis
+    (Frisch-Waugh-Lovell), so thousands of exposures cost a few matrix
+    products. Returns one row per exposure fitted.
+    """
+    fits = _fit(
+        df,
+        df[[outcome]].to_numpy(dtype=np.float64),
+        df[list(exposures)].to_numpy(dtype=np.float64),
+        exposures,
+        covariates,
+        required,
+        min_rows,
+        alpha,
+        rows,
+        survey,
+    )
+    return fits[COLUMNS]
+
+
+def fit_outcomes(
+    df,
+    outcomes,
+    exposures,
+    covariates="",
+    required=(),
+    min_rows=50,
+    alpha=0.05,
+    rows=None,
+    survey=None,
+):
+    """
+    fit_exposures for several outcomes at once
+
+    `outcomes` is a DataFrame of k outcome columns aligned row by row
+    with `df` (e.g. PhenoAge acceleration under k coefficient sets); rows
+    missing any of them are left out. Every outcome shares the covariate
+    factorization and the exposures' residuals, so k outcomes cost about
+    as much as one. Returns one row per exposure and outcome, with the
+    outcome's name in an "outcome" column.
+    """
+    if len(outcomes) != len(df):
+        raise ValueError(f"Outcomes have {len(outcomes)} rows, the data {len(df)}")
+    fits = _fit(
+        df,
+        outcomes.to_numpy(dtype=np.float64),
+        df[list(exposures)].to_numpy(dtype=np.float64),
+        exposures,
+        covariates,
+        required,
+        min_rows,
+        alpha,
+        rows,
+        survey,
+    )
+    fits["outcome"] = np.asarray(outcomes.columns)[fits["outcome"].to_numpy(int)]
+    return fits[["exposure", "outcome", *COLUMNS[1:]]]
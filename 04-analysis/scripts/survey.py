@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Survey Design for PFAS-PhenoAge Study
+NHANES complex-sample design (weights, strata, PSUs) for design-based
+regression: weights rescaled for pooled cycles and Taylor-linearized
+(strata/PSU sandwich) variances from precomputed PSU indices
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# "none" (unweighted OLS, the default) or the weight column of a
+# design-based analysis, see SURVEY_WEIGHTS
+SURVEY_WEIGHT_ENV = "PFAS_SURVEY_WEIGHT"
+DEFAULT_WEIGHT = "none"
+
+# Two-year weights the cohort carries: MEC examination, and PFAS
+# subsample A (the weight NHANES documents for the PFAS lab files)
+SURVEY_WEIGHTS = {"WTMEC2YR": "MEC exam", "WTSA2YR": "PFAS subsample A"}
+
+STRATUM_COLUMN = "SDMVSTRA"
+PSU_COLUMN = "SDMVPSU"
+CYCLE_COLUMN = "cycle"
+
+
+def survey_weight():
+    """Weight column selected by PFAS_SURVEY_WEIGHT, or None for OLS"""
+    setting = os.environ.get(SURVEY_WEIGHT_ENV, DEFAULT_WEIGHT)
+    if setting == DEFAULT_WEIGHT:
+        return None
+    if setting not in SURVEY_WEIGHTS:
+        raise ValueError(
+            f"{SURVEY_WEIGHT_ENV}={setting!r}: expected {DEFAULT_WEIGHT!r} or "
+            f"one of {list(SURVEY_WEIGHTS)}"
+        )
+    return setting
+
+
+def survey_columns(weight=None):
+    """Columns to read for the design of `weight` (default: the selected one)"""
+    weight = weight or survey_weight()
+    if weight is None:
+        return []
+    return [weight, STRATUM_COLUMN, PSU_COLUMN]
+
+
+class SurveyDesign:
+    """
+    Weights, strata and PSUs of the rows of one analysis frame
+
+    Two-year weights are divided by the number of cycles pooled, as NHANES
+    prescribes for combined cycles; rows with a missing weight get weight
+    0 and drop out of every estimate, as do rows without a stratum or
+    PSU. PSUs are numbered within strata once, so a linearized variance
+    is one indicator product per batch of scores rather than a loop over
+    strata and PSUs.
+    """
+
+    def __init__(self, weights, strata, psus, cycles=1):
+        weights = np.asarray(weights, dtype=np.float64)
+        self.weights = np.nan_to_num(weights, nan=0.0) / cycles
+        self.cycles = cycles
+
+        # PSU of each row as (stratum, PSU) pairs, numbered 0..G-1
+        pairs = pd.MultiIndex.from_arrays(
+            [np.asarray(strata, dtype=np.float64), np.asarray(psus, np.float64)]
+        )
+        self.psu, groups = pd.factorize(pairs)
+        self.stratum, _ = pd.factorize(groups.get_level_values(0))
+        self.psu_count = np.bincount(self.stratum)
+
+        known = self.psu >= 0
+        self.weights[~known] = 0.0
+        self._indicator = np.zeros((len(groups), len(weights)))
+        self._indicator[self.psu[known], np.flatnonzero(known)] = 1.0
+        self._strata = np.zeros((len(self.psu_count), len(groups)))
+        self._strata[self.stratum, np.arange(len(groups))] = 1.0
+
+    @classmethod
+    def from_frame(cls, df, weight=None):
+        """Design of `df` under `weight` (default: the selected one), or None"""
+        weight = weight or survey_weight()
+        if weight is None:
+            return None
+        cycles = df[CYCLE_COLUMN].nunique() if CYCLE_COLUMN in df.columns else 1
+        return cls(df[weight], df[STRATUM_COLUMN], df[PSU_COLUMN], max(cycles, 1))
+
+    def __len__(self):
+        return len(self.weights)
+
+    def degrees_of_freedom(self, rows):
+        """PSUs minus strata among `rows` (the design df of a domain)"""
+        psus = np.unique(self.psu[rows])
+        return len(psus) - len(np.unique(self.stratum[psus]))
+
+    def linearized_variance(self, scores, rows):
+        """
+        Taylor-linearized variance of estimators with influence `scores`
+
+        `scores` (n_rows x k, one column per estimator) are the weighted
+        influence values of `rows` (a boolean mask). They are totalled
+        per PSU, centered within strata and summed in squares with the
+        n_h / (n_h - 1) factor, i.e. with-replacement sampling of PSUs.
+        Rows outside `rows` count as zero, so a subgroup analysis keeps
+        every PSU of the design (domain estimation); strata with a single
+        PSU add nothing.
+        """
+        totals = self._indicator[:, rows] @ scores
+        means = (self._strata @ totals) / self.psu_count[:, None]
+        centered = totals - means[self.stratum]
+        count = self.psu_count[self.stratum]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            factor = np.where(count > 1, count / (count - 1), 0.0)
+        return factor @ centered**2